@@ -0,0 +1,438 @@
+"""\
+@file capture.py
+@brief Memory-mapped pcap/pcapng reader for viewer/simulator UDP traffic
+
+$LicenseInfo:firstyear=2024&license=mit$
+
+Copyright (c) 2024, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+"""Streams UDP datagrams out of pcap and pcapng captures and attributes
+them to template messages.
+
+The capture file is memory-mapped and every frame, datagram and payload is
+handed out as a memoryview slice of the mapping, so nothing is copied until
+a packet has to be zero-decoded, and memory use does not grow with the size
+of the capture. Slices are only valid until the generator that produced
+them is advanced or closed.
+
+Supported link types are Ethernet (with 802.1Q tags), BSD loopback, raw IP
+and Linux cooked captures (SLL and SLL2), carrying IPv4 or IPv6. Fragmented
+IP datagrams are skipped.
+"""
+
+from collections import namedtuple
+import mmap
+import struct
+
+from .llmessage import PHL_NAME, lookupNumber, bodyOffset
+from . import zerocode
+
+class CaptureError(Exception):
+    pass
+
+
+# LL packet header flags, from llpacketack.h / net.h
+ZERO_CODE_FLAG = zerocode.ZERO_CODE_FLAG
+RELIABLE_FLAG = 0x40
+RESENT_FLAG = 0x20
+ACK_FLAG = 0x10
+
+# the ports simulators listen on; the viewer side is ephemeral
+DEFAULT_PORTS = frozenset([12035, 12036] + list(range(13000, 13051)))
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LOOP = 108
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+# DLT_RAW has different values on some BSDs; savefiles may carry them
+_RAW_LINKTYPES = (LINKTYPE_RAW, 12, 14, LINKTYPE_IPV4, LINKTYPE_IPV6)
+
+_PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1000),   # microsecond timestamps
+    b'\xa1\xb2\xc3\xd4': ('>', 1000),
+    b'\x4d\x3c\xb2\xa1': ('<', 1),      # nanosecond timestamps
+    b'\xa1\xb2\x3c\x4d': ('>', 1),
+    }
+_PCAPNG_SHB = b'\x0a\x0d\x0d\x0a'
+
+_ETHERTYPE_IPV4 = 0x0800
+_ETHERTYPE_IPV6 = 0x86dd
+_ETHERTYPE_VLAN = (0x8100, 0x88a8, 0x9100)
+_IPPROTO_UDP = 17
+
+_u16be = struct.Struct('>H')
+_u32be = struct.Struct('>I')
+_udpHeader = struct.Struct('>HHH')
+
+Datagram = namedtuple('Datagram', 'timestamp source sport destination dport payload')
+
+
+def _pcapFrames(view, order, nanosPerTick):
+    header = struct.Struct(order + 'IIII')
+    linktype = struct.unpack_from(order + 'I', view, 20)[0] & 0xffff
+    offset = 24
+    end = len(view)
+    while offset + header.size <= end:
+        seconds, fraction, caplen, origlen = header.unpack_from(view, offset)
+        offset += header.size
+        if offset + caplen > end:
+            # a capture cut off mid-record
+            return
+        yield (seconds * 1000000000 + fraction * nanosPerTick, linktype,
+               view[offset:offset + caplen])
+        offset += caplen
+
+def _pcapngTimestampUnits(options, order):
+    """Nanoseconds per timestamp tick from an IDB's if_tsresol option."""
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from(order + 'HH', options, offset)
+        offset += 4
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            resolution = options[offset]
+            if resolution & 0x80:
+                return 1e9 / (1 << (resolution & 0x7f))
+            return 1e9 / (10 ** resolution)
+        offset += (length + 3) & ~3
+    return 1000
+
+def _pcapngFrames(view):
+    end = len(view)
+    offset = 0
+    order = '<'
+    interfaces = [ ]
+    while offset + 12 <= end:
+        if view[offset:offset + 4] == _PCAPNG_SHB:
+            magic = view[offset + 8:offset + 12]
+            if magic == b'\x4d\x3c\x2b\x1a':
+                order = '<'
+            elif magic == b'\x1a\x2b\x3c\x4d':
+                order = '>'
+            else:
+                raise CaptureError("bad pcapng byte-order magic at offset %d" % offset)
+            # interface ids are per section
+            interfaces = [ ]
+        blocktype, length = struct.unpack_from(order + 'II', view, offset)
+        if length < 12 or offset + length > end:
+            return
+        body = offset + 8
+        if blocktype == 1:
+            # Interface Description Block
+            linktype, = struct.unpack_from(order + 'H', view, body)
+            units = _pcapngTimestampUnits(view[body + 8:offset + length - 4], order)
+            interfaces.append((linktype, units))
+        elif blocktype == 6:
+            # Enhanced Packet Block
+            interface, high, low, caplen = struct.unpack_from(order + 'IIII', view, body)
+            try:
+                linktype, units = interfaces[interface]
+            except IndexError:
+                raise CaptureError("packet for undeclared interface %d at offset %d"
+                                   % (interface, offset))
+            data = body + 20
+            yield (int(((high << 32) | low) * units), linktype,
+                   view[data:data + caplen])
+        elif blocktype == 3:
+            # Simple Packet Block: no timestamp, always interface 0
+            if not interfaces:
+                raise CaptureError("packet before any interface at offset %d" % offset)
+            linktype, units = interfaces[0]
+            origlen, = struct.unpack_from(order + 'I', view, body)
+            caplen = min(origlen, length - 16)
+            yield 0, linktype, view[body + 4:body + 4 + caplen]
+        offset += length
+
+def frames(view):
+    """Yields (timestamp in nanoseconds, link type, frame) for each captured
+    frame in view, a buffer holding a whole pcap or pcapng file."""
+    magic = bytes(view[:4])
+    if magic == _PCAPNG_SHB:
+        return _pcapngFrames(view)
+    try:
+        order, nanosPerTick = _PCAP_MAGIC[magic]
+    except KeyError:
+        raise CaptureError("not a pcap or pcapng capture")
+    return _pcapFrames(view, order, nanosPerTick)
+
+
+def _ipPacket(linktype, frame):
+    """Returns the IP packet carried by frame, or None."""
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 12
+        ethertype, = _u16be.unpack_from(frame, offset)
+        while ethertype in _ETHERTYPE_VLAN:
+            offset += 4
+            ethertype, = _u16be.unpack_from(frame, offset)
+        offset += 2
+    elif linktype in _RAW_LINKTYPES:
+        return frame
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        # the address family is in host (NULL) or network (LOOP) byte
+        # order; the IP version nibble is more reliable than either
+        return frame[4:]
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ethertype, = _u16be.unpack_from(frame, 14)
+        offset = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        ethertype, = _u16be.unpack_from(frame, 0)
+        offset = 20
+    else:
+        return None
+    if ethertype not in (_ETHERTYPE_IPV4, _ETHERTYPE_IPV6):
+        return None
+    return frame[offset:]
+
+def _udpDatagram(ip):
+    """Returns (source, sport, destination, dport, payload) for a UDP/IP
+    packet, or None."""
+    if len(ip) < 20:
+        return None
+    version = ip[0] >> 4
+    if version == 4:
+        if ip[9] != _IPPROTO_UDP:
+            return None
+        fragment, = _u16be.unpack_from(ip, 6)
+        if fragment & 0x3fff:
+            # more fragments, or not the first one
+            return None
+        offset = (ip[0] & 0x0f) * 4
+        source, destination = bytes(ip[12:16]), bytes(ip[16:20])
+    elif version == 6:
+        if len(ip) < 48 or ip[6] != _IPPROTO_UDP:
+            return None
+        offset = 40
+        source, destination = bytes(ip[8:24]), bytes(ip[24:40])
+    else:
+        return None
+    try:
+        sport, dport, length = _udpHeader.unpack_from(ip, offset)
+    except struct.error:
+        return None
+    # trust the UDP length over the capture, which may be padded
+    payload = ip[offset + 8:offset + length]
+    if len(payload) != length - 8:
+        # truncated by the snap length
+        return None
+    return source, sport, destination, dport, payload
+
+def datagrams(view, ports=DEFAULT_PORTS):
+    """Yields a Datagram for each UDP datagram in the capture in view that
+    has either port in ports (or every datagram, if ports is None)."""
+    for timestamp, linktype, frame in frames(view):
+        try:
+            ip = _ipPacket(linktype, frame)
+            udp = ip is not None and _udpDatagram(ip)
+        except struct.error:
+            # a frame too short for its own headers
+            continue
+        if not udp:
+            continue
+        source, sport, destination, dport, payload = udp
+        if ports is not None and sport not in ports and dport not in ports:
+            continue
+        yield Datagram(timestamp, source, sport, destination, dport, payload)
+
+class Capture(object):
+    """A memory-mapped capture file; use as a context manager."""
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap refuses empty files
+            self._file.close()
+            raise CaptureError("%s is empty" % filename)
+        self.view = memoryview(self._map)
+
+    def frames(self):
+        return frames(self.view)
+
+    def datagrams(self, ports=DEFAULT_PORTS):
+        return datagrams(self.view, ports)
+
+    def close(self):
+        if self._map is None:
+            return
+        self.view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # a caller still holds a slice; the mapping goes with it
+            pass
+        self._file.close()
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def stripAcks(packet):
+    """Returns (packet without appended acks, number of acks). The ack
+    count is the last byte, preceded by that many 4 byte packet ids."""
+    if not packet[0] & ACK_FLAG:
+        return packet, 0
+    count = packet[-1]
+    end = len(packet) - 1 - 4 * count
+    if end < PHL_NAME:
+        raise CaptureError("%d appended acks don't fit in a %d byte packet"
+                           % (count, len(packet)))
+    return packet[:end], count
+
+
+class MessageStats(object):
+    __slots__ = ('name', 'packets', 'bytes', 'bodyBytes', 'zerocoded',
+                 'zerocodedBytes', 'expandedBytes', 'reliable', 'resent',
+                 'acks', 'errors')
+
+    def __init__(self, name):
+        self.name = name
+        self.packets = 0
+        self.bytes = 0              # UDP payload bytes, as sent
+        self.bodyBytes = 0          # message bytes after zero decoding
+        self.zerocoded = 0
+        self.zerocodedBytes = 0     # wire size of zerocoded packets (no acks)
+        self.expandedBytes = 0      # decoded size of those same packets
+        self.reliable = 0
+        self.resent = 0
+        self.acks = 0
+        self.errors = 0
+
+    @property
+    def averageSize(self):
+        return self.bytes / self.packets if self.packets else 0.0
+
+    @property
+    def zerocodeSavings(self):
+        return self.expandedBytes - self.zerocodedBytes
+
+    def toDict(self):
+        d = dict((k, getattr(self, k)) for k in self.__slots__)
+        d['averageSize'] = self.averageSize
+        d['zerocodeSavings'] = self.zerocodeSavings
+        return d
+
+
+class TrafficStats(object):
+    """Per-message totals for a stream of LL packets. Packets that aren't
+    LL packets, or carry a message number the template doesn't know, are
+    counted under the names in UNPARSEABLE and UNKNOWN."""
+
+    UNPARSEABLE = '<unparseable>'
+    UNKNOWN = '<unknown>'
+
+    def __init__(self, template, codec=None):
+        self.template = template
+        # with a TemplateCodec, message bodies are decoded too
+        self.codec = codec
+        self.messages = { }
+        self.packets = 0
+        self.bytes = 0
+        self.first = None
+        self.last = None
+        self._buffer = bytearray()
+
+    def _stats(self, name):
+        try:
+            return self.messages[name]
+        except KeyError:
+            stats = self.messages[name] = MessageStats(name)
+            return stats
+
+    def add(self, packet, timestamp=None):
+        """Accounts for one UDP payload."""
+        size = len(packet)
+        self.packets += 1
+        self.bytes += size
+        if timestamp is not None:
+            if self.first is None:
+                self.first = timestamp
+            self.last = timestamp
+
+        try:
+            if size <= PHL_NAME:
+                raise CaptureError("%d bytes is too short for a packet" % size)
+            flags = packet[0]
+            packet, acks = stripAcks(packet)
+            if flags & ZERO_CODE_FLAG:
+                buf = self._buffer
+                del buf[:]
+                zerocode.decodePacket(packet, buf)
+            else:
+                buf = packet
+            message, end = lookupNumber(self.template.high, self.template.medium,
+                                        self.template.low, buf, PHL_NAME)
+        except (CaptureError, IndexError):
+            stats = self._stats(self.UNPARSEABLE)
+            stats.packets += 1
+            stats.bytes += size
+            stats.errors += 1
+            return None
+        stats = self._stats(message.name if message else self.UNKNOWN)
+        stats.packets += 1
+        stats.bytes += size
+        stats.acks += acks
+        if flags & RELIABLE_FLAG:
+            stats.reliable += 1
+        if flags & RESENT_FLAG:
+            stats.resent += 1
+        if message is None:
+            stats.errors += 1
+            return None
+        body = bodyOffset(buf, end)
+        stats.bodyBytes += len(buf) - body
+        if flags & ZERO_CODE_FLAG:
+            stats.zerocoded += 1
+            stats.zerocodedBytes += len(packet)
+            stats.expandedBytes += len(buf)
+        if self.codec is not None:
+            try:
+                self.codec.messages[message.name].decode(buf, body)
+            except Exception:
+                stats.errors += 1
+        return message
+
+    def addCapture(self, capture, ports=DEFAULT_PORTS):
+        for datagram in capture.datagrams(ports):
+            self.add(datagram.payload, datagram.timestamp)
+        return self
+
+    @property
+    def duration(self):
+        """Seconds between the first and last packet."""
+        if self.first is None:
+            return 0.0
+        return (self.last - self.first) / 1e9
+
+    def sortedMessages(self, key='bytes'):
+        return sorted(self.messages.values(),
+                      key=lambda s: (getattr(s, key), s.name), reverse=True)
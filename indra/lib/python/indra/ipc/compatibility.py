@@ -39,11 +39,48 @@ S:  I   M   O   N   S
 
 """
 
+from collections import namedtuple
+import json
+from xml.sax.saxutils import quoteattr, escape
+
+# One finding of a compatibility check. level is the class name of the
+# compatibility that produced it; message, block and variable locate it
+# (None where unknown); leadin + reason is the text explain() shows, and
+# detail is the underlying reason when reason only summarizes it.
+Entry = namedtuple('Entry', 'level message block variable reason detail leadin')
+
+def _flatten(node):
+    """Entries are kept as a tree of (left, right) pairs with lists at the
+    leaves, so that combining two compatibilities is O(1). Flatten it,
+    left to right, without recursion."""
+    result = [ ]
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if isinstance(n, list):
+            result.extend(n)
+        else:
+            stack.append(n[1])
+            stack.append(n[0])
+    return result
+
+
 class _Compatibility(object):
-    def __init__(self, reason):
-        self.reasons = [ ]
+    def __init__(self, reason, block=None, variable=None, detail=None):
+        self._entries = [ ]
         if reason:
-            self.reasons.append(reason)
+            self._entries.append(Entry(self.__class__.__name__, None, block,
+                                       variable, reason, detail, ""))
+
+    @property
+    def entries(self):
+        if not isinstance(self._entries, list):
+            self._entries = _flatten(self._entries)
+        return self._entries
+
+    @property
+    def reasons(self):
+        return [e.leadin + e.reason for e in self.entries]
         
     def combine(self, other):
         if self._level() <= other._level():
@@ -51,8 +88,11 @@ class _Compatibility(object):
         else:
             return other._buildclone(self)
     
-    def prefix(self, leadin):
-        self.reasons = [ leadin + r for r in self.reasons ] 
+    def prefix(self, leadin, message=None):
+        self._entries = [
+            e._replace(leadin=leadin + e.leadin,
+                       message=e.message if e.message is not None else message)
+            for e in self.entries ]
     
     def same(self):         return self._level() >=  1
     def deployable(self):   return self._level() >   0
@@ -64,9 +104,9 @@ class _Compatibility(object):
         
     def _buildclone(self, other=None):
         c = self._buildinstance()
-        c.reasons = self.reasons
+        c._entries = self._entries
         if other:
-            c.reasons = c.reasons + other.reasons
+            c._entries = (self._entries, other._entries)
         return c
         
     def _buildinstance(self):
@@ -84,7 +124,7 @@ class Mixed(_Compatibility):
     def __init__(self, *inputs):
         _Compatibility.__init__(self, None)
         for i in inputs:
-            self.reasons += i.reasons
+            self._entries = (self._entries, i._entries)
                     
     def _buildinstance(self):
         return self.__class__()
@@ -119,5 +159,65 @@ class Same(_Compatibility):
         return 1
 
 
-
-
+class Report(object):
+    """Accumulates the per-message results of a template comparison, as
+    passed to Template.compatibleWithBase(base, report), and exports them
+    for CI. Each message is appended once, so building a report is linear
+    in the number of messages and findings."""
+
+    def __init__(self, acceptable=None):
+        # acceptable: the compatibility classes that pass, as in
+        # template_verifier's PRODUCTION_ACCEPTABLE/DEVELOPMENT_ACCEPTABLE
+        self.acceptable = tuple(acceptable or (Same, Newer))
+        self.messages = [ ]
+        self.result = None
+
+    def addMessage(self, name, compatibility):
+        self.messages.append((name, compatibility))
+
+    def finish(self, compatibility):
+        self.result = compatibility
+
+    def passed(self):
+        return type(self.result) in self.acceptable
+
+    def entries(self):
+        """All entries in message order, each with its message set."""
+        result = [ ]
+        for name, c in self.messages:
+            result.extend(e if e.message is not None else e._replace(message=name)
+                          for e in c.entries)
+        return result
+
+    def toDict(self):
+        return {
+            'result': type(self.result).__name__,
+            'passed': self.passed(),
+            'acceptable': [a.__name__ for a in self.acceptable],
+            'messages': len(self.messages),
+            'entries': [dict((k, v) for k, v in e._asdict().items() if k != 'leadin')
+                        for e in self.entries()],
+            }
+
+    def toJSON(self, indent=2):
+        return json.dumps(self.toDict(), indent=indent, sort_keys=True)
+
+    def toJUnit(self, suite='message_template'):
+        """One testcase per compared message; a message fails when its own
+        compatibility isn't acceptable."""
+        cases = [ ]
+        failures = 0
+        for name, c in sorted(self.messages, key=lambda m: m[0]):
+            case = '  <testcase classname=%s name=%s>' % (quoteattr(suite), quoteattr(name))
+            text = "\n".join(c.reasons)
+            if type(c) not in self.acceptable:
+                failures += 1
+                case += '\n    <failure type=%s message=%s>%s</failure>\n  ' % (
+                    quoteattr(type(c).__name__), quoteattr(c.reasons[0] if c.reasons else ""),
+                    escape(text))
+            elif text:
+                case += '\n    <system-out>%s</system-out>\n  ' % escape(text)
+            cases.append(case + '</testcase>')
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<testsuite name=%s tests="%d" failures="%d" errors="0">\n%s\n</testsuite>\n'
+                % (quoteattr(suite), len(self.messages), failures, "\n".join(cases)))
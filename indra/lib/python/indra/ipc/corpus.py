@@ -0,0 +1,226 @@
+"""\
+@file corpus.py
+@brief Synthetic packet corpora generated from a message template
+
+$LicenseInfo:firstyear=2024&license=mit$
+
+Copyright (c) 2024, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+"""Generates reproducible streams of valid packets for load testing the
+message system: every packet has a real header, a message chosen from a
+weighted mix, randomized values within each variable type's range and
+randomized Variable block repeat counts, and is zerocoded when its
+message is Zerocoded (unless that is turned off).
+
+A corpus file is a plain sequence of records, each a 4 byte little-endian
+length followed by that many bytes of packet, exactly as it would arrive
+in a UDP datagram. There is no file header, so files can be concatenated.
+
+To generate millions of packets a minute, each block's instances are
+encoded once up front into a pool of `variants` random encodings, and a
+packet is assembled by picking instances from those pools. Every packet
+gets its own repeat counts and picks, and the sequence number and
+reliable flag vary per packet.
+"""
+
+import random
+import struct
+
+from .llmessage import Message, Block, Variable
+from . import zerocode
+
+RELIABLE_FLAG = 0x40
+
+MAX_PACKET_SIZE = 0x2000        # NET_BUFFER_SIZE
+
+_record = struct.Struct('<I')
+_header = struct.Struct('>BIB')
+
+_integers = {
+    Variable.U8: 1, Variable.U16: 2, Variable.U32: 4, Variable.U64: 8,
+    Variable.S8: 1, Variable.S16: 2, Variable.S32: 4, Variable.S64: 8,
+    Variable.LLUUID: 16, Variable.IPADDR: 4, Variable.IPPORT: 2,
+    }
+
+# struct and number of components
+_floats = {
+    Variable.F32: (struct.Struct('<f'), 1),
+    Variable.F64: (struct.Struct('<d'), 1),
+    Variable.LLVECTOR3: (struct.Struct('<3f'), 3),
+    Variable.LLVECTOR3D: (struct.Struct('<3d'), 3),
+    Variable.LLVECTOR4: (struct.Struct('<4f'), 4),
+    Variable.LLQUATERNION: (struct.Struct('<3f'), 3),
+    }
+
+
+class CorpusGenerator(object):
+    """Generates packets for template. mix maps message names to relative
+    frequencies; by default every message that is still sent over UDP is
+    equally likely."""
+
+    def __init__(self, template, mix=None, zerocoding=True, seed=None,
+                 variants=32, maxRepeats=8, maxVariableBytes=64,
+                 zeroFraction=0.3, reliableFraction=0.5,
+                 maxSize=MAX_PACKET_SIZE):
+        self.template = template
+        self.zerocoding = zerocoding
+        self.variants = variants
+        self.maxRepeats = maxRepeats
+        self.maxVariableBytes = maxVariableBytes
+        self.zeroFraction = zeroFraction
+        self.reliableFraction = reliableFraction
+        self.maxSize = maxSize
+        self.rng = random.Random(seed)
+        self.sequence = 0
+
+        if mix is None:
+            blacklisted = Message.deprecations.index(Message.UDPBLACKLISTED)
+            mix = dict((name, 1) for name, m in template.messages.items()
+                       if m.deprecateLevel < blacklisted)
+        self.names = [ ]
+        self.weights = [ ]
+        for name in sorted(mix):
+            if name not in template.messages:
+                raise KeyError("message %s isn't in the template" % name)
+            if mix[name] > 0:
+                self.names.append(name)
+                self.weights.append(mix[name])
+        if not self.names:
+            raise ValueError("the message mix is empty")
+        self._messages = dict((name, self._compileMessage(template.messages[name]))
+                              for name in self.names)
+
+    def _value(self, variable):
+        """One random encoding of variable."""
+        rng = self.rng
+        t = variable.type
+        if t == Variable.VARIABLE:
+            length = int(variable.size)
+            n = rng.randrange(min(self.maxVariableBytes, (1 << (8 * length)) - 1) + 1)
+            return n.to_bytes(length, 'little') + rng.randbytes(n)
+        if t == Variable.FIXED:
+            n = int(variable.size)
+            return bytes(n) if rng.random() < self.zeroFraction else rng.randbytes(n)
+        if t == Variable.BOOL:
+            return bytes((rng.random() < 0.5,))
+        if t in _integers:
+            n = _integers[t]
+            return bytes(n) if rng.random() < self.zeroFraction else rng.randbytes(n)
+        fmt, components = _floats[t]
+        if rng.random() < self.zeroFraction:
+            return bytes(fmt.size)
+        if t == Variable.LLQUATERNION:
+            # the packed x, y, z of a unit quaternion
+            return fmt.pack(*[rng.uniform(-0.577, 0.577) for i in range(components)])
+        return fmt.pack(*[rng.uniform(-4096.0, 4096.0) for i in range(components)])
+
+    def _compileMessage(self, message):
+        blocks = [ ]
+        for block in message.blocks:
+            pool = [b''.join([self._value(v) for v in block.variables])
+                    for i in range(self.variants)]
+            if block.repeat == Block.MULTIPLE:
+                repeat = int(block.count)
+            elif block.repeat == Block.SINGLE:
+                repeat = 1
+            else:
+                repeat = None
+            blocks.append((pool, repeat))
+        zerocoded = self.zerocoding and message.coding == Message.ZEROCODED
+        return message.encodedNumber(), blocks, zerocoded
+
+    def _body(self, blocks, maxRepeats):
+        rng = self.rng
+        parts = [ ]
+        for pool, repeat in blocks:
+            if repeat is None:
+                n = rng.randint(0, maxRepeats)
+                parts.append(bytes((n,)))
+            else:
+                n = repeat
+            if n == 1:
+                parts.append(rng.choice(pool))
+            elif n:
+                parts.extend(rng.choices(pool, k=n))
+        return parts
+
+    def packet(self, name):
+        """One packet of message name, as bytes."""
+        number, blocks, zerocoded = self._messages[name]
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        flags = RELIABLE_FLAG if self.rng.random() < self.reliableFraction else 0
+        parts = [_header.pack(flags, self.sequence, 0), number]
+        maxRepeats = self.maxRepeats
+        while True:
+            packet = b''.join(parts + self._body(blocks, maxRepeats))
+            if len(packet) <= self.maxSize or maxRepeats == 0:
+                break
+            # too big for the packet buffer: fewer Variable block instances
+            maxRepeats //= 2
+        if zerocoded:
+            packet = zerocode.encodePacket(packet)
+        return packet
+
+    def packets(self, count, batch=4096):
+        """Yields count packets, with messages drawn from the mix."""
+        names, weights, rng = self.names, self.weights, self.rng
+        packet = self.packet
+        while count > 0:
+            n = min(batch, count)
+            for name in rng.choices(names, weights, k=n):
+                yield packet(name)
+            count -= n
+
+    def write(self, f, count):
+        """Writes count length-prefixed packets to the binary file f.
+        Returns the number of bytes written."""
+        written = 0
+        pack = _record.pack
+        chunk = [ ]
+        for packet in self.packets(count):
+            chunk.append(pack(len(packet)))
+            chunk.append(packet)
+            if len(chunk) >= 8192:
+                data = b''.join(chunk)
+                f.write(data)
+                written += len(data)
+                chunk = [ ]
+        data = b''.join(chunk)
+        f.write(data)
+        return written + len(data)
+
+
+def readCorpus(f):
+    """Yields the packets of a corpus file opened in binary mode."""
+    size = _record.size
+    while True:
+        prefix = f.read(size)
+        if not prefix:
+            return
+        if len(prefix) != size:
+            raise EOFError("truncated record length")
+        n, = _record.unpack(prefix)
+        packet = f.read(n)
+        if len(packet) != n:
+            raise EOFError("truncated packet")
+        yield packet
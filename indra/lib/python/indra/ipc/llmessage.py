@@ -27,24 +27,91 @@ $/LicenseInfo$
 """
 
 from .compatibility import Incompatible, Older, Newer, Same
-from .tokenstream import TokenStream
+from .tokenstream import TokenStream, LineTokenStream
+
+###
+### Packet Header
+###
+
+# byte offsets in the packet header, as in message.h
+PHL_FLAGS = 0
+PHL_PACKET_ID = 1
+PHL_OFFSET = 5
+PHL_NAME = 6
+
+def lookupNumber(high, medium, low, buf, offset):
+    """Looks up the frequency-encoded message number at buf[offset] in the
+    dispatch tables. Returns (entry or None, offset past the number)."""
+    try:
+        b = buf[offset]
+        if b != 0xFF:
+            return high[b], offset + 1
+        b = buf[offset + 1]
+        if b != 0xFF:
+            return medium[b], offset + 2
+        return low.get((buf[offset + 2] << 8) | buf[offset + 3]), offset + 4
+    except IndexError:
+        return None, offset
+
+def bodyOffset(buf, numberend):
+    """Offset of the message body: the extra header bytes counted by the
+    offset byte follow the message number."""
+    return numberend + buf[PHL_OFFSET]
+
 
 ###
 ### Message Template
 ###
 
 class Template:
+    fingerprinted = False
+
     def __init__(self):
         self.messages = { }
+        # dispatch tables indexed by the wire message number: dense for
+        # the one byte High and Medium numbers, sparse for Low and Fixed
+        self.high = [ None ] * 256
+        self.medium = [ None ] * 256
+        self.low = { }
     
     def addMessage(self, m):
         self.messages[m.name] = m
+        if self.fingerprinted:
+            m.fingerprint()
+        if m.priority == Message.HIGH:
+            self.high[m.number] = m
+        elif m.priority == Message.MEDIUM:
+            self.medium[m.number] = m
+        else:
+            self.low[m.number & 0xFFFF] = m
+
+    def messageAt(self, buf, offset=PHL_NAME):
+        """Returns (Message, offset past the message number) for the message
+        number encoded at buf[offset], or (None, offset) if there is no such
+        message."""
+        return lookupNumber(self.high, self.medium, self.low, buf, offset)
+
+    def parseHeader(self, packet):
+        """Returns (Message, body offset) for a whole, already zero-decoded
+        packet, given as bytes or memoryview. Message is None if the number
+        is unknown or the packet is too short."""
+        m, end = lookupNumber(self.high, self.medium, self.low, packet, PHL_NAME)
+        if m is None:
+            return None, end
+        return m, bodyOffset(packet, end)
     
-    def compatibleWithBase(self, base):
+    def compatibleWithBase(self, base, report=None):
+        """Returns the combined compatibility of every message. If report
+        (a compatibility.Report) is given, each message's own result is
+        added to it as well."""
         messagenames = (
               frozenset(list(self.messages.keys()))
             | frozenset(list(base.messages.keys()))
             )
+        # computing fingerprints costs about as much as the walk they save,
+        # so only use them when both sides have them already (typically
+        # from template_verifier's parse cache)
+        fingerprinted = self.fingerprinted and base.fingerprinted
             
         compatibility = Same()
         for name in messagenames:
@@ -55,14 +122,34 @@ class Template:
                 c = Older("missing message %s, did you mean to deprecate?" % name)
             elif not basemessage:
                 c = Newer("added message %s" % name)
+            elif (fingerprinted and
+                  selfmessage.fingerprint() == basemessage.fingerprint()):
+                # structurally identical: the full walk could only say Same,
+                # and combining with Same changes nothing
+                if report is not None:
+                    report.addMessage(name, Same())
+                continue
             else:
                 c = selfmessage.compatibleWithBase(basemessage)
-                c.prefix("in message %s: " % name)
-            
+                c.prefix("in message %s: " % name, name)
+
+            if report is not None:
+                report.addMessage(name, c)
             compatibility = compatibility.combine(c)
-        
+
+        if report is not None:
+            report.finish(compatibility)
         return compatibility
 
+    def computeFingerprints(self):
+        """Computes the fingerprint of every message up front, so that a
+        Template saved after calling this can be compared without
+        recomputing them. compatibleWithBase() only skips identical
+        messages once both templates have been fingerprinted."""
+        for m in self.messages.values():
+            m.fingerprint()
+        self.fingerprinted = True
+
 
 
 class Message:
@@ -87,6 +174,8 @@ class Message:
     UDPBLACKLISTED = "UDPBlackListed"
     deprecations = [ NOTDEPRECATED, UDPDEPRECATED, UDPBLACKLISTED, DEPRECATED ]
     # in order of increasing deprecation
+
+    _fingerprint = None
     
     def __init__(self, name, number, priority, trust, coding):
         self.name = name
@@ -100,11 +189,33 @@ class Message:
     def deprecated(self):
         return self.deprecateLevel != 0
 
+    def encodedNumber(self):
+        """The message number as it appears on the wire."""
+        if self.priority == Message.HIGH:
+            return bytes((self.number,))
+        if self.priority == Message.MEDIUM:
+            return bytes((0xFF, self.number))
+        return bytes((0xFF, 0xFF, (self.number >> 8) & 0xFF, self.number & 0xFF))
+
     def deprecate(self, deprecation): 
         self.deprecateLevel = self.deprecations.index(deprecation)
+        self._fingerprint = None
 
     def addBlock(self, block):
         self.blocks.append(block)
+        self._fingerprint = None
+
+    def fingerprint(self):
+        """A hashable structural key holding everything compatibleWithBase()
+        looks at, so messages with equal fingerprints are always Same.
+        Computed once: don't modify a block or variable after fingerprinting
+        its message."""
+        if self._fingerprint is None:
+            self._fingerprint = (
+                self.name, self.priority, self.trust, self.coding,
+                self.number, self.deprecateLevel,
+                tuple([b.fingerprint() for b in self.blocks]))
+        return self._fingerprint
         
     def compatibleWithBase(self, base):
         if self.name != base.name:
@@ -145,10 +256,19 @@ class Message:
         for i in range(0, samelen):
             selfblock = self.blocks[i]
             baseblock = base.blocks[i]
+            # as in Template.compatibleWithBase, only use fingerprints that
+            # both sides have already computed
+            if (selfblock._fingerprint is not None and
+                    selfblock._fingerprint == baseblock._fingerprint):
+                continue
             
             c = selfblock.compatibleWithBase(baseblock)
             if not c.same():
-                c = Incompatible("block %d isn't identical" % i)
+                variables = [e.variable for e in c.entries if e.variable is not None]
+                c = Incompatible("block %d isn't identical" % i, block=i,
+                                 variable=variables[0] if variables else None,
+                                 detail="; ".join(e.detail or e.reason
+                                                  for e in c.entries))
             compatibility = compatibility.combine(c)
         
         if selflen > baselen:
@@ -169,6 +289,8 @@ class Block(object):
     VARIABLE = "Variable"
     repeats = [ SINGLE, MULTIPLE, VARIABLE ]
     repeatswithcount = [ MULTIPLE ]
+
+    _fingerprint = None
     
     def __init__(self, name, repeat, count=None):
         self.name = name
@@ -178,6 +300,14 @@ class Block(object):
 
     def addVariable(self, variable):
         self.variables.append(variable)
+        self._fingerprint = None
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            count = self.count if self.repeat in Block.repeatswithcount else None
+            self._fingerprint = (self.name, self.repeat, count,
+                                 tuple([v.fingerprint() for v in self.variables]))
+        return self._fingerprint
         
     def compatibleWithBase(self, base):
         if self.name != base.name:
@@ -202,7 +332,8 @@ class Block(object):
             
             c = selfvar.compatibleWithBase(basevar)
             if not c.same():
-                c = Incompatible("variable %d isn't identical" % i)
+                c = Incompatible("variable %d isn't identical" % i, variable=i,
+                                 detail="; ".join(c.reasons))
             compatibility = compatibility.combine(c)
 
         if selflen > baselen:
@@ -232,11 +363,19 @@ class Variable:
                 LLVECTOR3, LLVECTOR3D, LLVECTOR4, LLQUATERNION,
                 LLUUID, BOOL, IPADDR, IPPORT, FIXED, VARIABLE ]
     typeswithsize = [ FIXED, VARIABLE ]
+
+    _fingerprint = None
     
     def __init__(self, name, type, size):
         self.name = name
         self.type = type
         self.size = size
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            size = self.size if self.type in Variable.typeswithsize else None
+            self._fingerprint = (self.name, self.type, size)
+        return self._fingerprint
         
     def compatibleWithBase(self, base):
         if self.name != base.name:
@@ -261,23 +400,34 @@ class TemplateParser:
     def __init__(self, tokens):
         self._tokens = tokens
         self._version = 0
+        self.version = None     # as declared in the template, if it is
         self._numbers = { }
         for p in Message.priorities:
             self._numbers[p] = 0
 
     def parseTemplate(self):
-        tokens = self._tokens
         t = Template()
+        for m in self.iterMessages():
+            t.addMessage(m)
+        if self.version is not None:
+            t.version = self.version
+        return t
+
+    def iterMessages(self):
+        """Parses the template, yielding each Message as soon as its closing
+        brace has been read. With a LineTokenStream, nothing past that brace
+        has been read from the input yet."""
+        tokens = self._tokens
         while True:
             if tokens.want("version"):
                 v = float(tokens.require(tokens.wantFloat()))
                 self._version = v
-                t.version = v
+                self.version = v
                 continue
     
             m = self.parseMessage()
             if m:
-                t.addMessage(m)
+                yield m
                 continue
             
             if self._version >= 2.0:
@@ -290,7 +440,6 @@ class TemplateParser:
                 tokens.consume()
                     # just assume (gulp) that this is a comment
                     # line 468: "sim -> dataserver"
-        return t                
 
 
     def parseMessage(self):
@@ -369,4 +518,12 @@ def parseTemplateString(s):
     return TemplateParser(TokenStream().fromString(s)).parseTemplate()
 
 def parseTemplateFile(f):
-    return TemplateParser(TokenStream().fromFile(f)).parseTemplate()
+    """Parses a template from f, any iterator of str or UTF-8 bytes lines,
+    lexing lines only as the parser reaches them."""
+    return TemplateParser(LineTokenStream(f)).parseTemplate()
+
+def iterTemplateFile(f):
+    """Yields the Messages of the template read from f (such as an open
+    file, a pipe or socket.makefile()), each one as soon as its closing
+    brace has been read, so memory stays proportional to one message."""
+    return TemplateParser(LineTokenStream(f)).iterMessages()
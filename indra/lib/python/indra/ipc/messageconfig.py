@@ -0,0 +1,203 @@
+"""\
+@file messageconfig.py
+@brief Joins etc/message.xml routing with the message template
+
+$LicenseInfo:firstyear=2024&license=mit$
+
+Copyright (c) 2024, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+"""etc/message.xml says how each message travels: its flavor (template,
+meaning UDP, or llsd, meaning HTTP) and whether it must come from a trusted
+sender. The message template says what the message contains. MessageModel
+joins the two into one MessageInfo per message, indexed by name, flavor
+and priority, and checkConsistency() looks for places where they disagree,
+following LLMessageConfig's reading of the file: a message without a
+flavor of its own uses the server's default.
+"""
+
+from collections import namedtuple
+import xml.etree.ElementTree as ElementTree
+
+from .llmessage import Message
+
+class ConfigError(Exception):
+    pass
+
+
+TEMPLATE_FLAVOR = 'template'
+LLSD_FLAVOR = 'llsd'
+flavors = [ TEMPLATE_FLAVOR, LLSD_FLAVOR ]
+
+DEFAULT_SERVER = 'simulator'
+
+def _llsdValue(element):
+    tag = element.tag
+    if tag == 'map':
+        children = list(element)
+        result = { }
+        for key, value in zip(children[::2], children[1::2]):
+            if key.tag != 'key':
+                raise ConfigError("expected <key> in <map>, got <%s>" % key.tag)
+            result[key.text or ''] = _llsdValue(value)
+        return result
+    if tag == 'array':
+        return [_llsdValue(child) for child in element]
+    text = (element.text or '').strip()
+    if tag == 'string':
+        return element.text or ''
+    if tag == 'boolean':
+        return text.lower() in ('1', 'true')
+    if tag == 'integer':
+        return int(text or 0)
+    if tag == 'real':
+        return float(text or 0)
+    if tag == 'undef':
+        return None
+    raise ConfigError("unsupported LLSD element <%s>" % tag)
+
+def parseLLSDXML(data):
+    """Parses the subset of LLSD XML that message.xml uses (maps, arrays,
+    strings, booleans and numbers) into Python values."""
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError as e:
+        raise ConfigError(str(e))
+    if root.tag != 'llsd' or len(root) != 1:
+        raise ConfigError("expected a single value inside <llsd>")
+    return _llsdValue(root[0])
+
+
+class MessageConfig(object):
+    """The contents of a message.xml file."""
+    def __init__(self, llsd):
+        self.serverDefaults = llsd.get('serverDefaults', { })
+        self.messages = llsd.get('messages', { })
+        self.capBans = llsd.get('capBans', { })
+        self.messageBans = llsd.get('messageBans', { })
+        self.maxQueuedEvents = llsd.get('maxQueuedEvents')
+
+    def serverDefault(self, server=DEFAULT_SERVER):
+        return self.serverDefaults.get(server)
+
+def parseMessageConfigString(s):
+    return MessageConfig(parseLLSDXML(s))
+
+def parseMessageConfigFile(f):
+    return MessageConfig(parseLLSDXML(f.read()))
+
+
+class MessageInfo(namedtuple('MessageInfo',
+                             'name message config flavor trustedSender')):
+    """Everything known about one message. message is the template's
+    Message (or None), config its message.xml entry (or None), flavor the
+    effective flavor and trustedSender True, False or None if unset."""
+
+    @property
+    def priority(self):
+        return self.message.priority if self.message else None
+
+    @property
+    def deprecation(self):
+        if self.message is None:
+            return None
+        return self.message.deprecations[self.message.deprecateLevel]
+
+    @property
+    def onlySendLatest(self):
+        return bool(self.config and self.config.get('only-send-latest'))
+
+
+class MessageModel(object):
+    def __init__(self, template, config, server=DEFAULT_SERVER):
+        self.template = template
+        self.config = config
+        self.server = server
+        self.defaultFlavor = config.serverDefault(server)
+        self.messages = { }
+        self.byFlavor = { }
+        self.byPriority = { }
+        for name in set(template.messages) | set(config.messages):
+            entry = config.messages.get(name)
+            if not isinstance(entry, dict):
+                entry = None
+            flavor = entry.get('flavor') if entry else None
+            trusted = entry.get('trusted-sender') if entry else None
+            info = MessageInfo(name, template.messages.get(name), entry,
+                               flavor or self.defaultFlavor, trusted)
+            self.messages[name] = info
+            self.byFlavor.setdefault(info.flavor, [ ]).append(info)
+            self.byPriority.setdefault(info.priority, [ ]).append(info)
+
+    def __getitem__(self, name):
+        return self.messages[name]
+
+    def __contains__(self, name):
+        return name in self.messages
+
+    def messageAt(self, buf, offset):
+        """Like Template.messageAt(), but returns the MessageInfo."""
+        message, end = self.template.messageAt(buf, offset)
+        return (message and self.messages[message.name]), end
+
+
+_UDP_BLACKLISTED = Message.deprecations.index(Message.UDPBLACKLISTED)
+
+Issue = namedtuple('Issue', 'severity name reason')
+ERROR = 'error'
+WARNING = 'warning'
+
+def checkConsistency(model):
+    """Returns a list of Issues, sorted by message name."""
+    issues = [ ]
+    for name, info in model.messages.items():
+        entry, message = info.config, info.message
+        explicit = entry.get('flavor') if entry else None
+        if explicit is not None and explicit not in flavors:
+            issues.append(Issue(ERROR, name, "unknown flavor %r" % explicit))
+            continue
+        if message is None:
+            if explicit == TEMPLATE_FLAVOR:
+                issues.append(Issue(ERROR, name,
+                                    "routed as template but not in the template"))
+            continue
+        if info.flavor == LLSD_FLAVOR and message.priority == Message.HIGH:
+            issues.append(Issue(WARNING, name,
+                                "llsd flavored but still High frequency in the template"))
+        if info.flavor == TEMPLATE_FLAVOR:
+            # Deprecated messages aren't sent at all, so routing them is
+            # only stale; UDPBlackListed ones would be dropped on arrival
+            if message.deprecateLevel == _UDP_BLACKLISTED:
+                issues.append(Issue(ERROR, name, "%s but still routed as template"
+                                    % info.deprecation))
+            elif message.deprecateLevel != 0:
+                issues.append(Issue(WARNING, name, "%s but still routed as template"
+                                    % info.deprecation))
+        # trusted-sender false is normal for Trusted messages that simulators
+        # forward to viewers; the reverse lets untrusted circuits send over
+        # UDP what HTTP only takes from trusted senders
+        if info.trustedSender and message.trust != Message.TRUSTED:
+            issues.append(Issue(ERROR, name,
+                                "trusted-sender is true but the template says %s"
+                                % message.trust))
+    issues.sort(key=lambda i: (i.name, i.reason))
+    return issues
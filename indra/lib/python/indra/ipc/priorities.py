@@ -0,0 +1,200 @@
+"""\
+@file priorities.py
+@brief Plan moves of busy messages to shorter message number bands
+
+$LicenseInfo:firstyear=2024&license=mit$
+
+Copyright (c) 2024, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+"""A message's priority decides how many bytes its number takes in every
+packet: 1 for High, 2 for Medium and 4 for Low and Fixed. Given how often
+each message is sent, planPromotions() picks the messages to move into the
+unused numbers of the shorter bands so as to save the most header bytes.
+
+Changing the priority or number of an existing message is always
+Incompatible, so a move is written as a new message with the same blocks
+in the shorter band, under a new name, while the original is marked
+Deprecated. Both are Newer changes, so the result passes compatibleWithBase
+in development mode; code sending the message has to switch to the new
+name before the old one can be removed.
+"""
+
+from collections import namedtuple
+import re
+
+from .llmessage import Message, parseTemplateString
+
+HEADER_SIZES = {
+    Message.HIGH: 1,
+    Message.MEDIUM: 2,
+    Message.LOW: 4,
+    Message.FIXED: 4,
+    }
+
+# 0xFF escapes to the next band, and Low numbers from 0xFF00 up would
+# collide with the Fixed messages
+NUMBER_RANGES = {
+    Message.HIGH: range(1, 0xFF),
+    Message.MEDIUM: range(1, 0xFF),
+    Message.LOW: range(1, 0xFF00),
+    }
+
+DEFAULT_NAME_FORMAT = '{name}{priority}'
+
+Promotion = namedtuple('Promotion', 'name count priority target number newname savings')
+
+
+def freeNumbers(template, priority):
+    """The unused message numbers of a band, in increasing order."""
+    used = set(m.number for m in template.messages.values()
+               if m.priority == priority)
+    return [n for n in NUMBER_RANGES[priority] if n not in used]
+
+def headerBytes(template, counts):
+    """Bytes spent on message numbers for the given per-message counts."""
+    total = 0
+    for name, count in counts.items():
+        m = template.messages.get(name)
+        if m is not None:
+            total += count * HEADER_SIZES[m.priority]
+    return total
+
+def _prefixSums(values):
+    sums = [0]
+    for v in values:
+        sums.append(sums[-1] + v)
+    return sums
+
+def planPromotions(template, counts, minCount=1, exclude=(),
+                   nameFormat=DEFAULT_NAME_FORMAT):
+    """Returns the list of Promotions that saves the most header bytes for
+    counts (a dict of message name to packets sent) using only the free
+    numbers of the High and Medium bands. Deprecated and Fixed messages,
+    names in exclude and messages sent fewer than minCount times stay put.
+    """
+    candidates = {Message.MEDIUM: [ ], Message.LOW: [ ]}
+    for name, count in counts.items():
+        message = template.messages.get(name)
+        if (message is None or count < minCount or name in exclude
+            or message.deprecated() or message.priority not in candidates):
+            continue
+        candidates[message.priority].append((count, name))
+    for band in candidates.values():
+        band.sort(key=lambda c: (-c[0], c[1]))
+    low = candidates[Message.LOW]
+    medium = candidates[Message.MEDIUM]
+    highFree = freeNumbers(template, Message.HIGH)
+    mediumFree = freeNumbers(template, Message.MEDIUM)
+    h, m = len(highFree), len(mediumFree)
+
+    # The busiest k Low messages go to High, the next m to Medium, and High's
+    # remaining slots go to the busiest Medium messages; exchanging any two
+    # of those choices can't do better, so trying every k finds the optimum.
+    lowSums = _prefixSums(c for c, n in low)
+    mediumSums = _prefixSums(c for c, n in medium)
+    def total(k):
+        lowToMedium = min(len(low), k + m)
+        return (3 * lowSums[k]
+                + 2 * (lowSums[lowToMedium] - lowSums[k])
+                + mediumSums[min(len(medium), h - k)])
+    best = max(range(min(h, len(low)) + 1), key=lambda k: (total(k), -k))
+
+    moves = ([(c, n, Message.HIGH) for c, n in low[:best]]
+             + [(c, n, Message.HIGH) for c, n in medium[:h - best]]
+             + [(c, n, Message.MEDIUM) for c, n in low[best:best + m]])
+    numbers = {Message.HIGH: iter(highFree), Message.MEDIUM: iter(mediumFree)}
+    promotions = [ ]
+    for count, name, target in sorted(moves, key=lambda c: (-c[0], c[1])):
+        priority = template.messages[name].priority
+        newname = nameFormat.format(name=name, priority=target)
+        if newname in template.messages:
+            raise ValueError("can't rename %s to %s: the name is taken"
+                             % (name, newname))
+        promotions.append(Promotion(
+            name, count, priority, target, next(numbers[target]), newname,
+            count * (HEADER_SIZES[priority] - HEADER_SIZES[target])))
+    return promotions
+
+
+_headerRE = re.compile(r'^([ \t]*)(\w+)[ \t]+(High|Medium|Low|Fixed)[ \t]+(\S+)'
+                       r'[ \t]+(\S+)[ \t]+(\S+)(?:[ \t]+[A-Za-z]+)?[ \t]*$')
+
+def _code(line):
+    return line.split('//')[0].rstrip()
+
+def _messageHeaders(lines):
+    """Maps each message name to the index of its header line."""
+    headers = { }
+    for i, line in enumerate(lines):
+        m = _headerRE.match(_code(line))
+        if m:
+            headers[m.group(2)] = i
+    return headers
+
+def _messageExtent(lines, name, header):
+    """Returns the (first, last) line indices of the message whose header
+    is lines[header], from its opening to its closing brace."""
+    first = header - 1
+    while first >= 0 and not _code(lines[first]).strip():
+        first -= 1
+    if first < 0 or _code(lines[first]).strip() != '{':
+        raise ValueError("can't find the start of message %s" % name)
+    depth = 0
+    for last in range(first, len(lines)):
+        code = _code(lines[last])
+        depth += code.count('{') - code.count('}')
+        if depth == 0:
+            return first, last
+    raise ValueError("can't find the end of message %s" % name)
+
+def applyPromotions(text, promotions, deprecation=Message.DEPRECATED):
+    """Rewrites template text: each promoted message is marked with
+    deprecation, and followed by its replacement in the new band."""
+    lines = text.splitlines(True)
+    headers = _messageHeaders(lines)
+    try:
+        edits = sorted(((headers[p.name], p) for p in promotions),
+                       key=lambda e: e[0], reverse=True)
+    except KeyError as e:
+        raise ValueError("message %s isn't in the template text" % e)
+    # bottom up, so that inserting doesn't move the lines still to edit
+    for header, p in edits:
+        first, last = _messageExtent(lines, p.name, header)
+        indent, name, priority, number, trust, coding = \
+                _headerRE.match(_code(lines[header])).groups()
+        copy = lines[first:last + 1]
+        copy[header - first] = '%s%s %s %d %s %s\n' % (
+            indent, p.newname, p.target, p.number, trust, coding)
+        if not copy[-1].endswith('\n'):
+            copy[-1] += '\n'
+        lines[header] = '%s%s %s %s %s %s %s\n' % (
+            indent, name, priority, number, trust, coding, deprecation)
+        lines[last + 1:last + 1] = ['\n', '// %s moved to %s frequency as %s\n'
+                                    % (p.name, p.target, p.newname)] + copy
+    return ''.join(lines)
+
+def checkPromotions(baseText, newText):
+    """Parses both texts and returns the new template's compatibility with
+    the base."""
+    return parseTemplateString(newText).compatibleWithBase(
+        parseTemplateString(baseText))
@@ -0,0 +1,340 @@
+"""\
+@file templatecodec.py
+@brief Binary encoders and decoders compiled from a message template
+
+$LicenseInfo:firstyear=2024&license=mit$
+
+Copyright (c) 2024, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+"""Compiles a parsed llmessage.Template into per-message codecs for the
+message body, i.e. everything after the packet header and message number.
+
+A decoded message is a dict mapping each block name to a list of block
+instances, and each instance is a dict mapping variable names to values.
+Single blocks decode to a one-element list; encode() also accepts a bare
+dict for them. Values are laid out as LLTemplateMessageBuilder writes them:
+
+    U8..S64, F32, F64   int or float (little-endian on the wire)
+    BOOL                bool
+    LLVector3/3d/4      tuple of floats
+    LLQuaternion        tuple of 3 floats (the packed x, y, z form)
+    LLUUID, IPADDR      raw bytes (16 and 4 bytes, network order for IPADDR)
+    IPPORT              int (big-endian on the wire)
+    Fixed, Variable     raw bytes
+
+Runs of fixed-size variables are packed into one precomputed struct.Struct,
+and repeated blocks made only of fixed-size variables are decoded with
+Struct.iter_unpack.
+"""
+
+from operator import itemgetter
+import struct
+
+from .llmessage import Block, Variable, PHL_NAME, lookupNumber, bodyOffset
+
+class CodecError(Exception):
+    pass
+
+
+def _swap16(v):
+    return ((v & 0xff) << 8) | (v >> 8)
+
+# struct format and number of struct items per fixed-size variable type
+_formats = {
+    Variable.U8: ('B', 1),  Variable.U16: ('H', 1),
+    Variable.U32: ('I', 1), Variable.U64: ('Q', 1),
+    Variable.S8: ('b', 1),  Variable.S16: ('h', 1),
+    Variable.S32: ('i', 1), Variable.S64: ('q', 1),
+    Variable.F32: ('f', 1), Variable.F64: ('d', 1),
+    Variable.LLVECTOR3: ('3f', 3), Variable.LLVECTOR3D: ('3d', 3),
+    Variable.LLVECTOR4: ('4f', 4), Variable.LLQUATERNION: ('3f', 3),
+    Variable.LLUUID: ('16s', 1), Variable.BOOL: ('?', 1),
+    Variable.IPADDR: ('4s', 1), Variable.IPPORT: ('H', 1),
+    }
+
+# per-type conversion applied to the struct item, in both directions
+_converters = {
+    Variable.IPPORT: _swap16,
+    }
+
+_lengthStructs = {
+    1: struct.Struct('<B'),
+    2: struct.Struct('<H'),
+    4: struct.Struct('<I'),
+    }
+
+_countStruct = _lengthStructs[1]
+
+
+class _FixedRun(object):
+    """A run of consecutive fixed-size variables packed with one Struct."""
+    def __init__(self, variables):
+        fmt = ['<']
+        self.names = [ ]
+        self.fields = [ ]
+        index = 0
+        for v in variables:
+            if v.type == Variable.FIXED:
+                code, width = '%ds' % int(v.size), 1
+            else:
+                code, width = _formats[v.type]
+            fmt.append(code)
+            self.names.append(v.name)
+            self.fields.append((v.name, index, width, _converters.get(v.type)))
+            index += width
+        self.struct = struct.Struct(''.join(fmt))
+        self.size = self.struct.size
+        # the common case: one struct item per variable, no conversion
+        self.simple = all(width == 1 and convert is None
+                          for name, index, width, convert in self.fields)
+        if len(self.names) == 1:
+            name = self.names[0]
+            self.getter = lambda values: (values[name],)
+        else:
+            self.getter = itemgetter(*self.names)
+
+    def unpack(self, items, values):
+        if self.simple:
+            values.update(zip(self.names, items))
+            return
+        for name, index, width, convert in self.fields:
+            if width > 1:
+                values[name] = items[index:index + width]
+            elif convert:
+                values[name] = convert(items[index])
+            else:
+                values[name] = items[index]
+
+    def decode(self, buf, offset, values):
+        try:
+            items = self.struct.unpack_from(buf, offset)
+        except struct.error:
+            raise CodecError("ran off end of packet reading %s at offset %d"
+                             % (", ".join(self.names), offset))
+        self.unpack(items, values)
+        return offset + self.size
+
+    def pack(self, values):
+        try:
+            if self.simple:
+                return self.struct.pack(*self.getter(values))
+            items = [ ]
+            for name, index, width, convert in self.fields:
+                value = values[name]
+                if width > 1:
+                    items.extend(value)
+                elif convert:
+                    items.append(convert(value))
+                else:
+                    items.append(value)
+            return self.struct.pack(*items)
+        except KeyError as e:
+            raise CodecError("missing variable %s" % e)
+        except struct.error as e:
+            raise CodecError("can't pack %s: %s" % (", ".join(self.names), e))
+
+
+class _VariableField(object):
+    """A Variable-typed variable: a little-endian length, then the data."""
+    def __init__(self, variable):
+        self.name = variable.name
+        self.length = _lengthStructs[int(variable.size)]
+        self.maximum = (1 << (8 * self.length.size)) - 1
+
+    def decode(self, buf, offset, values):
+        try:
+            n, = self.length.unpack_from(buf, offset)
+        except struct.error:
+            raise CodecError("ran off end of packet reading length of %s"
+                             % self.name)
+        offset += self.length.size
+        end = offset + n
+        if end > len(buf):
+            raise CodecError("ran off end of packet reading %d bytes of %s"
+                             % (n, self.name))
+        values[self.name] = bytes(buf[offset:end])
+        return end
+
+    def pack(self, values):
+        try:
+            data = values[self.name]
+        except KeyError as e:
+            raise CodecError("missing variable %s" % e)
+        if len(data) > self.maximum:
+            raise CodecError("%s is %d bytes, more than its length field allows"
+                             % (self.name, len(data)))
+        return self.length.pack(len(data)) + bytes(data)
+
+
+class BlockCodec(object):
+    def __init__(self, block):
+        self.name = block.name
+        self.repeat = block.repeat
+        self.count = block.count
+        self.segments = [ ]
+        run = [ ]
+        for v in block.variables:
+            if v.type == Variable.VARIABLE:
+                if run:
+                    self.segments.append(_FixedRun(run))
+                    run = [ ]
+                self.segments.append(_VariableField(v))
+            else:
+                run.append(v)
+        if run:
+            self.segments.append(_FixedRun(run))
+        # a block with only fixed-size variables has a single layout
+        if len(self.segments) == 1 and isinstance(self.segments[0], _FixedRun):
+            self.fixed = self.segments[0]
+        else:
+            self.fixed = None
+
+    def decode(self, buf, offset):
+        """Returns (list of block instances, offset past the block)."""
+        if self.repeat == Block.SINGLE:
+            count = 1
+        elif self.repeat == Block.MULTIPLE:
+            count = self.count
+        elif offset >= len(buf):
+            # missing Variable blocks at the end of a message are legal
+            return [ ], offset
+        else:
+            count = buf[offset]
+            offset += 1
+
+        fixed = self.fixed
+        if fixed is not None:
+            end = offset + count * fixed.size
+            if end > len(buf):
+                raise CodecError("ran off end of packet in block %s" % self.name)
+            if fixed.simple:
+                names = fixed.names
+                instances = [dict(zip(names, items)) for items in
+                             fixed.struct.iter_unpack(buf[offset:end])]
+            else:
+                instances = [ ]
+                for items in fixed.struct.iter_unpack(buf[offset:end]):
+                    values = { }
+                    fixed.unpack(items, values)
+                    instances.append(values)
+            return instances, end
+
+        instances = [ ]
+        for i in range(count):
+            values = { }
+            for segment in self.segments:
+                offset = segment.decode(buf, offset, values)
+            instances.append(values)
+        return instances, offset
+
+    def encode(self, instances, out):
+        """Appends the encoding of instances to the list of chunks out."""
+        if isinstance(instances, dict):
+            instances = [instances]
+        elif instances is None:
+            instances = [ ]
+        n = len(instances)
+        if self.repeat == Block.VARIABLE:
+            if n > 255:
+                raise CodecError("block %s has %d instances, at most 255 allowed"
+                                 % (self.name, n))
+            out.append(_countStruct.pack(n))
+        else:
+            expected = 1 if self.repeat == Block.SINGLE else self.count
+            if n != expected:
+                raise CodecError("block %s needs %d instances, got %d"
+                                 % (self.name, expected, n))
+        segments = self.segments
+        for values in instances:
+            for segment in segments:
+                out.append(segment.pack(values))
+
+
+class MessageCodec(object):
+    def __init__(self, message):
+        self.message = message
+        self.name = message.name
+        self.blocks = [BlockCodec(b) for b in message.blocks]
+
+    def decodeFrom(self, buf, offset=0):
+        """Decodes the message body starting at offset in buf, which may be
+        bytes, bytearray or memoryview. Returns (message dict, offset just
+        past the body)."""
+        result = { }
+        for block in self.blocks:
+            result[block.name], offset = block.decode(buf, offset)
+        return result, offset
+
+    def decode(self, buf, offset=0):
+        return self.decodeFrom(buf, offset)[0]
+
+    def encode(self, data):
+        """Returns the message body for data as bytes."""
+        out = [ ]
+        for block in self.blocks:
+            try:
+                instances = data[block.name]
+            except KeyError:
+                if block.repeat != Block.VARIABLE:
+                    raise CodecError("message %s is missing block %s"
+                                     % (self.name, block.name))
+                instances = None
+            block.encode(instances, out)
+        return b''.join(out)
+
+
+class TemplateCodec(object):
+    def __init__(self, template):
+        self.template = template
+        self.messages = { }
+        for name, message in template.messages.items():
+            self.messages[name] = MessageCodec(message)
+        # the Template's dispatch tables, mapped to codecs
+        def codec(m):
+            return m and self.messages[m.name]
+        self.high = [codec(m) for m in template.high]
+        self.medium = [codec(m) for m in template.medium]
+        self.low = dict((k, codec(m)) for k, m in template.low.items())
+
+    def codecAt(self, buf, offset=PHL_NAME):
+        """Like Template.messageAt(), but returns the MessageCodec."""
+        return lookupNumber(self.high, self.medium, self.low, buf, offset)
+
+    def decodePacket(self, packet):
+        """Decodes a whole packet that has already been zero-decoded and
+        had any appended acks stripped. Returns (MessageCodec, message
+        dict), or (None, None) for an unknown message number."""
+        codec, end = lookupNumber(self.high, self.medium, self.low, packet, PHL_NAME)
+        if codec is None:
+            return None, None
+        return codec, codec.decode(packet, bodyOffset(packet, end))
+
+    def decode(self, name, buf, offset=0):
+        return self.messages[name].decode(buf, offset)
+
+    def encode(self, name, data):
+        return self.messages[name].encode(data)
+
+
+def compileTemplate(template):
+    return TemplateCodec(template)
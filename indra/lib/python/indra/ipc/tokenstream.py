@@ -33,9 +33,6 @@ class _EOF(object):
 
 EOF = _EOF()
 
-class _LineMarker(int):
-    pass
-    
 _commentRE = re.compile(r'//.*')
 _symbolRE = re.compile(r'[a-zA-Z_][a-zA-Z_0-9]*')
 _integerRE = re.compile(r'(0x[0-9A-Fa-f]+|0\d*|[1-9]\d*)')
@@ -49,12 +46,7 @@ class ParseError(Exception):
         self.reason = reason
 
     def _contextString(self):    
-        c = [ ]
-        for t in self.context:
-            if isinstance(t, _LineMarker):
-                break
-            c.append(t)
-        return " ".join(c)
+        return " ".join(self.context)
 
     def __str__(self):
         return "line %d: %s @ ... %s" % (
@@ -72,9 +64,15 @@ def _optionText(options):
 
 
 class TokenStream(object):
+    """Lexes the whole input up front into parallel token and line arrays,
+    then walks them with an index cursor, so peek() and consume() are O(1)
+    no matter how large the template is."""
+
     def __init__(self):
-        self.line = 0
         self.tokens = [ ]
+        self.lines = [ ]
+        self._pos = 0
+        self._lastLine = 0
     
     def fromString(self, string):
         return self.fromLines(string.split('\n'))
@@ -83,29 +81,36 @@ class TokenStream(object):
         return self.fromLines(file)
 
     def fromLines(self, lines):
-        i = 0
+        tokens = self.tokens
+        tokenlines = self.lines
+        i = self._lastLine
         for line in lines:
             i += 1
-            self.tokens.append(_LineMarker(i))
-            self.tokens.extend(_commentRE.sub(" ", line).split())
-        self._consumeLines()
+            for t in _commentRE.sub(" ", line).split():
+                tokens.append(t)
+                tokenlines.append(i)
+        self._lastLine = i
         return self
+
+    @property
+    def line(self):
+        """Line number of the next token, or of the last line once the
+        stream is exhausted."""
+        if self._pos < len(self.tokens):
+            return self.lines[self._pos]
+        return self._lastLine
     
     def consume(self):
-        if not self.tokens:
+        pos = self._pos
+        if pos >= len(self.tokens):
             return EOF
-        t = self.tokens.pop(0)
-        self._consumeLines()
-        return t
-    
-    def _consumeLines(self):
-        while self.tokens and isinstance(self.tokens[0], _LineMarker):
-            self.line = self.tokens.pop(0)
+        self._pos = pos + 1
+        return self.tokens[pos]
     
     def peek(self):
-        if not self.tokens:
+        if self._pos >= len(self.tokens):
             return EOF
-        return self.tokens[0]
+        return self.tokens[self._pos]
             
     def want(self, t):
         if t == self.peek():
@@ -141,8 +146,14 @@ class TokenStream(object):
         return self.wantRE(_floatRE, "expected float")
     
     def _context(self):
-        n = min(5, len(self.tokens))
-        return self.tokens[0:n]
+        # up to five upcoming tokens, stopping at the end of the current line
+        start = self._pos
+        end = min(start + 5, len(self.tokens))
+        lines = self.lines
+        i = start
+        while i < end and lines[i] == lines[start]:
+            i += 1
+        return self.tokens[start:i]
 
     def require(self, t):
         if t:
@@ -152,3 +163,62 @@ class TokenStream(object):
         else:
             raise ParseError(self, "unmet requirement")
 
+
+class LineTokenStream(TokenStream):
+    """A TokenStream that lexes lines from an iterator only as the parser
+    asks for tokens, and forgets each line's tokens once they have all
+    been consumed, so memory stays proportional to one line however long
+    the input is. Lines may be str or UTF-8 bytes, so a file, pipe or
+    socket.makefile() can be parsed while it is still arriving."""
+
+    def __init__(self, lines):
+        TokenStream.__init__(self)
+        self._source = iter(lines)
+
+    def fromString(self, string):
+        raise TypeError("LineTokenStream reads from the iterator it was given")
+
+    fromFile = fromLines = fromString
+
+    def _fill(self):
+        """Makes sure there is an unconsumed token, unless the input is
+        exhausted. Returns False at the end of the input."""
+        while self._pos >= len(self.tokens):
+            if self._source is None:
+                return False
+            try:
+                line = next(self._source)
+            except StopIteration:
+                self._source = None
+                return False
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            self._lastLine += 1
+            tokens = _commentRE.sub(" ", line).split()
+            if tokens:
+                self.tokens = tokens
+                self.lines = [self._lastLine] * len(tokens)
+                self._pos = 0
+        return True
+
+    @property
+    def line(self):
+        if self._fill():
+            return self.lines[self._pos]
+        return self._lastLine
+
+    def consume(self):
+        if not self._fill():
+            return EOF
+        pos = self._pos
+        self._pos = pos + 1
+        return self.tokens[pos]
+
+    def peek(self):
+        if not self._fill():
+            return EOF
+        return self.tokens[self._pos]
+
+    def _context(self):
+        self._fill()
+        return TokenStream._context(self)
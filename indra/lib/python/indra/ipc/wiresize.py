@@ -0,0 +1,186 @@
+"""\
+@file wiresize.py
+@brief Static encoded size bounds for template messages
+
+$LicenseInfo:firstyear=2024&license=mit$
+
+Copyright (c) 2024, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+"""Works out the smallest, typical and largest packet each message can be
+sent in, before zerocoding and without appended acks, and checks them
+against the limits in net.h: packets over MTU_BYTES get fragmented by IP,
+and packets over BUFFER_BYTES can't be received at all.
+
+The minimum has every Variable block empty and every Variable field zero
+length; the maximum has 255 instances of every Variable block and every
+Variable field as long as its length field allows. The typical size
+assumes TYPICAL_REPEATS instances of each Variable block and
+TYPICAL_VARIABLE_BYTES of data in each Variable field (or the field's
+maximum, if that is smaller); both are guesses that can be passed in.
+"""
+
+from collections import namedtuple
+
+from .llmessage import Message, Block, Variable, PHL_NAME
+
+MTU_BYTES = 1200                # MTUBYTES
+BUFFER_BYTES = 0x2000           # NET_BUFFER_SIZE, which is MAX_BUFFER_SIZE
+
+TYPICAL_REPEATS = 1
+TYPICAL_VARIABLE_BYTES = 32
+
+NUMBER_SIZES = {
+    Message.HIGH: 1,
+    Message.MEDIUM: 2,
+    Message.LOW: 4,
+    Message.FIXED: 4,
+    }
+
+FIXED_SIZES = {
+    Variable.U8: 1, Variable.U16: 2, Variable.U32: 4, Variable.U64: 8,
+    Variable.S8: 1, Variable.S16: 2, Variable.S32: 4, Variable.S64: 8,
+    Variable.F32: 4, Variable.F64: 8,
+    Variable.LLVECTOR3: 12, Variable.LLVECTOR3D: 24, Variable.LLVECTOR4: 16,
+    Variable.LLQUATERNION: 12,  # packed as x, y, z
+    Variable.LLUUID: 16, Variable.BOOL: 1,
+    Variable.IPADDR: 4, Variable.IPPORT: 2,
+    }
+
+Size = namedtuple('Size', 'minimum typical maximum')
+
+
+class MessageSize(namedtuple('MessageSize',
+                             'name priority coding deprecation header'
+                             ' minimum typical maximum')):
+    """Whole packet sizes for one message, header included."""
+
+    def sentOverUDP(self):
+        return self.deprecation not in (Message.UDPBLACKLISTED, Message.DEPRECATED)
+
+    def problems(self, mtu=MTU_BYTES, buffer=BUFFER_BYTES):
+        """Returns (errors, warnings) as lists of strings."""
+        errors = [ ]
+        warnings = [ ]
+        if self.minimum > buffer:
+            errors.append("%s is at least %d bytes, more than the %d byte packet buffer"
+                          % (self.name, self.minimum, buffer))
+        elif self.minimum > mtu:
+            warnings.append("%s is at least %d bytes, more than the %d byte MTU"
+                            % (self.name, self.minimum, mtu))
+        elif self.typical > mtu:
+            warnings.append("%s is typically %d bytes, more than the %d byte MTU"
+                            % (self.name, self.typical, mtu))
+        return errors, warnings
+
+    def flags(self, mtu=MTU_BYTES, buffer=BUFFER_BYTES):
+        """Short markers of the limits each size exceeds, for tables."""
+        flags = [ ]
+        for label, size in (('min', self.minimum), ('typ', self.typical),
+                            ('max', self.maximum)):
+            if size > buffer:
+                flags.append(label + '>buffer')
+            elif size > mtu:
+                flags.append(label + '>mtu')
+        return flags
+
+
+def variableSize(variable, typicalBytes=TYPICAL_VARIABLE_BYTES):
+    if variable.type == Variable.FIXED:
+        n = int(variable.size)
+        return Size(n, n, n)
+    if variable.type == Variable.VARIABLE:
+        length = int(variable.size)
+        most = (1 << (8 * length)) - 1
+        return Size(length, length + min(typicalBytes, most), length + most)
+    n = FIXED_SIZES[variable.type]
+    return Size(n, n, n)
+
+def blockSize(block, typicalRepeats=TYPICAL_REPEATS,
+              typicalBytes=TYPICAL_VARIABLE_BYTES):
+    sizes = [variableSize(v, typicalBytes) for v in block.variables]
+    one = Size(sum(s.minimum for s in sizes),
+               sum(s.typical for s in sizes),
+               sum(s.maximum for s in sizes))
+    if block.repeat == Block.SINGLE:
+        return one
+    if block.repeat == Block.MULTIPLE:
+        n = int(block.count)
+        return Size(n * one.minimum, n * one.typical, n * one.maximum)
+    # a one byte count, then up to 255 instances
+    typical = min(typicalRepeats, 255)
+    return Size(1, 1 + typical * one.typical, 1 + 255 * one.maximum)
+
+def messageSize(message, typicalRepeats=TYPICAL_REPEATS,
+                typicalBytes=TYPICAL_VARIABLE_BYTES):
+    header = PHL_NAME + NUMBER_SIZES[message.priority]
+    sizes = [blockSize(b, typicalRepeats, typicalBytes) for b in message.blocks]
+    minimum = header + sum(s.minimum for s in sizes)
+    # trailing Variable blocks may be left out altogether
+    for block in reversed(message.blocks):
+        if block.repeat != Block.VARIABLE:
+            break
+        minimum -= 1
+    return MessageSize(message.name, message.priority, message.coding,
+                       message.deprecations[message.deprecateLevel], header,
+                       minimum,
+                       header + sum(s.typical for s in sizes),
+                       header + sum(s.maximum for s in sizes))
+
+def templateSizes(template, typicalRepeats=TYPICAL_REPEATS,
+                  typicalBytes=TYPICAL_VARIABLE_BYTES):
+    """MessageSizes for every message, in name order."""
+    return [messageSize(template.messages[name], typicalRepeats, typicalBytes)
+            for name in sorted(template.messages)]
+
+def checkSizes(sizes, mtu=MTU_BYTES, buffer=BUFFER_BYTES):
+    """Returns (errors, warnings) for a list of MessageSizes, leaving out
+    messages that are no longer sent over UDP."""
+    errors = [ ]
+    warnings = [ ]
+    for s in sizes:
+        if not s.sentOverUDP():
+            continue
+        e, w = s.problems(mtu, buffer)
+        errors.extend(e)
+        warnings.extend(w)
+    return errors, warnings
+
+SORT_KEYS = ('name', 'priority', 'minimum', 'typical', 'maximum')
+
+def formatTable(sizes, sort='name', mtu=MTU_BYTES, buffer=BUFFER_BYTES):
+    """Returns the sizes as lines of a text table, largest first unless
+    sorting by name or priority."""
+    if sort == 'name':
+        rows = sorted(sizes, key=lambda s: s.name)
+    elif sort == 'priority':
+        order = dict((p, i) for i, p in enumerate(Message.priorities))
+        rows = sorted(sizes, key=lambda s: (order[s.priority], s.name))
+    else:
+        rows = sorted(sizes, key=lambda s: (-getattr(s, sort), s.name))
+    lines = ["%-40s %-6s %-9s %7s %7s %12s  %s" % (
+        "message", "freq", "coding", "min", "typical", "max", "exceeds")]
+    for s in rows:
+        lines.append("%-40s %-6s %-9s %7d %7d %12d  %s" % (
+            s.name, s.priority, s.coding, s.minimum, s.typical, s.maximum,
+            " ".join(s.flags(mtu, buffer))))
+    return lines
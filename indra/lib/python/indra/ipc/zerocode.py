@@ -0,0 +1,145 @@
+"""\
+@file zerocode.py
+@brief Zero-run encoding used by Zerocoded template messages
+
+$LicenseInfo:firstyear=2024&license=mit$
+
+Copyright (c) 2024, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+"""Each run of zero bytes is sent as a single 0 followed by a count byte.
+Runs longer than 255 are split into several 0 [count] pairs on encode;
+on decode, extra 0 bytes before the count each stand for 256 more zeroes,
+matching LLMessageSystem::zeroCodeExpand(). The packet header (flags,
+sequence number and extra-header offset) is never encoded.
+
+Both directions scan for zero runs with a compiled regex over the whole
+buffer rather than looping over bytes in Python, and accept bytes,
+bytearray or memoryview input.
+"""
+
+import re
+
+ZERO_CODE_FLAG = 0x80
+PACKET_ID_SIZE = 6      # flags, 4 byte sequence number, extra header offset
+
+_zeroRunRE = re.compile(b'\x00+')
+_encodedRunRE = re.compile(b'\x00(\x00*)(.)?', re.DOTALL)
+
+_ZEROES = bytes(8192)
+
+_encodedRuns = { }
+def _encodedRun(n):
+    try:
+        return _encodedRuns[n]
+    except KeyError:
+        full, rest = divmod(n, 255)
+        run = b'\x00\xff' * full
+        if rest:
+            run += b'\x00' + bytes((rest,))
+        if n < 4096:
+            _encodedRuns[n] = run
+        return run
+
+def _encodeMatch(m):
+    return _encodedRun(m.end() - m.start())
+
+def _runLength(m):
+    count = m.group(2)
+    if count is None:
+        # a trailing 0 with no count expands to a single zero
+        return 1 + 256 * (m.end(1) - m.start(1))
+    return 256 * (m.end(1) - m.start(1)) + count[0]
+
+def _zeroes(n):
+    if n <= len(_ZEROES):
+        return _ZEROES[:n]
+    return bytes(n)
+
+def _decodeMatch(m):
+    return _zeroes(_runLength(m))
+
+
+def encode(data):
+    """Zero-run encode data, returning bytes."""
+    return _zeroRunRE.sub(_encodeMatch, data)
+
+def encodedSize(data):
+    """Size data would have after encode(), without building it."""
+    size = len(data)
+    for m in _zeroRunRE.finditer(data):
+        size += len(_encodedRun(m.end() - m.start())) - (m.end() - m.start())
+    return size
+
+def decode(data, out=None):
+    """Expand zero-run encoded data. Without out, returns bytes. With a
+    bytearray out, appends the expansion to it and returns out, copying
+    each literal span straight from data."""
+    if out is None:
+        return _encodedRunRE.sub(_decodeMatch, data)
+    view = memoryview(data)
+    pos = 0
+    for m in _encodedRunRE.finditer(data):
+        start = m.start()
+        if start != pos:
+            out += view[pos:start]
+        out += _zeroes(_runLength(m))
+        pos = m.end()
+    if pos < len(view):
+        out += view[pos:]
+    return out
+
+
+def encodePacket(packet):
+    """Zero-code a whole packet the way LLTemplateMessageBuilder does: the
+    header is copied as is, and the encoding (and ZERO_CODE_FLAG) is only
+    used if it makes the packet smaller. Returns bytes."""
+    view = memoryview(packet)
+    body = encode(view[PACKET_ID_SIZE:])
+    if len(body) + PACKET_ID_SIZE >= len(view):
+        return bytes(view)
+    header = bytearray(view[:PACKET_ID_SIZE])
+    header[0] |= ZERO_CODE_FLAG
+    return bytes(header) + body
+
+def decodePacket(packet, out=None):
+    """Undo encodePacket(). Packets without ZERO_CODE_FLAG are returned
+    (or appended to out) unchanged; otherwise the flag is cleared in the
+    result. Any appended acks must have been stripped off first."""
+    view = memoryview(packet)
+    if not view[0] & ZERO_CODE_FLAG:
+        if out is None:
+            return bytes(view)
+        out += view
+        return out
+    if out is None:
+        out = bytearray()
+        result = None
+    else:
+        result = out
+    start = len(out)
+    out += view[:PACKET_ID_SIZE]
+    out[start] &= ~ZERO_CODE_FLAG & 0xff
+    decode(view[PACKET_ID_SIZE:], out)
+    if result is None:
+        return bytes(out)
+    return result
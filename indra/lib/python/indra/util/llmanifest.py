@@ -27,21 +27,37 @@ THE SOFTWARE.
 $/LicenseInfo$
 """
 
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, deque
+from contextlib import contextmanager
+import concurrent.futures
 import subprocess
 import errno
 import filecmp
 import fnmatch
 import getopt
 import glob
+import hashlib
 import itertools
+import json
+import lzma
 import operator
 import os
 import re
 import shutil
+import stat
+import struct
 import subprocess
 import sys
 import tarfile
+import threading
+import time
+import traceback
+import zlib
+try:
+    import fcntl
+except ImportError:
+    # not on Windows
+    fcntl = None
 
 class ManifestError(RuntimeError):
     """Use an exception more specific than generic Python RuntimeError"""
@@ -89,6 +105,13 @@ def get_default_platform(dummy):
             'darwin':'darwin'
             }[sys.platform]
 
+def get_default_copy_workers(dummy):
+    # Threads only pay off once there are cores to overlap the copies'
+    # system calls on: with fewer, the copies were measured slower than
+    # making them one at a time. Past 8 threads the disk is the limit.
+    cpus = os.cpu_count() or 1
+    return str(1 if cpus < 4 else min(8, cpus))
+
 DEFAULT_SRCTREE = os.path.dirname(sys.argv[0])
 CHANNEL_VENDOR_BASE = 'Firestorm'
 RELEASE_CHANNEL = CHANNEL_VENDOR_BASE + ' Development'
@@ -124,6 +147,37 @@ BASE_ARGUMENTS=[
          description="""Addition to the channel for packaging and channel value,
          but not application name (used internally)""",
          default=None),
+    dict(name='content_store',
+         description="""Directory of files stored by content that copies are
+        reflinked from, so that manifests staging the same files into several
+        destinations write them once; with copy_strategy=hardlink, and not
+        packaging, they are hardlinked instead. Not used where neither works.
+        Used for additional_packages builds by default, and removed afterwards
+        if nothing links to it.""",
+         default=None),
+    dict(name='copy_workers',
+         description="""How many files to copy at once. Files matched by a single
+        path() call are copied concurrently on this many threads; 1 copies
+        them one at a time, as they are by default on machines with fewer
+        than 4 cores.""",
+         default=get_default_copy_workers),
+    dict(name='copy_strategy',
+         description="""How to copy files into the destination tree, one of:
+          auto     - reflink, or the first of the following that works
+          reflink  - share the source's extents (btrfs, xfs); otherwise range
+          range    - copy in the kernel with copy_file_range(); otherwise copy
+          copy     - shutil.copy2()
+          hardlink - link to the source, when it is on the same filesystem
+                     and we aren't packaging; otherwise reflink. Only for
+                     manifests whose construct() never changes a staged file
+                     in place (as Darwin's install_name_tool calls do), which
+                     would change the source too.""",
+         default='auto'),
+    dict(name='compress_workers',
+         description="""How many processes to compress packages with. Packages
+        are compressed in independent blocks, several at a time; 1 compresses
+        them one block after another. By default, one per core.""",
+         default=None),
     dict(name='configuration',
          description="""The build configuration used.""",
          default="Release"),
@@ -150,11 +204,23 @@ BASE_ARGUMENTS=[
     dict(name='source',
          description='Source directory.',
          default=DEFAULT_SRCTREE),
+    dict(name='state_file',
+         description="""Where to keep the index of what each destination file was
+        copied from, so that unchanged files can be skipped without comparing
+        them. By default, a hidden file beside the destination directory; an
+        empty value keeps no index.""",
+         default=None),
     dict(name='touch',
          description="""File to touch when action is finished. Touch file will
         contain the name of the final package in a form suitable
         for use by a .bat file.""",
          default=None),
+    dict(name='trace',
+         description="""File to write a Chrome trace (trace-event JSON, for
+        chrome://tracing or ui.perfetto.dev) of the run to: how long each
+        prefix, path, copy, command and finish step took, and what it did.
+        A summary is printed at the end. By default, nothing is traced.""",
+         default=None),
     dict(name='versionfile',
          description="""The name of a file containing the full version number."""),
     dict(name='viewer_flavor',
@@ -166,6 +232,9 @@ def usage(arguments, srctree=""):
     print("""Usage:
     %(name)s [options] [destdir]
     Options:
+	--plan
+	Print what the copy would change in the destination tree,
+	without changing anything.
     """ % nd)
     for arg in arguments:
         default = arg['default']
@@ -188,6 +257,7 @@ def main(extra=[]):
     arguments.sort(key=operator.itemgetter('name'))
     option_names = [arg['name'] + '=' for arg in arguments]
     option_names.append('help')
+    option_names.append('plan')
     options, remainder = getopt.getopt(sys.argv[1:], "", option_names)
 
     # convert options to a hash
@@ -246,6 +316,14 @@ def main(extra=[]):
     # pass in sourceid as an argument now instead of an environment variable
     args['sourceid'] = os.environ.get("sourceid", "")
 
+    # handle multiple packages if set
+    # ''.split() produces empty list
+    additional_packages = os.environ.get("additional_packages", "").split()
+    if additional_packages and 'content_store' not in args:
+        # the packages stage mostly the same files: write them once
+        args['content_store'] = os.path.join(os.path.dirname(os.path.abspath(args['dest'])),
+                                             '.manifest-store')
+
     # Build base package.
     touch = args.get('touch')
     if touch:
@@ -262,9 +340,6 @@ def main(extra=[]):
     else:
         print('================ Finished base copy')
 
-    # handle multiple packages if set
-    # ''.split() produces empty list
-    additional_packages = os.environ.get("additional_packages", "").split()
     if additional_packages:
         # Determine destination prefix / suffix for additional packages.
         base_dest_parts = list(os.path.split(args['dest']))
@@ -282,25 +357,56 @@ def main(extra=[]):
             else:
                 base_touch_parts.insert(-2, "{}")
             base_touch_template = os.path.join(*base_touch_parts)
+        # Build them all at once, each in its own process, with its output
+        # going to a log beside its destination
+        jobs = []
         for package_id in additional_packages:
-            args['channel_suffix'] = os.environ.get(package_id + "_viewer_channel_suffix")
-            args['sourceid']       = os.environ.get(package_id + "_sourceid")
-            args['dest'] = base_dest_template.format(package_id)
-            if touch:
-                print('================ Creating additional package for "', package_id, '" in ', args['dest'])
-            else:
-                print('================ Starting additional copy for "', package_id, '" in ', args['dest'])
-            try:
-                wm = LLManifest.for_platform(args['platform'], args.get('arch'))(args)
-                wm.do(*args['actions'])
-            except Exception as err:
-                sys.exit(str(err))
+            package_args = dict(args)
+            package_args['channel_suffix'] = os.environ.get(package_id + "_viewer_channel_suffix")
+            package_args['sourceid']       = os.environ.get(package_id + "_sourceid")
+            package_args['dest'] = base_dest_template.format(package_id)
             if touch:
-                print('================ Created additional package ', wm.package_file, ' for ', package_id)
-                with open(base_touch_template.format(package_id), 'w') as fp:
-                    fp.write('set package_file=%s\n' % wm.package_file)
+                print('================ Creating additional package for "', package_id, '" in ', package_args['dest'])
             else:
-                print('================ Finished additional copy "', package_id, '" in ', args['dest'])
+                print('================ Starting additional copy for "', package_id, '" in ', package_args['dest'])
+            jobs.append((package_id, package_args))
+        sys.stdout.flush()
+        failures = []
+        workers = min(len(jobs), os.cpu_count() or 1)
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = dict((executor.submit(build_package, args['platform'], args.get('arch'),
+                                            package_args, package_args['dest'] + '.log'),
+                            (package_id, package_args))
+                           for package_id, package_args in jobs)
+            for future in concurrent.futures.as_completed(futures):
+                package_id, package_args = futures[future]
+                log = package_args['dest'] + '.log'
+                print('================ Output of additional package "', package_id, '" (', log, ')')
+                if os.path.exists(log):
+                    with open(log) as f:
+                        sys.stdout.write(f.read())
+                try:
+                    package_file, error = future.result()
+                except Exception as err:
+                    # the worker process itself died
+                    package_file, error = None, '%s: %s' % (type(err).__name__, err)
+                if error is not None:
+                    print('================ Failed additional package "', package_id, '"')
+                    failures.append((package_id, error))
+                elif touch:
+                    print('================ Created additional package ', package_file, ' for ', package_id)
+                    with open(base_touch_template.format(package_id), 'w') as fp:
+                        fp.write('set package_file=%s\n' % package_file)
+                else:
+                    print('================ Finished additional copy "', package_id, '" in ', package_args['dest'])
+        if args.get('content_store'):
+            print('Removed %d unused files from %s' % (
+                ContentStore(args['content_store']).prune(), args['content_store']))
+        if failures:
+            for package_id, error in failures:
+                print('================ Additional package "%s" failed:\n%s' % (package_id, error))
+            raise ManifestError('%d of %d additional packages failed: %s' % (
+                len(failures), len(jobs), ', '.join(package_id for package_id, error in failures)))
     # Write out the package file in this format, so that it can easily be called
     # and used in a .bat file - yeah, it sucks, but this is the simplest...
     if touch:
@@ -309,6 +415,33 @@ def main(extra=[]):
         print('touched', touch)
     return 0
 
+def build_package(platform, arch, args, log):
+    """Runs the manifest for platform and arch with args in a worker
+    process, with everything it and its commands print going to the file
+    log. Returns (package file, None), or (None, the traceback) if it
+    failed."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.makedirs(os.path.dirname(os.path.abspath(log)), exist_ok=True)
+    log_file = open(log, 'w', buffering=1)
+    # commands write to the same file, through the same offset
+    saved_fds = os.dup(1), os.dup(2)
+    os.dup2(log_file.fileno(), 1)
+    os.dup2(log_file.fileno(), 2)
+    sys.stdout = sys.stderr = log_file
+    try:
+        wm = LLManifest.for_platform(platform, arch)(args)
+        wm.do(*args['actions'])
+        return getattr(wm, 'package_file', None), None
+    except BaseException:
+        return None, traceback.format_exc()
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        for fd, saved in zip((1, 2), saved_fds):
+            os.dup2(saved, fd)
+            os.close(saved)
+        log_file.close()
+
 class LLManifestRegistry(type):
     def __init__(cls, name, bases, dct):
         super(LLManifestRegistry, cls).__init__(name, bases, dct)
@@ -318,8 +451,885 @@ class LLManifestRegistry(type):
 
 MissingFile = namedtuple("MissingFile", ("pattern", "tried"))
 
+# ioctl(dst, FICLONE, src) makes dst share src's extents on btrfs and xfs
+FICLONE = 0x40049409 if fcntl is not None and sys.platform.startswith('linux') else None
+
+COPY_STRATEGIES = ('auto', 'hardlink', 'reflink', 'range', 'copy')
+
+# errors that mean a way of copying doesn't work between two filesystems at
+# all, so it needn't be tried again for them
+_UNSUPPORTED_ERRNOS = frozenset(getattr(errno, name) for name in
+                                ('EXDEV', 'EOPNOTSUPP', 'ENOTSUP', 'ENOSYS', 'ENOTTY')
+                                if hasattr(errno, name))
+# errors that mean it didn't work for this file
+_FALLBACK_ERRNOS = _UNSUPPORTED_ERRNOS | frozenset((errno.EPERM, errno.EINVAL, errno.EMLINK))
+
+def link_file(src, dst):
+    os.link(src, dst)
+
+def is_hardlinked(path):
+    """True if path is a regular file with other names, as a hardlink copy
+    leaves both the source and its copy."""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    return stat.S_ISREG(st.st_mode) and st.st_nlink > 1
+
+def reflink_file(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+def range_copy_file(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        while os.copy_file_range(infd, outfd, 1 << 30):
+            pass
+    shutil.copystat(src, dst)
+
+ELF_MAGIC = b'\x7fELF'
+_PT_NOTE = 4
+_NT_GNU_BUILD_ID = 3
+
+def elf_build_id(path):
+    """The GNU build-id of the ELF file path, in hex, or None if path isn't
+    an ELF file or has no build-id note."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(64)
+            if len(header) < 52 or header[:4] != ELF_MAGIC:
+                return None
+            is64 = header[4] == 2
+            endian = '<' if header[5] == 1 else '>'
+            if is64:
+                if len(header) < 64:
+                    return None
+                phoff, = struct.unpack_from(endian + 'Q', header, 32)
+                phentsize, phnum = struct.unpack_from(endian + 'HH', header, 54)
+                phdr = struct.Struct(endian + 'IIQQQQQQ')
+            else:
+                phoff, = struct.unpack_from(endian + 'I', header, 28)
+                phentsize, phnum = struct.unpack_from(endian + 'HH', header, 42)
+                phdr = struct.Struct(endian + 'IIIIIIII')
+            f.seek(phoff)
+            table = f.read(phentsize * phnum)
+            for offset in range(0, len(table) - phdr.size + 1, phentsize):
+                fields = phdr.unpack_from(table, offset)
+                if fields[0] != _PT_NOTE:
+                    continue
+                if is64:
+                    p_offset, p_filesz, p_align = fields[2], fields[5], fields[7]
+                else:
+                    p_offset, p_filesz, p_align = fields[1], fields[4], fields[7]
+                # notes are padded to the segment's alignment: 4, or 8
+                pad = 7 if p_align == 8 else 3
+                f.seek(p_offset)
+                notes = f.read(p_filesz)
+                pos = 0
+                while pos + 12 <= len(notes):
+                    namesz, descsz, type = struct.unpack_from(endian + 'III', notes, pos)
+                    pos += 12
+                    name = notes[pos:pos + namesz]
+                    pos = (pos + namesz + pad) & ~pad
+                    desc = notes[pos:pos + descsz]
+                    pos = (pos + descsz + pad) & ~pad
+                    if type == _NT_GNU_BUILD_ID and name == b'GNU\0':
+                        return desc.hex()
+    except (OSError, struct.error):
+        pass
+    return None
+
+class ContentStore(object):
+    """A directory of files named by the SHA-256 of their contents, which
+    manifest runs staging the same payload into different destinations --
+    several processes at once -- share: put() stores a file's contents
+    unless they are already there, and a FileCopier with the store then
+    links or reflinks destinations to the stored copy, so identical files
+    are written once however many destinations get them."""
+    def __init__(self, root):
+        self.root = root
+        # (st_dev, st_ino, st_size, st_mtime_ns): digest, for this process
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def digest(self, src):
+        st = os.stat(src)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(src, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            with self._lock:
+                self._digests[key] = digest
+        return digest
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def put(self, src, copy):
+        """Returns the path of the stored copy of src's contents, first
+        making it with copy(src, path) if there isn't one."""
+        path = self.path(self.digest(src))
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        copy(src, temp)
+        try:
+            os.link(temp, path)
+        except FileExistsError:
+            # another run stored the same contents first
+            pass
+        finally:
+            os.remove(temp)
+        return path
+
+    def prune(self):
+        """Removes the stored files that no destination links to any more,
+        and the directories, root included, that leaves empty. Returns how
+        many files there were."""
+        removed = 0
+        if not os.path.isdir(self.root):
+            return removed
+        for dir in os.listdir(self.root):
+            dir = os.path.join(self.root, dir)
+            for name in os.listdir(dir):
+                path = os.path.join(dir, name)
+                if os.lstat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+            try:
+                os.rmdir(dir)
+            except OSError:
+                # still in use
+                pass
+        try:
+            os.rmdir(self.root)
+        except OSError:
+            pass
+        return removed
+
+class FileCopier(object):
+    """Copies a file's contents and metadata with the cheapest method in
+    its chain that works, ending with shutil.copy2(), and remembers which
+    methods aren't supported between which filesystems. counts tallies the
+    files copied by each method.
+
+    Given a ContentStore, each file is first put in the store, by the
+    chain's other methods, and reflinked from there, so the destination
+    shares the stored copy's blocks but not its inode; or hardlinked, with
+    the 'hardlink' strategy, where hardlinks are allowed. Where that doesn't
+    work the store is dropped, since copying out of it would only copy each
+    file twice."""
+    def __init__(self, strategy='auto', hardlinks=True, store=None):
+        if strategy not in COPY_STRATEGIES:
+            raise ManifestError("Unknown copy strategy %r, expected one of %s"
+                                % (strategy, ', '.join(COPY_STRATEGIES)))
+        self.strategy = strategy
+        self.hardlinks = hardlinks
+        self.chain = []
+        if strategy == 'hardlink' and hardlinks:
+            self.chain.append(('hardlink', link_file))
+        if strategy in ('auto', 'hardlink', 'reflink') and FICLONE is not None:
+            self.chain.append(('reflink', reflink_file))
+        if strategy != 'copy' and hasattr(os, 'copy_file_range'):
+            self.chain.append(('range', range_copy_file))
+        self.chain.append(('copy', shutil.copy2))
+        # the store's files must be copies: a source linked in could be
+        # rewritten in place, changing what its name says it contains
+        self._store_chain = [method for method in self.chain if method[0] != 'hardlink']
+        self.store = store
+        if self.chain[0][0] == 'hardlink':
+            self._from_store = link_file
+        elif self.chain[0][0] == 'reflink':
+            self._from_store = reflink_file
+        else:
+            self.store = None
+        self.counts = defaultdict(int)
+        self._unsupported = set()
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def _device(self, dir):
+        try:
+            return self._devices[dir]
+        except KeyError:
+            device = self._devices[dir] = os.stat(dir or os.curdir).st_dev
+            return device
+
+    def copy(self, src, dst):
+        """Returns the name of the method that copied src to dst."""
+        name = None
+        if self.store is not None:
+            try:
+                self._from_store(self.store.put(src, self._copy_to_store), dst)
+                name = 'store'
+            except OSError as err:
+                if err.errno not in _FALLBACK_ERRNOS:
+                    raise
+                if err.errno in _UNSUPPORTED_ERRNOS:
+                    # the store is on another filesystem, or one that
+                    # can't reflink
+                    self.store = None
+        if name is None:
+            name = self._copy(src, dst, self.chain)
+        with self._lock:
+            self.counts[name] += 1
+        return name
+
+    def _copy_to_store(self, src, dst):
+        self._copy(src, dst, self._store_chain)
+
+    def _copy(self, src, dst, chain):
+        devices = None
+        for name, function in chain[:-1]:
+            if devices is None:
+                devices = (self._device(os.path.dirname(src)),
+                           self._device(os.path.dirname(dst)))
+            if (name,) + devices in self._unsupported:
+                continue
+            try:
+                function(src, dst)
+            except OSError as err:
+                if err.errno not in _FALLBACK_ERRNOS:
+                    raise
+                if err.errno in _UNSUPPORTED_ERRNOS:
+                    self._unsupported.add((name,) + devices)
+                continue
+            break
+        else:
+            name, function = chain[-1]
+            function(src, dst)
+        return name
+
+    def summary(self):
+        names = ['store'] + [name for name, function in self.chain]
+        return ', '.join('%s %d' % (name, self.counts[name])
+                         for name in names if self.counts[name])
+
+# the characters that make a glob pattern, as in the glob module
+_glob_magic = re.compile('[*?[]')
+_CASE_INSENSITIVE = sys.platform in ('win32', 'cygwin', 'darwin')
+
+class DirectoryIndex(object):
+    """Directory listings made with os.scandir(), each read once and shared
+    by every lookup, so that trying a path or glob against the source,
+    artwork and build prefixes costs a stat() of the directory and
+    dictionary lookups rather than a stat() of every candidate.
+
+    Creating, removing or renaming anything in a directory changes its
+    st_mtime_ns, so a listing is used only while its directory's mtime is
+    still the one it was read at, whatever changed it. A directory
+    modified within racy_ns of its scan could be changed again without
+    its mtime moving on, so its listing is read again each time until that
+    has passed."""
+    racy_ns = 2 * 10**9
+
+    def __init__(self):
+        # normalized dir: (st_mtime_ns, time.time_ns() of the scan, listing)
+        self._listings = {}
+        self._lock = threading.Lock()
+        self.scans = 0
+
+    def _key(self, dir):
+        return os.path.normpath(dir) if dir else os.curdir
+
+    def listing(self, dir):
+        """{name: DirEntry} for dir, in directory order; empty if dir isn't
+        a directory."""
+        key = self._key(dir)
+        try:
+            st = os.stat(key)
+        except OSError:
+            return {}
+        if not stat.S_ISDIR(st.st_mode):
+            return {}
+        cached = self._listings.get(key)
+        if (cached is not None and cached[0] == st.st_mtime_ns
+                and cached[1] - st.st_mtime_ns > self.racy_ns):
+            return cached[2]
+        scanned = time.time_ns()
+        listing = {}
+        try:
+            with os.scandir(key) as entries:
+                for entry in entries:
+                    listing[entry.name] = entry
+        except OSError:
+            pass
+        with self._lock:
+            self.scans += 1
+            # the mtime from before the scan: a change made while we read
+            # moves it on, and the next lookup reads the directory again
+            self._listings[key] = (st.st_mtime_ns, scanned, listing)
+        return listing
+
+    def entry(self, path):
+        """The DirEntry for path, or None if there's nothing there (not
+        even a broken symlink)."""
+        dir, name = os.path.split(self._key(path))
+        if name in ('', os.curdir, os.pardir):
+            return None
+        listing = self.listing(dir)
+        entry = listing.get(name)
+        if entry is None and _CASE_INSENSITIVE:
+            folded = name.casefold()
+            for other, entry in listing.items():
+                if other.casefold() == folded:
+                    return entry
+            return None
+        return entry
+
+    def lexists(self, path):
+        if self.entry(path) is not None:
+            return True
+        # the root of a filesystem, '.' or '..'
+        name = os.path.basename(self._key(path))
+        return name in ('', os.curdir, os.pardir) and os.path.lexists(path)
+
+    def isdir(self, path):
+        entry = self.entry(path)
+        if entry is None:
+            return self.lexists(path) and os.path.isdir(path)
+        return entry.is_dir()
+
+    def islink(self, path):
+        entry = self.entry(path)
+        return entry is not None and entry.is_symlink()
+
+    def isfile(self, path):
+        entry = self.entry(path)
+        return entry is not None and entry.is_file()
+
+    def stat(self, path):
+        # not entry.stat(), which is cached, and would miss a file that
+        # was rewritten in place without changing its directory
+        return os.stat(path)
+
+    def names(self, dir):
+        return list(self.listing(dir))
+
+    def _match(self, dir, pattern):
+        names = self.names(dir)
+        if pattern[0] != '.':
+            # like glob, wildcards don't match hidden files
+            names = [name for name in names if name[0] != '.']
+        return fnmatch.filter(names, pattern)
+
+    def glob(self, pattern):
+        """Like glob.glob(), non-recursive, but from the listings."""
+        dirname, basename = os.path.split(pattern)
+        if not _glob_magic.search(pattern):
+            if basename:
+                return [pattern] if self.lexists(pattern) else []
+            return [pattern] if self.isdir(dirname) else []
+        if not dirname:
+            return self._match(os.curdir, basename)
+        if dirname != pattern and _glob_magic.search(dirname):
+            dirs = self.glob(dirname)
+        else:
+            dirs = [dirname]
+        results = []
+        for dir in dirs:
+            if _glob_magic.search(basename):
+                results.extend(os.path.join(dir, name)
+                               for name in self._match(dir, basename))
+            elif basename:
+                if self.lexists(os.path.join(dir, basename)):
+                    results.append(os.path.join(dir, basename))
+            elif self.isdir(dir):
+                results.append(os.path.join(dir, basename))
+        return results
+
+    def invalidate(self, path):
+        """Forget what we know about path, which has been created, changed
+        or removed: its parent's listing and, if it's a directory, its own.
+        Listings are checked against their directories' mtimes anyway; this
+        only frees them sooner."""
+        key = self._key(path)
+        with self._lock:
+            self._listings.pop(key, None)
+            self._listings.pop(os.path.dirname(key) or os.curdir, None)
+
+    def clear(self):
+        with self._lock:
+            self._listings = {}
+
+class ExcludeMatcher(object):
+    """A list of exclude globs compiled into one regular expression, with the
+    same meaning as calling fnmatch.fnmatch() with each of them in turn.
+
+    A glob ending in '/*' excludes everything below the directories its
+    first part matches, so prunes() can say a directory needn't be listed
+    at all. hits maps each glob to the set of paths it excluded, or the
+    directories it pruned."""
+    def __init__(self, patterns, hits=None):
+        self.patterns = list(patterns)
+        self.hits = defaultdict(set) if hits is None else hits
+        self._lock = threading.Lock()
+        self._files = self._compile(enumerate(self.patterns))
+        dirs = []
+        for i, pattern in enumerate(self.patterns):
+            for sep in set(('/', os.sep)):
+                if pattern.endswith(sep + '*') and len(pattern) > 2:
+                    dirs.append((i, pattern[:-2]))
+                    break
+        self._dirs = self._compile(dirs)
+
+    def _compile(self, patterns):
+        # the outermost group closes last, so names the alternative matched
+        alternatives = ['(?P<e%d>%s)' % (i, fnmatch.translate(os.path.normcase(pattern)))
+                        for i, pattern in patterns]
+        return re.compile('|'.join(alternatives)).match if alternatives else None
+
+    def _hit(self, match, path):
+        pattern = self.patterns[int(match.lastgroup[1:])]
+        with self._lock:
+            self.hits[pattern].add(path)
+
+    def excludes(self, path):
+        if self._files is None:
+            return False
+        match = self._files(os.path.normcase(path))
+        if match is None:
+            return False
+        self._hit(match, path)
+        return True
+
+    def prunes(self, dir):
+        """True if dir, or everything in it, is excluded."""
+        if self.excludes(dir):
+            return True
+        if self._dirs is None:
+            return False
+        match = self._dirs(os.path.normcase(dir))
+        if match is None:
+            return False
+        self._hit(match, dir)
+        return True
+
+class BuildState(object):
+    """An index of what each destination file was copied from, kept between
+    runs in filename: the source path, size, mtime_ns and inode, and the
+    destination's own size, mtime_ns and inode.
+
+    A file is up to date if both its source and its destination still have
+    the recorded size, mtime and inode (a destination that was removed,
+    replaced or written to would not), so neither file has to be compared."""
+    VERSION = 2
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.previous = {}
+        self.current = {}
+        self._lock = threading.Lock()
+        if filename:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if state.get('version') != self.VERSION:
+            return
+        self.previous = dict((dst, tuple(entry))
+                             for dst, entry in state.get('files', {}).items())
+
+    def save(self):
+        if not self.filename:
+            return
+        tmpname = '%s.%d' % (self.filename, os.getpid())
+        with open(tmpname, 'w') as f:
+            json.dump(dict(version=self.VERSION, files=self.current), f,
+                      separators=(',', ':'))
+        os.replace(tmpname, self.filename)
+
+    def source_stat(self, src):
+        try:
+            return os.stat(src)
+        except OSError:
+            return None
+
+    def _entry(self, src, st):
+        return (src, st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def _dst_entry(self, dst_st):
+        return (dst_st.st_size, dst_st.st_mtime_ns, dst_st.st_ino)
+
+    def up_to_date(self, src, dst):
+        """Returns True if dst was copied from src, and neither has changed
+        since. Either way, returns the stat result for src."""
+        st = self.source_stat(src)
+        previous = self.previous.get(dst)
+        if st is None or previous is None or previous[:4] != self._entry(src, st):
+            return False, st
+        try:
+            dst_st = os.lstat(dst)
+        except OSError:
+            return False, st
+        return previous[4:] == self._dst_entry(dst_st), st
+
+    def record(self, src, dst, st=None):
+        if st is None:
+            st = os.stat(src)
+        entry = self._entry(src, st) + self._dst_entry(os.lstat(dst))
+        with self._lock:
+            self.current[dst] = entry
+
+    def stale(self):
+        """Destination files copied last time but not this time."""
+        return sorted(set(self.previous) - set(self.current))
+
+class CopyPlan(object):
+    """Copies recorded by copy_action() while defer_copies is set, to be
+    checked, deduplicated and run together by LLManifest.flush_copies().
+
+    Each destination keeps only the last copy planned to it, just as if
+    the copies had run in order; overridden lists those that were
+    replaced. Files copied from one source to several destinations are
+    read once: the first destination is copied from the source, and the
+    rest from the first destination."""
+    def __init__(self):
+        # normalized destination: (kind, src, dst), in the order planned
+        self.entries = {}
+        self.overridden = []
+
+    def add(self, kind, src, dst):
+        key = os.path.normpath(dst)
+        previous = self.entries.pop(key, None)
+        if previous is not None and previous[1] != src:
+            self.overridden.append((dst, previous[1], src))
+        self.entries[key] = (kind, src, dst)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, dst):
+        return os.path.normpath(dst) in self.entries
+
+    def links(self):
+        return [(src, dst) for kind, src, dst in self.entries.values() if kind == 'link']
+
+    def groups(self):
+        """[(src, [dst, ...])] for the files, in the order first planned."""
+        groups = {}
+        for kind, src, dst in self.entries.values():
+            if kind == 'file':
+                groups.setdefault(os.path.normpath(src), (src, []))[1].append(dst)
+        return list(groups.values())
+
+class CopyEngine(object):
+    """Runs copies on a bounded pool of worker threads.
+
+    Inside a batch(), submit() queues a copy and returns at once; leaving
+    the outermost batch waits for every queued copy and re-raises the
+    first failure, in submission order. Outside a batch, or with a single
+    worker, submit() copies right away, just as a plain call would."""
+    # run() handles fewer calls than this one at a time: the thread
+    # handoffs cost more than a few small copies
+    min_parallel = 8
+
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self._executor = None
+        self._depth = 0
+        self._pending = []
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.workers, thread_name_prefix='llmanifest-copy')
+        return self._executor
+
+    def submit(self, function, *args):
+        if self._depth == 0 or self.workers == 1:
+            function(*args)
+        else:
+            self._pending.append(self._pool().submit(function, *args))
+
+    @contextmanager
+    def batch(self):
+        self._depth += 1
+        try:
+            yield
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                # already failing: let the queued copies finish quietly
+                self._wait(quiet=True)
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self._wait()
+
+    def _wait(self, quiet=False):
+        pending, self._pending = self._pending, []
+        concurrent.futures.wait(pending)
+        if not quiet:
+            for future in pending:
+                future.result()
+
+    def run(self, function, arglist, catch=(IOError, os.error)):
+        """Calls function(*args) for each args in arglist, concurrently, and
+        waits for them all. Returns [(args..., exception)] for the calls
+        that raised one of catch; anything else is re-raised."""
+        errors = []
+        if self.workers == 1 or len(arglist) < self.min_parallel:
+            for args in arglist:
+                try:
+                    function(*args)
+                except catch as why:
+                    errors.append(tuple(args) + (why,))
+            return errors
+        futures = [self._pool().submit(function, *args) for args in arglist]
+        concurrent.futures.wait(futures)
+        for args, future in zip(arglist, futures):
+            why = future.exception()
+            if why is None:
+                continue
+            if not isinstance(why, catch):
+                raise why
+            errors.append(tuple(args) + (why,))
+        return errors
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+# Dictionary size of each xz preset level, as listed in xz(1)
+_XZ_PRESET_DICT_SIZES = (256 << 10, 1 << 20, 2 << 20, 4 << 20, 4 << 20,
+                         8 << 20, 8 << 20, 16 << 20, 32 << 20, 64 << 20)
+_XZ_STREAM_FLAGS = b'\x00\x01'      # CRC32 checks
+_XZ_FILTER_LZMA2 = 0x21
+
+def _xz_varint(n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+def _xz_crc32(data):
+    return struct.pack('<I', zlib.crc32(data))
+
+def _xz_pad(size):
+    return b'\0' * (-size % 4)
+
+def _lzma2_dict_props(dict_size):
+    """The LZMA2 filter properties byte for dict_size."""
+    for bits in range(40):
+        if dict_size <= (2 | (bits & 1)) << (bits // 2 + 11):
+            return bytes((bits,))
+    return bytes((40,))
+
+def compress_xz_block(data, preset, dict_size):
+    """Compresses data as the raw LZMA2 payload of one xz block. Returns
+    (compressed, crc32 of data). Runs in a worker process."""
+    compressed = lzma.compress(data, format=lzma.FORMAT_RAW,
+                               filters=[dict(id=lzma.FILTER_LZMA2, preset=preset,
+                                             dict_size=dict_size)])
+    return compressed, zlib.crc32(data)
+
+class ParallelXZWriter(object):
+    """A write-only binary file that compresses everything written to it into
+    fileobj as a single .xz stream of independent blocks, compressing up to
+    workers blocks at a time in worker processes -- the same layout as
+    xz --threads produces, so any xz decoder (and tar -xJf) can read it.
+
+    Blocks are block_size bytes of input, by default three times the
+    preset's dictionary, as xz uses; larger blocks compress slightly
+    better, smaller ones give more parallelism."""
+    def __init__(self, fileobj, preset=6, block_size=None, workers=None):
+        self.fileobj = fileobj
+        self.preset = preset
+        self.dict_size = _XZ_PRESET_DICT_SIZES[preset & 0xf]
+        self.block_size = block_size or max(3 * self.dict_size, 1 << 20)
+        # no point in a dictionary bigger than the block
+        self.dict_size = min(self.dict_size, max(self.block_size, 4096))
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.records = []               # (unpadded size, uncompressed size)
+        self.size = 0                   # compressed bytes written
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._executor = None
+        self.closed = False
+        self._write(b'\xfd7zXZ\x00' + _XZ_STREAM_FLAGS + _xz_crc32(_XZ_STREAM_FLAGS))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.size += len(data)
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed ParallelXZWriter")
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def _submit(self, data):
+        if self.workers == 1:
+            self._write_block(len(data), compress_xz_block(data, self.preset, self.dict_size))
+            return
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+        # keep every worker busy, but hold no more than two blocks each
+        while len(self._pending) >= 2 * self.workers:
+            self._finish_oldest()
+        self._pending.append((len(data), self._executor.submit(
+            compress_xz_block, data, self.preset, self.dict_size)))
+
+    def _finish_oldest(self):
+        size, future = self._pending.popleft()
+        self._write_block(size, future.result())
+
+    def _write_block(self, size, result):
+        compressed, crc = result
+        header = bytearray(b'\0\xc0')   # one filter; both sizes present
+        header += _xz_varint(len(compressed)) + _xz_varint(size)
+        header += _xz_varint(_XZ_FILTER_LZMA2) + b'\x01' + _lzma2_dict_props(self.dict_size)
+        header += _xz_pad(len(header) + 4)
+        header[0] = (len(header) + 4) // 4 - 1
+        header += _xz_crc32(header)
+        self._write(bytes(header))
+        self._write(compressed)
+        self._write(_xz_pad(len(compressed)) + struct.pack('<I', crc))
+        self.records.append((len(header) + len(compressed) + 4, size))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._finish_oldest()
+            index = bytearray(b'\0' + _xz_varint(len(self.records)))
+            for unpadded, size in self.records:
+                index += _xz_varint(unpadded) + _xz_varint(size)
+            index += _xz_pad(len(index))
+            index += _xz_crc32(index)
+            self._write(bytes(index))
+            footer = struct.pack('<I', len(index) // 4 - 1) + _XZ_STREAM_FLAGS
+            self._write(_xz_crc32(footer) + footer + b'YZ')
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Stops without finishing the stream."""
+        self.closed = True
+        for size, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+class ManifestTracer(object):
+    """Times the steps of a manifest run and counts what they did.
+
+    Each span() becomes a Chrome trace event: write() saves them as a
+    trace-event JSON file, for chrome://tracing or ui.perfetto.dev, and
+    summary() totals them by category. Spans may come from any thread;
+    the copy engine's show up as their own tracks. When not enabled,
+    spans and counts cost next to nothing and nothing is recorded."""
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.events = []
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """Times the body as an event called name; the body may add to the
+        args dict it gets, which the trace shows with the event."""
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add(name, category, start, time.perf_counter(), **args)
+
+    def add(self, name, category, start, end, **args):
+        """Records an event for a span timed by the caller, in
+        time.perf_counter() seconds."""
+        if not self.enabled:
+            return
+        event = dict(name=name, cat=category, ph='X', pid=os.getpid(),
+                     tid=threading.get_ident(),
+                     ts=(start - self.origin) * 1e6, dur=(end - start) * 1e6,
+                     args=args)
+        with self._lock:
+            self.events.append(event)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def write(self, filename):
+        threads = dict((event['tid'], None) for event in self.events)
+        main = threading.main_thread().ident
+        names = [dict(name='thread_name', ph='M', pid=os.getpid(), tid=tid,
+                      args=dict(name='main' if tid == main else 'worker %d' % i))
+                 for i, tid in enumerate(threads)]
+        with open(filename, 'w') as f:
+            json.dump(dict(traceEvents=names + self.events, displayTimeUnit='ms',
+                           otherData=dict(self.counters)), f)
+
+    def summary(self, slowest=10):
+        """The report printed at the end of a traced run, as a list of lines."""
+        totals = defaultdict(lambda: [0, 0.0, 0.0])
+        for event in self.events:
+            total = totals[event['cat']]
+            total[0] += 1
+            total[1] += event['dur'] / 1e6
+            total[2] = max(total[2], event['dur'] / 1e6)
+        lines = ["%-14s %8s %10s %10s" % ('category', 'count', 'total s', 'max s')]
+        for category, (count, seconds, longest) in sorted(
+                totals.items(), key=lambda item: -item[1][1]):
+            lines.append("%-14s %8d %10.3f %10.3f" % (category, count, seconds, longest))
+        events = sorted(self.events, key=lambda event: -event['dur'])[:slowest]
+        if events:
+            lines.append("slowest:")
+            lines.extend("  %8.3f s  %-10s %s" % (event['dur'] / 1e6, event['cat'], event['name'])
+                         for event in events)
+        if self.counters:
+            lines.append("counters:")
+            lines.extend("  %-28s %12d" % (name, value)
+                         for name, value in sorted(self.counters.items()))
+        return lines
+
 class LLManifest(object, metaclass=LLManifestRegistry):
     manifests = {}
+    # Set in a subclass whose construct() never looks at the files it has
+    # copied, to have copy_action() plan the copies instead, and run them
+    # together (see flush_copies()) before anything that might look: a
+    # command, put_in_file(), remove(), created_path() and finish().
+    defer_copies = False
+
     def for_platform(self, platform, arch = None):
         if arch:
             platform = platform + '_' + arch + '_'
@@ -331,6 +1341,8 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         self.args = args
         self.file_list = []
         self.excludes = []
+        self._exclude_matcher = None
+        self.exclude_hits = defaultdict(set)
         self.actions = []
         self.src_prefix = [args['source']]
         self.artwork_prefix = [args['artwork']]
@@ -339,6 +1351,28 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         self.created_paths = []
         self.package_name = "Unknown"
         self.missing = []
+        self.copy_engine = CopyEngine(
+            int(args.get('copy_workers') or get_default_copy_workers(None)))
+        # packaging modifies files in the destination tree in place (chmod,
+        # strip, signing), which mustn't reach the sources through links
+        self.file_copier = FileCopier(args.get('copy_strategy') or 'auto',
+                                      hardlinks='package' not in args.get('actions', ()),
+                                      store=(ContentStore(args['content_store'])
+                                             if args.get('content_store') else None))
+        # what's in the source directories; what's in the destination tree
+        # is always looked up afresh
+        self.dir_index = DirectoryIndex()
+        self.build_state = BuildState(args.get('state_file', self.default_state_file()))
+        # with --plan, work out what would change without changing anything
+        self.planning = 'plan' in args
+        self.plan = []
+        self.pending_copies = CopyPlan()
+        self.tracer = ManifestTracer(enabled=bool(args.get('trace')))
+
+    def default_state_file(self):
+        dest = os.path.abspath(self.args['dest'])
+        return os.path.join(os.path.dirname(dest),
+                            '.%s.manifest-state' % os.path.basename(dest))
 
     def default_channel(self):
         return self.args.get('channel', None) == RELEASE_CHANNEL
@@ -352,6 +1386,15 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         """ Excludes all files that match the glob from being included
         in the file list by path()."""
         self.excludes.append(glob)
+        self._exclude_matcher = None
+
+    def exclude_matcher(self):
+        """self.excludes, compiled."""
+        matcher = self._exclude_matcher
+        if matcher is None or matcher.patterns != self.excludes:
+            matcher = self._exclude_matcher = ExcludeMatcher(self.excludes,
+                                                             self.exclude_hits)
+        return matcher
 
     def prefix(self, src='', build='', dst='', src_dst=None):
         """
@@ -427,6 +1470,14 @@ class LLManifest(object, metaclass=LLManifestRegistry):
             # entry to each prefix stack, capture len()-1.
             self.prevlen = { stack: len(getattr(self.manifest, stack)) - 1
                              for stack in self.stacks }
+            self.start = None
+
+        def describe(self):
+            return "prefix(%s)" % ", ".join(
+                "%s=%r" % (name, getattr(self.manifest, stack)[-1])
+                for name, stack in (("src", "src_prefix"), ("build", "build_prefix"),
+                                    ("dst", "dst_prefix"))
+                if getattr(self.manifest, stack)[-1])
 
         def __bool__(self):
             # If the caller wrote:
@@ -435,6 +1486,8 @@ class LLManifest(object, metaclass=LLManifestRegistry):
             return True
 
         def __enter__(self):
+            self.start = time.perf_counter()
+            self.name = self.describe()
             # nobody uses 'with self.prefix(...) as variable:'
             return None
 
@@ -444,6 +1497,10 @@ class LLManifest(object, metaclass=LLManifestRegistry):
             if type is not None:
                 return False
 
+            if self.start is not None:
+                self.manifest.tracer.add(self.name, 'prefix', self.start,
+                                         time.perf_counter())
+
             # Okay, 'with' block completed successfully. Restore previous
             # state of each of the prefix stacks in self.stacks.
             # Note that we do NOT simply call pop() on them as end_prefix()
@@ -540,10 +1597,16 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         Runs an external command.  
         Raises ManifestError exception if the command returns a nonzero status.
         """
+        self.flush_copies()
+        if self.planning:
+            print("Would run command:", command)
+            return
         print("Running command:", command)
         sys.stdout.flush()
         try:
-            subprocess.check_call(command)
+            with self.tracer.span(os.path.basename(command[0]), 'command',
+                                  command=' '.join(command)):
+                subprocess.check_call(command)
         except subprocess.CalledProcessError as err:
             raise ManifestError( "Command %s returned non-zero status (%s)"
                                 % (command, err.returncode) )
@@ -554,10 +1617,16 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         Runs an external command.  
         Raises ManifestError exception if the command returns a nonzero status.
         """
+        self.flush_copies()
+        if self.planning:
+            print("Would run command:", command)
+            return
         print("Running command:", command)
         sys.stdout.flush()
         try:
-            subprocess.check_call(command, shell=True)
+            with self.tracer.span(command.split(None, 1)[0] if command.strip() else command,
+                                  'command', command=command):
+                subprocess.check_call(command, shell=True)
         except subprocess.CalledProcessError as err:
             raise ManifestError( "Command %s returned non-zero status (%s)"
                                 % (command, err.returncode) )
@@ -567,16 +1636,31 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         """ Declare that you've created a path in order to
           a) verify that you really have created it
           b) schedule it for cleanup"""
+        self.flush_copies()
         if not os.path.exists(path):
             raise ManifestError("Should be something at path " + path)
+        self.dir_index.invalidate(path)
         self.created_paths.append(path)
 
     def put_in_file(self, contents, dst, src=None):
         # write contents as dst
         dst_path = self.dst_path_of(dst)
+        self.flush_copies()
+        if self.planning:
+            self.plan.append(('write', dst_path, src))
+            if src:
+                self.file_list.append([src, dst_path])
+            return dst_path
         self.cmakedirs(os.path.dirname(dst_path))
+        # dst_path might be a hard link to a source file: replace, don't rewrite
+        try:
+            os.unlink(dst_path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
         with open(dst_path, 'wb') as f:
             f.write(contents)
+        self.dir_index.invalidate(dst_path)
 
         # Why would we create a file in the destination tree if not to include
         # it in the installer? The default src=None (plus the fact that the
@@ -598,14 +1682,69 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         self.created_paths.append(dst)
 
     def copy_action(self, src, dst):
-        if src and (os.path.exists(src) or os.path.islink(src)):
+        with self.tracer.span(self._relative_dst_path(dst), 'copy_action', src=src):
+            self._copy_action(src, dst)
+
+    def _copy_action(self, src, dst):
+        if src and self.dir_index.lexists(src):
             # ensure that destination path exists
             self.cmakedirs(os.path.dirname(dst))
             self.created_paths.append(dst)
-            self.ccopymumble(src, dst)
+            if self.dir_index.islink(src):
+                if self.defer_copies:
+                    self.pending_copies.add('link', src, dst)
+                else:
+                    self.ccopymumble(src, dst)
+            elif self.dir_index.isfile(src):
+                if self.defer_copies:
+                    self.pending_copies.add('file', src, dst)
+                else:
+                    # within a path() call, regular files copy concurrently
+                    self.copy_engine.submit(self.ccopyfile, src, dst)
+            else:
+                # a whole tree: plans can't say what it will overwrite
+                self.flush_copies()
+                self.ccopymumble(src, dst)
         else:
             print("Doesn't exist:", src)
 
+    def flush_copies(self):
+        """Runs the copies copy_action() has planned, if any, as a CopyPlan:
+        reports destinations planned more than once, makes the links, and
+        copies each source once, on the copy engine's threads, to the first
+        of its destinations and from there to the others. Copy errors are
+        collected and raised together, as by ccopytree()."""
+        plan = self.pending_copies
+        if not len(plan):
+            return
+        self.pending_copies = CopyPlan()
+        for dst, old, new in plan.overridden:
+            print("Copy plan: %s comes from %s, not %s" % (
+                self._relative_dst_path(dst), new, old))
+        links = plan.links()
+        groups = plan.groups()
+        files = sum(len(dsts) for src, dsts in groups)
+        print("Copy plan: %d files from %d sources (%d duplicates), %d links" % (
+            files, len(groups), files - len(groups), len(links)))
+        sys.stdout.flush()
+        with self.tracer.span('flush_copies', 'copy', files=files, sources=len(groups),
+                              links=len(links)):
+            for src, dst in links:
+                self.ccopymumble(src, dst)
+            errors = self.copy_engine.run(self._copy_group, groups)
+        self.tracer.count('duplicate copies', files - len(groups))
+        if errors:
+            raise ManifestError(errors)
+
+    def _copy_group(self, src, dsts):
+        self.ccopyfile(src, dsts[0])
+        for dst in dsts[1:]:
+            if self.planning:
+                # nothing was copied to read back
+                self.ccopyfile(src, dst)
+            else:
+                self._copy_if_changed(dsts[0], dst)
+
     def package_action(self, src, dst):
         pass
 
@@ -613,6 +1752,7 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         """
         generic finish, always called before the ${action}_finish() methods
         """
+        self.flush_copies()
         # Collecting MissingFile instances in self.missing, and checking that
         # here, is intended to minimize the number of (potentially lengthy)
         # build cycles a developer must run in order to fix missing-files
@@ -660,6 +1800,46 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         tf.add(self.get_dst_prefix(), "")
         tf.close()
 
+    def xz_tarball(self, tarname, root, arcname, excludes=(), preset=6):
+        """Writes the tree root to tarname as a .tar.xz whose top directory
+        is arcname, as 'tar --numeric-owner -cJf tarname arcname' would,
+        but compressing blocks of it on compress_workers processes.
+        excludes are tar --exclude patterns: each one is matched against
+        the archive path of everything and each of its trailing parts, and
+        leaves out the matches along with their contents."""
+        self.flush_copies()
+        if self.planning:
+            print("Would write %s from %s" % (tarname, root))
+            return
+        print("Creating %s from %s" % (tarname, root))
+        sys.stdout.flush()
+        excluded = []
+        def tar_filter(tarinfo):
+            parts = tarinfo.name.split('/')
+            for i in range(len(parts)):
+                tail = '/'.join(parts[i:])
+                if any(fnmatch.fnmatchcase(tail, pattern) for pattern in excludes):
+                    excluded.append(tarinfo.name)
+                    return None
+            # --numeric-owner: don't reveal who built it
+            tarinfo.uname = tarinfo.gname = ''
+            return tarinfo
+        workers = int(self.args.get('compress_workers') or 0) or None
+        try:
+            with open(tarname, 'wb') as f, \
+                 ParallelXZWriter(f, preset=preset, workers=workers) as xz:
+                with tarfile.open(fileobj=xz, mode='w|', format=tarfile.GNU_FORMAT) as tf:
+                    tf.add(root, arcname, filter=tar_filter)
+        except BaseException:
+            if os.path.exists(tarname):
+                os.remove(tarname)
+            raise
+        for name in excluded:
+            print("Excluded %s" % name)
+        print("Wrote %s: %d bytes in %d blocks on %d processes" %
+              (tarname, xz.size, len(xz.records), xz.workers))
+        return tarname
+
     def cleanup_finish(self):
         """ Delete paths that were specified to have been created by this script"""
         for c in self.created_paths:
@@ -669,7 +1849,7 @@ class LLManifest(object, metaclass=LLManifestRegistry):
     def process_either(self, src, dst):
         # If it's a real directory, recurse through it --
         # but not a symlink! Handle those like files.
-        if os.path.isdir(src) and not os.path.islink(src):
+        if self.dir_index.isdir(src) and not self.dir_index.islink(src):
             return self.process_directory(src, dst)
         else:
             return self.process_file(src, dst)
@@ -689,11 +1869,11 @@ class LLManifest(object, metaclass=LLManifestRegistry):
             return 0
 
     def process_directory(self, src, dst):
-        if not self.includes(src, dst):
+        if not self.includes_dir(src, dst):
             sys.stdout.write(" (excluding %r, %r)" % (src, dst))
             sys.stdout.flush()
             return 0
-        names = os.listdir(src)
+        names = self.dir_index.names(src)
         self.cmakedirs(dst)
         errors = []
         count = 0
@@ -704,13 +1884,26 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         return count
 
     def includes(self, src, dst):
-        if src:
-            for excl in self.excludes:
-                if fnmatch.fnmatch(src, excl):
-                    return False
+        if src and self.excludes:
+            return not self.exclude_matcher().excludes(src)
+        return True
+
+    def includes_dir(self, src, dst):
+        """Like includes(), but also False for a directory all of whose
+        contents would be excluded, so it needn't be listed."""
+        if src and self.excludes:
+            return not self.exclude_matcher().prunes(src)
         return True
 
+    def print_exclude_stats(self):
+        if not self.excludes:
+            return
+        print("Excludes:")
+        for excl in self.excludes:
+            print("  %6d %s" % (len(self.exclude_hits.get(excl, ())), excl))
+
     def remove(self, *paths):
+        self.flush_copies()
         for path in paths:
             if os.path.exists(path):
                 print("Removing path", path)
@@ -718,16 +1911,113 @@ class LLManifest(object, metaclass=LLManifestRegistry):
                     shutil.rmtree(path)
                 else:
                     os.remove(path)
+                self.dir_index.invalidate(path)
+
+    @contextmanager
+    def timed(self, step):
+        """Reports how long the body takes, as step."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.tracer.add(step, 'step', start, end)
+            print("%s took %.2f s" % (step, end - start))
+            sys.stdout.flush()
+
+    def normalize_permissions(self, root, file_modes, dir_mode=None):
+        """In one walk of root, gives each regular file whose permission
+        bits are a key of file_modes the corresponding value, and each
+        directory dir_mode, if given. Symlinks are left alone. Returns
+        the number of paths changed."""
+        self.flush_copies()
+        changed = 0
+        dirs = [root]
+        if dir_mode is not None and stat.S_IMODE(os.stat(root).st_mode) != dir_mode:
+            os.chmod(root, dir_mode)
+            changed += 1
+        while dirs:
+            with os.scandir(dirs.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                        if dir_mode is None:
+                            continue
+                        mode = stat.S_IMODE(entry.stat(follow_symlinks=False).st_mode)
+                        new = dir_mode
+                    elif entry.is_file(follow_symlinks=False):
+                        mode = stat.S_IMODE(entry.stat(follow_symlinks=False).st_mode)
+                        new = file_modes.get(mode, mode)
+                    else:
+                        continue
+                    if new != mode:
+                        os.chmod(entry.path, new)
+                        changed += 1
+        return changed
+
+    def elf_files(self, dirs):
+        """The regular files under dirs that start with the ELF magic
+        number: the executables and libraries strip can work on, whatever
+        they are called."""
+        self.flush_copies()
+        found = []
+        dirs = [dir for dir in reversed(dirs) if os.path.isdir(dir)]
+        while dirs:
+            with os.scandir(dirs.pop()) as entries:
+                for entry in sorted(entries, key=operator.attrgetter('name')):
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        with open(entry.path, 'rb') as f:
+                            if f.read(4) == ELF_MAGIC:
+                                found.append(entry.path)
+        return found
+
+    def strip_files(self, files, options=('-S',), batch=64):
+        """Runs strip over files, up to batch of them per command, with a
+        command per core running at once. Raises ManifestError, with strip's
+        output, if it fails on any of them: a binary that can't be stripped
+        mustn't go into a release package unnoticed."""
+        self.flush_copies()
+        if self.planning:
+            print("Would strip %d files" % len(files))
+            return
+        workers = os.cpu_count() or 1
+        # enough batches to keep every worker busy
+        batch = max(1, min(batch, -(-len(files) // workers)))
+        batches = [files[i:i + batch] for i in range(0, len(files), batch)]
+        print("Stripping %d files in %d batches" % (len(files), len(batches)))
+        sys.stdout.flush()
+        def strip(paths):
+            return subprocess.run(['strip'] + list(options) + paths,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        failures = []
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for result in executor.map(strip, batches):
+                if result.returncode:
+                    failures.append("strip returned %s:\n%s" %
+                                    (result.returncode, result.stdout.decode(errors='replace')))
+        if failures:
+            raise ManifestError("\n".join(failures))
 
     def ccopymumble(self, src, dst):
         """Copy a single symlink, file or directory."""
         if os.path.islink(src):
             linkto = os.readlink(src)
+            if os.path.islink(dst) and os.readlink(dst) == linkto:
+                # already right; leaving it alone also leaves its directory's
+                # mtime alone, which build_state relies on
+                return
+            if self.planning:
+                self.plan.append(('link', dst, linkto))
+                return
             if os.path.islink(dst) or os.path.isfile(dst):
                 os.remove(dst)  # because symlinking over an existing link fails
             elif os.path.isdir(dst):
                 shutil.rmtree(dst)
             os.symlink(linkto, dst)
+            self.dir_index.invalidate(dst)
+            self.tracer.count('links made')
         elif os.path.isdir(src):
             self.ccopytree(src, dst)
         else:
@@ -736,18 +2026,38 @@ class LLManifest(object, metaclass=LLManifestRegistry):
             # YYY would we put such things into a viewer package?!
 
     def ccopyfile(self, src, dst):
-        """ Copy a single file.  Uses filecmp to skip copying for existing files."""
+        """ Copy a single file with self.file_copier, unless it's excluded.
+        Skips files that are already up to date."""
+        # only copy if it's not excluded
+        if self.includes(src, dst):
+            self._copy_if_changed(src, dst)
+
+    def _copy_if_changed(self, src, dst):
         # Don't recopy file if it's up-to-date.
         # If we seem to be not not overwriting files that have been
         # updated, set the last arg to False, but it will take longer.
 ##      reldst = (dst[len(self.dst_prefix[0]):]
 ##                if dst.startswith(self.dst_prefix[0])
 ##                else dst).lstrip(r'\/')
-        if os.path.exists(dst) and filecmp.cmp(src, dst, True):
+        # A copy-only run may have hardlinked dst to src. Packaging changes
+        # files in place (chmod, strip, signing), which would change the
+        # source too, so such a dst is copied again however current it is.
+        linked = not self.file_copier.hardlinks and is_hardlinked(dst)
+        up_to_date, st = self.build_state.up_to_date(src, dst)
+        if up_to_date and not linked:
+            self.build_state.record(src, dst, st)
+            self.tracer.count('up to date (state file)')
+            return
+        exists = os.path.exists(dst)
+        if exists and not linked and filecmp.cmp(src, dst, True):
 ##          print "{} (skipping, {} exists)".format(src, reldst)
+            self.build_state.record(src, dst, st)
+            self.tracer.count('up to date (compared)')
             return
-        # only copy if it's not excluded
-        if self.includes(src, dst):
+        if self.planning:
+            self.plan.append(('change' if exists else 'new', dst, src))
+            return
+        with self.tracer.span(os.path.basename(dst), 'copy', src=src, dst=dst) as trace:
             try:
                 os.unlink(dst)
             except OSError as err:
@@ -755,28 +2065,47 @@ class LLManifest(object, metaclass=LLManifestRegistry):
                     raise
 
 ##          print "{} => {}".format(src, reldst)
-            shutil.copy2(src, dst)
+            trace['method'] = self.file_copier.copy(src, dst)
+            self.dir_index.invalidate(dst)
+            self.build_state.record(src, dst)
+            if self.tracer.enabled:
+                trace['bytes'] = st.st_size if st is not None else os.path.getsize(dst)
+                self.tracer.count('files copied')
+                self.tracer.count('bytes copied', trace['bytes'])
 
     def ccopytree(self, src, dst):
         """Direct copy of shutil.copytree with the additional
         feature that the destination directory can exist.  It
         is so dumb that Python doesn't come with this. Also it
-        implements the excludes functionality."""
-        if not self.includes(src, dst):
+        implements the excludes functionality. Directories and
+        symlinks are made as the tree is walked; the files are
+        then copied on the copy engine's threads."""
+        if not self.includes_dir(src, dst):
             return
-        names = os.listdir(src)
+        files = []
+        errors = self._ccopytree_walk(src, dst, files)
+        errors.extend(self.copy_engine.run(self.ccopyfile, files))
+        if errors:
+            raise ManifestError(errors)
+
+    def _ccopytree_walk(self, src, dst, files):
+        names = self.dir_index.names(src)
         self.cmakedirs(dst)
         errors = []
         for name in names:
             srcname = os.path.join(src, name)
             dstname = os.path.join(dst, name)
             try:
-                self.ccopymumble(srcname, dstname)
+                if self.dir_index.isdir(srcname) and not self.dir_index.islink(srcname):
+                    if self.includes_dir(srcname, dstname):
+                        errors.extend(self._ccopytree_walk(srcname, dstname, files))
+                elif self.dir_index.islink(srcname):
+                    self.ccopymumble(srcname, dstname)
+                else:
+                    files.append((srcname, dstname))
             except (IOError, os.error) as why:
                 errors.append((srcname, dstname, why))
-        if errors:
-            raise ManifestError(errors)
-
+        return errors
 
     def cmakedirs(self, path):
         """Ensures that a directory exists, and doesn't throw an exception
@@ -784,8 +2113,10 @@ class LLManifest(object, metaclass=LLManifestRegistry):
 #        print "making path: ", path
         path = os.path.normpath(path)
         self.created_paths.append(path)
-        if not os.path.exists(path):
+        if not self.planning and not os.path.exists(path):
             os.makedirs(path)
+            for ancestor in path_ancestors(path):
+                self.dir_index.invalidate(ancestor)
 
     def find_existing_file(self, *list):
         for f in list:
@@ -801,6 +2132,7 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         """ Extracts the contents of the tarfile (specified
         relative to the source prefix) into the directory
         specified relative to the destination directory."""
+        self.flush_copies()
         self.check_file_exists(src_tar)
         tf = tarfile.open(self.src_path_of(src_tar), 'r')
         for member in tf.getmembers():
@@ -828,7 +2160,7 @@ class LLManifest(object, metaclass=LLManifestRegistry):
 
     wildcard_pattern = re.compile(r'\*')
     def expand_globs(self, src, dst):
-        src_list = glob.glob(src)
+        src_list = self.dir_index.glob(src)
         src_re, d_template = self.wildcard_regex(src.replace('\\', '/'),
                                                  dst.replace('\\', '/'))
         for s in src_list:
@@ -852,6 +2184,20 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         """
         return self.path(os.path.join(path, file), file)
 
+    def _try_path(self, src, dst):
+        """Processes src, a glob or a single path, into dst. Returns the
+        number of files processed, which is 0 if there's no such path; the
+        lookups are answered from self.dir_index."""
+        # expand globs
+        count = 0
+        if self.wildcard_pattern.search(src):
+            for s,d in self.expand_globs(src, dst):
+                assert(s != d)
+                count += self.process_file(s, d)
+        elif self.dir_index.lexists(src):
+            count += self.process_either(src, dst)
+        return count
+
     def path(self, src, dst=None):
         sys.stdout.flush()
         if src == None:
@@ -861,37 +2207,32 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         dst = os.path.join(self.get_dst_prefix(), dst)
         sys.stdout.write("Processing %s => %s ... " % (src, self._relative_dst_path(dst)))
 
-        def try_path(src):
-            # expand globs
-            count = 0
-            if self.wildcard_pattern.search(src):
-                for s,d in self.expand_globs(src, dst):
-                    assert(s != d)
-                    count += self.process_file(s, d)
-            else:
-                # if we're specifying a single path (not a glob),
-                # we should error out if it doesn't exist
-                self.check_file_exists(src)
-                count += self.process_either(src, dst)
-            return count
-
         try_prefixes = [self.get_src_prefix(), self.get_artwork_prefix(), self.get_build_prefix()]
-        for pfx in try_prefixes:
-            try:
-                count = try_path(os.path.join(pfx, src))
-            except MissingError:
-                # if we produce MissingError, just try the next prefix
-                continue
-            # If we actually found nonzero files, stop looking
-            if count:
-                break
-        else:
-            # no more prefixes left to try
-            print(("\nunable to find '%s'; looked in:\n  %s" % (src, '\n  '.join(try_prefixes))))
-            self.missing.append(MissingFile(pattern=src, tried=try_prefixes))
-            # At this point 'count' might never have been successfully
-            # assigned! Even if it was, though, we can be sure it is 0.
-            return 0
+        # the files found are copied concurrently, and all copied by the
+        # time we leave this block
+        with self.tracer.span(src, 'path', dst=self._relative_dst_path(dst)) as trace, \
+             self.copy_engine.batch():
+            for pfx in try_prefixes:
+                try:
+                    count = self._try_path(os.path.join(pfx, src), dst)
+                except MissingError:
+                    # an action found something missing: try the next prefix
+                    continue
+                # If we actually found nonzero files, stop looking
+                if count:
+                    trace.update(files=count, prefix=pfx)
+                    if pfx != try_prefixes[0]:
+                        self.tracer.count('prefix fallbacks')
+                    break
+            else:
+                trace['files'] = 0
+                # no more prefixes left to try
+                print(("\nunable to find '%s'; looked in:\n  %s" % (src, '\n  '.join(try_prefixes))))
+                self.missing.append(MissingFile(pattern=src, tried=try_prefixes))
+                self.tracer.count('missing paths')
+                # At this point 'count' might never have been successfully
+                # assigned! Even if it was, though, we can be sure it is 0.
+                return 0
 
         print("%d files" % count)
 
@@ -908,33 +2249,27 @@ class LLManifest(object, metaclass=LLManifestRegistry):
         dst = os.path.join(self.get_dst_prefix(), dst)
         sys.stdout.write("Processing %s => %s ... " % (src, self._relative_dst_path(dst)))
 
-        def try_path(src):
-            # expand globs
-            count = 0
-            if self.wildcard_pattern.search(src):
-                for s,d in self.expand_globs(src, dst):
-                    assert(s != d)
-                    count += self.process_file(s, d)
-            else:
-                # if we're specifying a single path (not a glob),
-                # we should error out if it doesn't exist
-                self.check_file_exists(src)
-                count += self.process_either(src, dst)
-            return count
-
         try_prefixes = [self.get_src_prefix(), self.get_artwork_prefix(), self.get_build_prefix()]
-        for pfx in try_prefixes:
-            try:
-                count = try_path(os.path.join(pfx, src))
-            except MissingError:
-                # if we produce MissingError, just try the next prefix
-                continue
-            # If we actually found nonzero files, stop looking
-            if count:
-                break
-        else:
-            sys.stdout.write("Skipping %s\n" % (src))
-            return 0
+        # the files found are copied concurrently, and all copied by the
+        # time we leave this block
+        with self.tracer.span(src, 'path_optional', dst=self._relative_dst_path(dst)) as trace, \
+             self.copy_engine.batch():
+            for pfx in try_prefixes:
+                try:
+                    count = self._try_path(os.path.join(pfx, src), dst)
+                except MissingError:
+                    # an action found something missing: try the next prefix
+                    continue
+                # If we actually found nonzero files, stop looking
+                if count:
+                    trace.update(files=count, prefix=pfx)
+                    if pfx != try_prefixes[0]:
+                        self.tracer.count('prefix fallbacks')
+                    break
+            else:
+                trace['files'] = 0
+                sys.stdout.write("Skipping %s\n" % (src))
+                return 0
 
         print("%d files" % count)
 
@@ -944,13 +2279,56 @@ class LLManifest(object, metaclass=LLManifestRegistry):
 
     def do(self, *actions):
         self.actions = actions
-        self.construct()
-        # perform finish actions
-        # generic finish first
-        self.finish()
-        for action in self.actions:
-            methodname = action + "_finish"
-            method = getattr(self, methodname, None)
-            if method is not None:
-                method()
+        try:
+            with self.tracer.span('construct', 'construct'):
+                self.construct()
+                self.flush_copies()
+            # perform finish actions
+            # generic finish first
+            with self.tracer.span('finish', 'finish'):
+                self.finish()
+            if self.planning:
+                self.print_plan()
+                return self.file_list
+            for action in self.actions:
+                methodname = action + "_finish"
+                method = getattr(self, methodname, None)
+                if method is not None:
+                    with self.tracer.span(methodname, 'finish'):
+                        method()
+        finally:
+            self.copy_engine.shutdown()
+            if not self.planning:
+                self.build_state.save()
+            if self.tracer.enabled:
+                # written even when the run fails, to show how far it got
+                self.print_trace()
+        if self.file_copier.counts:
+            print("Copied files by %s: %s" % (self.file_copier.strategy,
+                                                self.file_copier.summary()))
+        self.print_exclude_stats()
         return self.file_list
+
+    def print_trace(self):
+        """Writes the --trace file and prints its summary."""
+        self.tracer.count('directory scans', self.dir_index.scans)
+        self.tracer.write(self.args['trace'])
+        print("Trace written to %s:" % self.args['trace'])
+        for line in self.tracer.summary():
+            print("  " + line)
+
+    def print_plan(self):
+        """Report what --plan found would change."""
+        counts = defaultdict(int)
+        for change, dst, src in sorted(self.plan, key=operator.itemgetter(1)):
+            counts[change] += 1
+            print("%-6s %s <= %s" % (change, self._relative_dst_path(dst), src))
+        planned = set(dst for change, dst, src in self.plan)
+        stale = [dst for dst in self.build_state.stale()
+                 if dst not in planned and os.path.exists(dst)]
+        for dst in stale:
+            print("%-6s %s" % ('stale', self._relative_dst_path(dst)))
+        print("Plan: %d new, %d changed, %d links, %d written, %d unchanged, "
+              "%d no longer produced" % (
+                  counts['new'], counts['change'], counts['link'], counts['write'],
+                  len(self.build_state.current), len(stale)))
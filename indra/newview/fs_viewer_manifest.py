@@ -91,10 +91,13 @@ class FSViewerManifest:
 
         self.fs_save_symbols("linux")
 
-    def fs_linux_tar_excludes(self):
+    def fs_linux_tar_exclude_patterns(self):
         installer_name_components = ['Phoenix',self.app_name(),self.args.get('arch'),'.'.join(self.args['version'])]
         installer_name = "_".join(installer_name_components)
-        return "--exclude=%s/bin/.debug" % installer_name
+        return ["%s/bin/.debug" % installer_name]
+
+    def fs_linux_tar_excludes(self):
+        return " ".join("--exclude=%s" % pattern for pattern in self.fs_linux_tar_exclude_patterns())
 
     def fs_save_windows_symbols(self):
         self.fs_save_symbols("windows")
@@ -164,39 +167,70 @@ class FSViewerManifest:
 
             os.rename("%s/firestorm-symbols-%s-%d.tar.bz2" % (self.args['configuration'].lower(), osname, self.address_size), sName)
 
-    def fs_generate_breakpad_symbols_for_file( self, aFile ):
+    def fs_breakpad_cache_key( self, aFile ):
+        # the build-id identifies an ELF file's code without reading all of it
+        from indra.util.llmanifest import elf_build_id
+        import hashlib
+
+        buildId = elf_build_id( aFile )
+        if buildId:
+            return "buildid-" + buildId
+
+        sha = hashlib.sha256()
+        with open( aFile, "rb" ) as f:
+            for chunk in iter( lambda: f.read( 1 << 20 ), b"" ):
+                sha.update( chunk )
+        return "sha256-" + sha.hexdigest()
+
+    def fs_generate_breakpad_symbols_for_file( self, aFile, cacheDir ):
+        """Dumps the breakpad symbols of aFile into symbols/, reusing the copy
+        in cacheDir from an earlier build of the same file if there is one.
+        Returns (cache entry name, whether it came from the cache). If
+        dump_syms fails, that is reported, and nothing is dumped or cached."""
         from os import makedirs, remove
-        from os.path import join, isfile
+        from os.path import basename, join, isfile
         import subprocess
-        from shutil import move
+        import tempfile
+        from shutil import copyfile
 
         dumpSym = join( self.args["build"], "..", "packages", "bin", "dump_syms" )
-        if not isfile( dumpSym ):
-            return
-
-        symbolFile = aFile +".sym"
 
-        with open( symbolFile, "w") as outfile:
-            subprocess.call( [dumpSym, aFile ], stdout=outfile )
-
-        firstline = open( symbolFile ).readline().strip()
+        cacheName = "%s-%s.sym" % ( self.fs_breakpad_cache_key( aFile ), basename( aFile ) )
+        cached = join( cacheDir, cacheName )
+        hit = isfile( cached )
+        if not hit:
+            fd, symbolFile = tempfile.mkstemp( dir=cacheDir, suffix=".tmp" )
+            try:
+                with os.fdopen( fd, "w" ) as outfile:
+                    result = subprocess.call( [dumpSym, aFile ], stdout=outfile )
+                if result != 0:
+                    # whatever it wrote may be truncated: don't keep it
+                    print( "WARNING: dump_syms returned %s for %s; no symbols saved" %
+                           ( result, aFile ) )
+                    return cacheName, False
+                # also cached when empty: dump_syms succeeded, and the file
+                # has no symbols to dump
+                os.replace( symbolFile, cached )
+            finally:
+                if isfile( symbolFile ):
+                    remove( symbolFile )
+
+        with open( cached ) as f:
+            firstline = f.readline().strip()
 
         if firstline != "":
-            module, os, bitness, hash, filename = firstline.split(" ")
+            module, os_, bitness, hash, filename = firstline.split(" ")
             symbolDir = join( "symbols", filename, hash )
-            try:
-                makedirs( symbolDir )
-            except:
-                pass
-            move( symbolFile, symbolDir )
+            makedirs( symbolDir, exist_ok=True )
+            copyfile( cached, join( symbolDir, basename( aFile ) + ".sym" ) )
 
-        if isfile( symbolFile ):
-            remove( symbolFile )
+        return cacheName, hit
 
     def fs_save_breakpad_symbols(self, osname):
         from glob import glob
-        import sys
-        from os.path import isdir, join
+        import concurrent.futures
+        import hashlib
+        from os.path import isdir, isfile, join
         from shutil import rmtree
         import tarfile
 
@@ -207,19 +241,46 @@ class FSViewerManifest:
         if isdir( "symbols" ):
             rmtree( "symbols" )
 
-        files =  glob( "%s/bin/*" % self.args['dest'] )
-        for f in files:
-            self.fs_generate_breakpad_symbols_for_file( f )
+        dumpSym = join( self.args["build"], "..", "packages", "bin", "dump_syms" )
+        if not isfile( dumpSym ):
+            return
 
-        files =  glob( "%s/lib/*.so" % self.args['dest'] )
-        for f in files:
-            if f.find( "libcef.so" ) == -1:
-                self.fs_generate_breakpad_symbols_for_file( f )
+        # dump_syms only reads bin/* and lib/*.so, so skip directories
+        files = [f for f in glob( "%s/bin/*" % self.args['dest'] ) if isfile( f )]
+        files += [f for f in glob( "%s/lib/*.so" % self.args['dest'] )
+                  if f.find( "libcef.so" ) == -1 and isfile( f )]
+
+        # Symbols are kept between builds, keyed by build-id or content; a
+        # different dump_syms starts a new cache
+        st = os.stat( dumpSym )
+        tag = hashlib.sha256( ( "%s %d %d" % ( os.path.abspath( dumpSym ), st.st_size,
+                                               st.st_mtime_ns ) ).encode() ).hexdigest()[:16]
+        cacheRoot = join( self.args["build"], "breakpad-symbols-cache" )
+        cacheDir = join( cacheRoot, tag )
+        os.makedirs( cacheDir, exist_ok=True )
+
+        # the work happens in the dump_syms processes, so threads will do
+        workers = int( self.args.get( 'compress_workers' ) or 0 ) or os.cpu_count() or 1
+        with concurrent.futures.ThreadPoolExecutor( workers ) as executor:
+            results = list( executor.map( self.fs_generate_breakpad_symbols_for_file,
+                                          files, [cacheDir] * len( files ) ) )
+        print( "Breakpad symbols for %d files, %d from the cache" %
+               ( len( results ), sum( hit for name, hit in results ) ) )
+
+        # forget whatever this build no longer has
+        used = set( name for name, hit in results )
+        for name in os.listdir( cacheDir ):
+            if name not in used:
+                os.remove( join( cacheDir, name ) )
+        for name in os.listdir( cacheRoot ):
+            if name != tag:
+                rmtree( join( cacheRoot, name ), ignore_errors=True )
 
         if isdir( "symbols" ):
             for a in self.args:
                 print("%s: %s" % (a, self.args[a]))
 
-            fTar = tarfile.open( symbolsName, "w:bz2")
-            fTar.add("symbols", arcname=".")
-            fTar.add( join( self.args["dest"], "build_data.json" ), arcname="build_data.json" )
+            # stream the tarball out rather than seeking back into it
+            with tarfile.open( symbolsName, "w|bz2") as fTar:
+                fTar.add("symbols", arcname=".")
+                fTar.add( join( self.args["dest"], "build_data.json" ), arcname="build_data.json" )
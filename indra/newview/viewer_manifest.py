@@ -1873,6 +1873,9 @@ class Darwin_x86_64_Manifest(DarwinManifest):
 
 class LinuxManifest(ViewerManifest):
     build_data_json_platform = 'lnx'
+    # construct() copies the same CEF payload into both bin and lib: plan
+    # the copies so that each file is read once
+    defer_copies = True
 
     def construct(self):
         # <FS:ND> HACK! Force parent to always copy XML/... even when not having configured with --package.
@@ -2103,51 +2106,43 @@ class LinuxManifest(ViewerManifest):
         #installer_name = self.installer_base_name()
         installer_name = self.fs_installer_basename()
 
-        self.fs_save_breakpad_symbols("linux")
+        with self.timed("Breakpad symbols"):
+            self.fs_save_breakpad_symbols("linux")
         self.fs_delete_linux_symbols() # <FS:ND/> Delete old syms
-        self.strip_binaries()
-        self.fs_save_linux_symbols() # <FS:ND/> Package symbols, add debug link
+        with self.timed("Stripping"):
+            self.strip_binaries()
+        with self.timed("Saving symbols"):
+            self.fs_save_linux_symbols() # <FS:ND/> Package symbols, add debug link
 
         # Fix access permissions
-        self.run_command(['find', self.get_dst_prefix(),
-                          '-type', 'd', '-exec', 'chmod', '755', '{}', ';'])
-        for old, new in ('0700', '0755'), ('0500', '0555'), ('0600', '0644'), ('0400', '0444'):
-            self.run_command(['find', self.get_dst_prefix(),
-                              '-type', 'f', '-perm', old,
-                              '-exec', 'chmod', new, '{}', ';'])
+        with self.timed("Fixing permissions"):
+            changed = self.normalize_permissions(
+                self.get_dst_prefix(),
+                {0o700: 0o755, 0o500: 0o555, 0o600: 0o644, 0o400: 0o444},
+                dir_mode=0o755)
+            print("Changed the permissions of %d paths" % changed)
         self.package_file = installer_name + '.tar.xz'
 
-        # temporarily move directory tree so that it has the right
-        # name in the tarfile
-        realname = self.get_dst_prefix()
-        tempname = self.build_path_of(installer_name)
-        self.run_command(["mv", realname, tempname])
-        try:
-            # only create tarball if it's a release build.
-            if self.args['buildtype'].lower() == 'release':
-                # --numeric-owner hides the username of the builder for
-                # security etc.
-                self.run_command(['tar', '-C', self.get_build_prefix(),
-                                  '--numeric-owner', self.fs_linux_tar_excludes(), '-caf',
-                                 tempname + '.tar.xz', installer_name])
-            else:
-                print("Skipping %s.tar.xz for non-Release build (%s)" % \
-                      (installer_name, self.args['buildtype']))
-        finally:
-            self.run_command(["mv", tempname, realname])
+        # only create tarball if it's a release build.
+        if self.args['buildtype'].lower() == 'release':
+            # the tree goes in under installer_name, without the builder's
+            # username (as tar --numeric-owner), compressed in parallel
+            with self.timed("Compressing"):
+                self.xz_tarball(self.build_path_of(self.package_file),
+                                self.get_dst_prefix(), installer_name,
+                                excludes=self.fs_linux_tar_exclude_patterns())
+        else:
+            print("Skipping %s.tar.xz for non-Release build (%s)" % \
+                  (installer_name, self.args['buildtype']))
 
     def strip_binaries(self):
         if self.args['buildtype'].lower() == 'release' and self.is_packaging_viewer():
             print("* Going strip-crazy on the packaged binaries, since this is a RELEASE build")
             # makes some small assumptions about our packaged dir structure
-            self.run_command(
-                ["find"] +
-                [os.path.join(self.get_dst_prefix(), dir) for dir in ('bin', 'lib')] +
-                # <FS:Ansariel> Remove VMP
-                # ['-type', 'f', '!', '-name', '*.py',
-                ['-type', 'f', "!", "-name", "*.dat", "!", "-name", "*.pak", "!", "-name", "*.bin", "!", "-name", "*.lib", "!", "-name", "*.pdb",
-                # </FS:Ansariel> Remove VMP
-                 '!', '-name', 'update_install', '-exec', 'strip', '-S', '{}', ';'])
+            # only ELF files: the data files, scripts and update_install
+            # that find used to be told to skip by name aren't
+            self.strip_files(self.elf_files(
+                [os.path.join(self.get_dst_prefix(), dir) for dir in ('bin', 'lib')]))
 
 class Linux_i686_Manifest(LinuxManifest):
     address_size = 32
@@ -27,8 +27,21 @@ $/LicenseInfo$
 """
 
 from indra.util import llmanifest
+import contextlib
+import errno
+import fnmatch
+import glob
+import io
+import json
+import lzma
 import os.path
 import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
 import unittest
 
 class DemoManifest(llmanifest.LLManifest):
@@ -55,9 +68,9 @@ class TestLLManifest(unittest.TestCase):
                                         'artwork':'art', 'build':'build'})
 
     def testproperwindowspath(self):
-        self.assertEqual(llmanifest.proper_windows_path("C:\Program Files", "cygwin"),"/cygdrive/c/Program Files")
-        self.assertEqual(llmanifest.proper_windows_path("C:\Program Files", "windows"), "C:\Program Files")
-        self.assertEqual(llmanifest.proper_windows_path("/cygdrive/c/Program Files/NSIS", "windows"), "C:\Program Files\NSIS")
+        self.assertEqual(llmanifest.proper_windows_path(r"C:\Program Files", "cygwin"),"/cygdrive/c/Program Files")
+        self.assertEqual(llmanifest.proper_windows_path(r"C:\Program Files", "windows"), r"C:\Program Files")
+        self.assertEqual(llmanifest.proper_windows_path("/cygdrive/c/Program Files/NSIS", "windows"), r"C:\Program Files\NSIS")
         self.assertEqual(llmanifest.proper_windows_path("/cygdrive/c/Program Files/NSIS", "cygwin"), "/cygdrive/c/Program Files/NSIS")
 
     def testpathancestors(self):
@@ -130,5 +143,518 @@ class TestLLManifest(unittest.TestCase):
         self.assertTrue(os.path.isdir("test_dir_DELETE/nested/dir"))
         os.removedirs("test_dir_DELETE/nested/dir")
 
+class StagingManifest(llmanifest.LLManifest):
+    patterns = ('*.pak', 'locales')
+    def construct(self):
+        for pattern in self.patterns:
+            self.path(pattern)
+
+class PackagesManifest(StagingManifest):
+    def construct(self):
+        if os.path.basename(os.path.dirname(self.args['dest'])) == 'bad':
+            raise llmanifest.ManifestError("bad package")
+        super(PackagesManifest, self).construct()
+
+class PayloadManifest(llmanifest.LLManifest):
+    defer_copies = True
+    def construct(self):
+        for dst in ('bin', 'lib'):
+            with self.prefix(dst=dst):
+                self.path('*.pak')
+                self.path('locales')
+                self.path('link.pak')
+        self.path('a.pak', 'x.pak')
+        self.path('b.pak', 'x.pak')
+
+class TestCopyEngine(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.dir, 'src')
+        self.dst = os.path.join(self.dir, 'dst')
+        for rel in ('a.pak', 'b.pak', 'c.txt', 'locales/en.pak', 'locales/fr.pak',
+                    'locales/nested/x.dat'):
+            path = os.path.join(self.src, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(rel * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def manifest(self, workers, strategy='copy', actions=('copy',)):
+        m = llmanifest.LLManifest({'source': self.src, 'artwork': self.src,
+                                   'build': self.src, 'dest': self.dst,
+                                   'copy_workers': str(workers),
+                                   'copy_strategy': strategy,
+                                   'actions': list(actions)})
+        m.actions = list(actions)
+        return m
+
+    def testorder(self):
+        lists = []
+        for workers in (1, 4):
+            shutil.rmtree(self.dst, ignore_errors=True)
+            m = self.manifest(workers)
+            self.assertEqual(m.path('*.pak'), 2)
+            self.assertEqual(m.path('locales'), 3)
+            self.assertEqual(m.path('nothere.txt'), 0)
+            self.assertEqual([mf.pattern for mf in m.missing], ['nothere.txt'])
+            # every copy is done by the time path() returns
+            for src, dst in m.file_list:
+                with open(src) as s, open(dst) as d:
+                    self.assertEqual(s.read(), d.read())
+            lists.append([[os.path.relpath(p, self.dir) for p in pair]
+                          for pair in m.file_list])
+            m.copy_engine.shutdown()
+        self.assertEqual(lists[0], lists[1])
+
+    def testtreeerrors(self):
+        m = self.manifest(4)
+        m.copy_engine.min_parallel = 1
+        # a directory where a file should go can't be copied over
+        os.makedirs(os.path.join(self.dst, 'locales', 'fr.pak', 'in_the_way'))
+        try:
+            m.ccopytree(os.path.join(self.src, 'locales'), os.path.join(self.dst, 'locales'))
+        except llmanifest.ManifestError as err:
+            errors = err.args[0]
+        else:
+            self.fail("expected ManifestError")
+        m.copy_engine.shutdown()
+        self.assertEqual([os.path.basename(e[0]) for e in errors], ['fr.pak'])
+        self.assertTrue(isinstance(errors[0][2], OSError))
+        # the rest of the tree was still copied
+        self.assertTrue(os.path.isfile(os.path.join(self.dst, 'locales', 'en.pak')))
+        self.assertTrue(os.path.isfile(os.path.join(self.dst, 'locales', 'nested', 'x.dat')))
+
+    def teststrategies(self):
+        a = os.path.join(self.src, 'a.pak')
+        os.utime(a, (1000000000, 1000000000))
+        for strategy, actions, linked in (('auto', ('copy',), False),
+                                          ('hardlink', ('copy',), True),
+                                          ('hardlink', ('copy', 'unpacked'), True),
+                                          ('hardlink', ('copy', 'package'), False),
+                                          ('reflink', ('copy',), False),
+                                          ('range', ('copy',), False),
+                                          ('copy', ('copy',), False)):
+            shutil.rmtree(self.dst, ignore_errors=True)
+            m = self.manifest(1, strategy, actions)
+            m.path('a.pak')
+            copied = os.path.join(self.dst, 'a.pak')
+            self.assertEqual(os.path.samefile(a, copied), linked, strategy)
+            with open(a) as s, open(copied) as d:
+                self.assertEqual(s.read(), d.read())
+            self.assertEqual(os.stat(copied).st_mtime, 1000000000)
+            self.assertEqual(sum(m.file_copier.counts.values()), 1)
+            self.assertEqual(list(m.file_copier.counts.keys())[0] == 'hardlink', linked)
+            # an up to date file isn't copied again
+            m.path('a.pak')
+            self.assertEqual(sum(m.file_copier.counts.values()), 1)
+
+            # put_in_file() doesn't write through a link into the source
+            m.put_in_file(b'generated', 'a.pak')
+            with open(a) as f:
+                self.assertEqual(f.read(), 'a.pak' * 100)
+
+        self.assertRaises(llmanifest.ManifestError, self.manifest, 1, 'teleport')
+
+    def testpackageafterlink(self):
+        a = os.path.join(self.src, 'a.pak')
+        copied = os.path.join(self.dst, 'a.pak')
+        m = self.manifest(1, 'hardlink', ('copy',))
+        m.path('a.pak')
+        self.assertTrue(os.path.samefile(a, copied))
+        # packaging the same tree copies the linked file again...
+        m = self.manifest(1, 'hardlink', ('copy', 'package'))
+        m.path('a.pak')
+        self.assertFalse(os.path.samefile(a, copied))
+        self.assertEqual(os.stat(a).st_nlink, 1)
+        # (once, after which it's up to date)
+        m.path('a.pak')
+        self.assertEqual(sum(m.file_copier.counts.values()), 1)
+        # ...so changing it in place leaves the source alone
+        mode = os.stat(a).st_mode
+        os.chmod(copied, 0o600)
+        with open(copied, 'a') as f:
+            f.write('stripped')
+        self.assertEqual(os.stat(a).st_mode, mode)
+        with open(a) as f:
+            self.assertEqual(f.read(), 'a.pak' * 100)
+
+    def testfallback(self):
+        copier = llmanifest.FileCopier('hardlink')
+        def cross_device(src, dst):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        copier.chain[0] = ('hardlink', cross_device)
+        for name in ('a.pak', 'b.pak'):
+            os.makedirs(self.dst, exist_ok=True)
+            self.assertNotEqual(copier.copy(os.path.join(self.src, name),
+                                            os.path.join(self.dst, name)), 'hardlink')
+        self.assertEqual(sum(copier.counts.values()), 2)
+        self.assertEqual(len([u for u in copier._unsupported if u[0] == 'hardlink']), 1)
+
+    def stage(self, **args):
+        args.update(source=self.src, artwork=self.src, build=self.src,
+                    dest=self.dst, copy_strategy='copy')
+        m = StagingManifest(args)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            m.do('copy')
+        return m, out.getvalue()
+
+    def testtrace(self):
+        trace = os.path.join(self.dir, 'trace.json')
+        m, out = self.stage(trace=trace)
+        with open(trace) as f:
+            events = json.load(f)['traceEvents']
+        spans = [event for event in events if event['ph'] == 'X']
+        self.assertEqual(sorted(event['name'] for event in spans if event['cat'] == 'path'),
+                         ['*.pak', 'locales'])
+        copies = [event for event in spans if event['cat'] == 'copy']
+        self.assertEqual(len(copies), 5)
+        self.assertEqual(sum(event['args']['bytes'] for event in copies),
+                         sum(len(rel) * 100 for rel in ('a.pak', 'b.pak', 'locales/en.pak',
+                                                          'locales/fr.pak', 'locales/nested/x.dat')))
+        self.assertTrue('copy_finish' in [event['name'] for event in spans if event['cat'] == 'finish'])
+        self.assertTrue('Trace written to' in out)
+        self.assertTrue(any(line.split()[:2] == ['files', 'copied'] and line.split()[-1] == '5'
+                            for line in out.splitlines()), out)
+
+        # again: everything is up to date, and says so
+        m, out = self.stage(trace=trace)
+        self.assertEqual(m.tracer.counters['up to date (state file)'], 5)
+        self.assertFalse('files copied' in m.tracer.counters)
+
+    def packages(self, actions, packages, strategy='auto'):
+        versionfile = os.path.join(self.dir, 'version')
+        with open(versionfile, 'w') as f:
+            f.write('7.1.2.3')
+        argv, environ = sys.argv, dict(os.environ)
+        sys.argv = ['llmanifest', '--actions=' + actions, '--platform=packages',
+                    '--copy_strategy=' + strategy,
+                    '--versionfile=' + versionfile, '--grid=agni',
+                    '--source=' + self.src, '--artwork=' + self.src, '--build=' + self.src,
+                    '--dest=' + os.path.join(self.dst, 'viewer')]
+        os.environ['additional_packages'] = packages
+        try:
+            llmanifest.main()
+        finally:
+            sys.argv = argv
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def testadditionalpackages(self):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            with self.assertRaises(llmanifest.ManifestError) as raised:
+                self.packages('copy', 'one bad two', 'hardlink')
+        # one failure doesn't stop the others, and is reported with its log
+        self.assertEqual(raised.exception.msg, '1 of 3 additional packages failed: bad')
+        self.assertTrue('ManifestError: bad package' in out.getvalue())
+        for rel in ('a.pak', 'locales/nested/x.dat'):
+            base = os.path.join(self.dst, 'viewer', rel)
+            for package in ('one', 'two'):
+                # the same file, stored once
+                self.assertTrue(os.path.samefile(base, os.path.join(self.dst, package, 'viewer', rel)))
+            self.assertEqual(os.stat(base).st_nlink, 4)
+        with open(os.path.join(self.dst, 'one', 'viewer.log')) as f:
+            self.assertTrue('Processing locales' in f.read())
+
+    def testpackagestore(self):
+        # packaging changes files in place: nothing may be linked, to the
+        # source, to the store or to another package
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.packages('copy package', 'one two')
+        for rel in ('a.pak', 'locales/nested/x.dat'):
+            for package in ('', 'one', 'two'):
+                path = os.path.join(self.dst, package, 'viewer', rel)
+                with open(path) as f:
+                    self.assertEqual(f.read(), rel * 100)
+                self.assertEqual(os.stat(path).st_nlink, 1)
+        # and the store is gone afterwards
+        self.assertFalse(os.path.exists(os.path.join(self.dst, '.manifest-store')))
+
+        # copies come out of the store by reflink, where that works...
+        store = llmanifest.ContentStore(os.path.join(self.dir, 'store'))
+        copier = llmanifest.FileCopier('auto', hardlinks=False, store=store)
+        if llmanifest.FICLONE is None:
+            return
+        copier._from_store = shutil.copy2
+        os.makedirs(self.dst, exist_ok=True)
+        a, copied = os.path.join(self.src, 'a.pak'), os.path.join(self.dst, 'x.pak')
+        self.assertEqual(copier.copy(a, copied), 'store')
+        stored = store.path(store.digest(a))
+        self.assertFalse(os.path.samefile(stored, copied))
+        self.assertEqual(os.stat(stored).st_nlink, 1)
+        # ...and the store isn't used where it doesn't
+        def no_reflink(src, dst):
+            raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+        copier._from_store = no_reflink
+        self.assertNotEqual(copier.copy(os.path.join(self.src, 'b.pak'),
+                                        os.path.join(self.dst, 'y.pak')), 'store')
+        self.assertEqual(copier.store, None)
+        self.assertEqual(store.prune(), 2)
+        self.assertFalse(os.path.exists(store.root))
+
+    def testbuildpackagefds(self):
+        before = os.fstat(1), os.fstat(2)
+        log = os.path.join(self.dir, 'build.log')
+        package_file, error = llmanifest.build_package(
+            'packages', None, {'source': self.src, 'artwork': self.src, 'build': self.src,
+                               'dest': self.dst, 'actions': ['copy']}, log)
+        self.assertEqual(error, None)
+        # the process's own output goes where it did before
+        after = os.fstat(1), os.fstat(2)
+        self.assertEqual([(st.st_dev, st.st_ino) for st in after],
+                         [(st.st_dev, st.st_ino) for st in before])
+        with open(log) as f:
+            self.assertTrue('Processing locales' in f.read())
+
+    def testbuildstate(self):
+        m, out = self.stage()
+        self.assertEqual(m.file_copier.counts['copy'], 5)
+        self.assertTrue(os.path.isfile(m.default_state_file()))
+        self.assertFalse(os.path.exists(os.path.join(self.dst, os.path.basename(m.default_state_file()))))
+
+        # nothing changed: nothing copied, nor even compared
+        saved = llmanifest.filecmp.cmp
+        llmanifest.filecmp.cmp = None
+        try:
+            m, out = self.stage()
+        finally:
+            llmanifest.filecmp.cmp = saved
+        self.assertEqual(sum(m.file_copier.counts.values()), 0)
+
+        # a changed source, and a removed destination
+        fr = os.path.join(self.src, 'locales', 'fr.pak')
+        with open(fr, 'a') as f:
+            f.write('more')
+        os.remove(os.path.join(self.dst, 'b.pak'))
+        m, out = self.stage()
+        self.assertEqual(m.file_copier.counts['copy'], 2)
+        with open(os.path.join(self.dst, 'locales', 'fr.pak')) as f:
+            self.assertTrue(f.read().endswith('more'))
+
+        # a destination written to in place, which leaves its directory alone
+        en = os.path.join(self.dst, 'locales', 'en.pak')
+        with open(en, 'r+') as f:
+            f.write('X' * 10)
+        m, out = self.stage()
+        self.assertEqual(m.file_copier.counts['copy'], 1)
+        with open(en) as f:
+            self.assertEqual(f.read(), 'locales/en.pak' * 100)
+
+        # --state_file= keeps no index, and still skips up to date files
+        os.remove(m.default_state_file())
+        m, out = self.stage(state_file='')
+        self.assertEqual(sum(m.file_copier.counts.values()), 0)
+        self.assertFalse(os.path.exists(m.default_state_file()))
+
+    def testplan(self):
+        self.stage()
+        with open(os.path.join(self.src, 'a.pak'), 'w') as f:
+            f.write('A.PAK' * 100)
+        with open(os.path.join(self.src, 'new.pak'), 'w') as f:
+            f.write('new')
+        patterns, StagingManifest.patterns = StagingManifest.patterns, ('*.pak',)
+        try:
+            m, out = self.stage(plan='')
+        finally:
+            StagingManifest.patterns = patterns
+        self.assertEqual(sorted((change, os.path.basename(dst)) for change, dst, src in m.plan),
+                         [('change', 'a.pak'), ('new', 'new.pak')])
+        self.assertTrue('Plan: 1 new, 1 changed, 0 links, 0 written, 1 unchanged, '
+                        '3 no longer produced' in out, out)
+        # and nothing was touched
+        self.assertEqual(sum(m.file_copier.counts.values()), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.dst, 'new.pak')))
+        with open(os.path.join(self.dst, 'a.pak')) as f:
+            self.assertEqual(f.read(), 'a.pak' * 100)
+
+    def testdirindex(self):
+        with open(os.path.join(self.src, '.hidden.pak'), 'w') as f:
+            f.write('hidden')
+        os.symlink('nowhere', os.path.join(self.src, 'broken.pak'))
+        # listings of directories changed just now are read every time
+        old = time.time() - 60
+        for dir, dirs, files in os.walk(self.src):
+            os.utime(dir, (old, old))
+        index = llmanifest.DirectoryIndex()
+        for pattern in ('*.pak', '.*', '*', 'locales/*.pak', '*/*.pak', 'locales/*/x.*',
+                        'locales/', 'loc*/', 'a.pak', 'nothere', 'nothere/*', '[ab].pak',
+                        '?.txt', 'a.pak/*'):
+            pattern = os.path.join(self.src, pattern)
+            self.assertEqual(index.glob(pattern), glob.glob(pattern), pattern)
+        scans = index.scans
+        self.assertTrue(index.isdir(os.path.join(self.src, 'locales')))
+        self.assertTrue(index.isfile(os.path.join(self.src, 'a.pak')))
+        self.assertTrue(index.lexists(os.path.join(self.src, 'broken.pak')))
+        self.assertTrue(index.islink(os.path.join(self.src, 'broken.pak')))
+        self.assertFalse(index.isfile(os.path.join(self.src, 'broken.pak')))
+        self.assertFalse(index.lexists(os.path.join(self.src, 'nothere', 'a.pak')))
+        self.assertEqual(index.scans, scans)
+        self.assertTrue(index.lexists(self.src + os.sep))
+
+        # changes made behind its back are seen too
+        with open(os.path.join(self.src, 'locales', 'de.pak'), 'w') as f:
+            f.write('de')
+        os.remove(os.path.join(self.src, 'b.pak'))
+        self.assertTrue(index.isfile(os.path.join(self.src, 'locales', 'de.pak')))
+        self.assertFalse(index.lexists(os.path.join(self.src, 'b.pak')))
+        self.assertEqual(index.glob(os.path.join(self.src, '*.pak')),
+                         glob.glob(os.path.join(self.src, '*.pak')))
+        with open(os.path.join(self.src, 'b.pak'), 'w') as f:
+            f.write('b.pak' * 100)
+
+        # the manifest sees what it creates itself
+        m = self.manifest(1)
+        m.dir_index = index
+        self.assertEqual(m._try_path(os.path.join(self.src, 'made.pak'),
+                                     os.path.join(self.dst, 'made.pak')), 0)
+        m.run_command(['touch', os.path.join(self.src, 'made.pak')])
+        self.assertEqual(m._try_path(os.path.join(self.src, 'made.pak'),
+                                     os.path.join(self.dst, 'made.pak')), 1)
+        m.put_in_file(b'x', 'put.pak')
+        self.assertTrue(index.isfile(os.path.join(self.dst, 'put.pak')))
+        m.remove(os.path.join(self.dst, 'put.pak'))
+        self.assertFalse(index.lexists(os.path.join(self.dst, 'put.pak')))
+        m.path('b.pak')
+        self.assertEqual(index.glob(os.path.join(self.dst, '*.pak')),
+                         glob.glob(os.path.join(self.dst, '*.pak')))
+
+    def testexcludes(self):
+        patterns = ['*.pdb', '*/locales/*', 'logcontrol.xml', '*/a?.pak', '*[!x].txt',
+                    '*/.svn/*', '/abs/*']
+        matcher = llmanifest.ExcludeMatcher(patterns)
+        for path in ('dir/x.pdb', 'dir/locales/en.pak', 'dir/locales', 'logcontrol.xml',
+                     'app_settings/logcontrol.xml', 'a/ab.pak', 'a/abc.pak', 'c.txt',
+                     'x.txt', 'x/.svn/entries', '/abs/anything/deeper', 'plain'):
+            self.assertEqual(matcher.excludes(path),
+                             any(fnmatch.fnmatch(path, p) for p in patterns), path)
+        self.assertEqual(sorted(matcher.hits['*/locales/*']), ['dir/locales/en.pak'])
+        self.assertFalse('logcontrol.xml' in [p for p, hits in matcher.hits.items()
+                                              if 'app_settings/logcontrol.xml' in hits])
+        self.assertTrue(matcher.prunes('dir/locales'))
+        self.assertTrue(matcher.prunes('x/.svn'))
+        self.assertFalse(matcher.prunes('dir/other'))
+
+        m = self.manifest(1)
+        m.exclude('*/locales/*')
+        m.exclude('*/b.pak')
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(m.path('*.pak'), 1)
+            self.assertEqual(m.path('locales'), 0)
+            m.print_exclude_stats()
+        # the pruned directory was never listed
+        self.assertFalse(os.path.join(self.src, 'locales') in m.dir_index._listings)
+        self.assertFalse(os.path.exists(os.path.join(self.dst, 'b.pak')))
+        self.assertTrue('       1 */locales/*' in out.getvalue(), out.getvalue())
+        self.assertTrue('       1 */b.pak' in out.getvalue(), out.getvalue())
+
+        # the compiled matcher follows later exclude() calls
+        m.exclude('*/a.pak')
+        self.assertFalse(m.includes(os.path.join(self.src, 'a.pak'), None))
+
+    def testcopyplan(self):
+        os.symlink('a.pak', os.path.join(self.src, 'link.pak'))
+        for strategy, linked in (('hardlink', True), ('copy', False)):
+            shutil.rmtree(self.dst, ignore_errors=True)
+            m = PayloadManifest({'source': self.src, 'artwork': self.src, 'build': self.src,
+                                 'dest': self.dst, 'copy_strategy': strategy,
+                                 'actions': ['copy'], 'state_file': ''})
+            m.actions = ['copy']
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                m.construct()
+                # planned, not copied
+                self.assertEqual(os.listdir(os.path.join(self.dst, 'bin')), ['locales'])
+                self.assertEqual(len(m.pending_copies), 13)
+                self.assertEqual([(os.path.basename(dst), os.path.basename(old), os.path.basename(new))
+                                  for dst, old, new in m.pending_copies.overridden],
+                                 [('x.pak', 'a.pak', 'b.pak')])
+                m.run_command(['true'])
+                self.assertEqual(len(m.pending_copies), 0)
+            self.assertTrue('Copy plan: 11 files from 5 sources (6 duplicates), 2 links'
+                            in out.getvalue(), out.getvalue())
+            for src, dst in m.file_list:
+                self.assertTrue(os.path.lexists(dst), dst)
+            with open(os.path.join(self.dst, 'x.pak')) as f:
+                self.assertEqual(f.read(), 'b.pak' * 100)
+            self.assertEqual(os.readlink(os.path.join(self.dst, 'lib', 'link.pak')), 'a.pak')
+            bin_en = os.path.join(self.dst, 'bin', 'locales', 'en.pak')
+            lib_en = os.path.join(self.dst, 'lib', 'locales', 'en.pak')
+            self.assertEqual(os.path.samefile(bin_en, lib_en), linked)
+            with open(lib_en) as f:
+                self.assertEqual(f.read(), 'locales/en.pak' * 100)
+            m.copy_engine.shutdown()
+
+    def testxztarball(self):
+        os.symlink('a.pak', os.path.join(self.src, 'link.pak'))
+        with open(os.path.join(self.src, 'big.bin'), 'wb') as f:
+            f.write(os.urandom(200000) + bytes(300000))
+        tarname = os.path.join(self.dir, 'pkg.tar.xz')
+        for workers in (1, 2):
+            m = self.manifest(1)
+            m.args['compress_workers'] = str(workers)
+            with contextlib.redirect_stdout(io.StringIO()):
+                # small blocks, to make several of them
+                with open(tarname, 'wb') as f, \
+                     llmanifest.ParallelXZWriter(f, preset=1, block_size=65536,
+                                                 workers=workers) as xz:
+                    xz.write(b'x' * 100000)
+                with lzma.open(tarname) as f:
+                    self.assertEqual(f.read(), b'x' * 100000)
+                self.assertEqual(len(xz.records), 2)
+
+                m.xz_tarball(tarname, self.src, 'Pkg', excludes=['Pkg/locales/nested'])
+            with tarfile.open(tarname) as tf:
+                members = dict((info.name, info) for info in tf.getmembers())
+                self.assertEqual(tf.extractfile('Pkg/big.bin').read(),
+                                 open(os.path.join(self.src, 'big.bin'), 'rb').read())
+            self.assertEqual(sorted(members),
+                             ['Pkg', 'Pkg/a.pak', 'Pkg/b.pak', 'Pkg/big.bin', 'Pkg/c.txt',
+                              'Pkg/link.pak', 'Pkg/locales', 'Pkg/locales/en.pak',
+                              'Pkg/locales/fr.pak'])
+            self.assertEqual(members['Pkg/link.pak'].linkname, 'a.pak')
+            self.assertEqual(set(info.uname for info in members.values()), {''})
+            self.assertEqual(set(info.gname for info in members.values()), {''})
+
+    def testpackagesteps(self):
+        modes = {'a.pak': 0o700, 'b.pak': 0o600, 'c.txt': 0o640, 'locales/en.pak': 0o400}
+        for rel, mode in modes.items():
+            os.chmod(os.path.join(self.src, rel), mode)
+        os.chmod(os.path.join(self.src, 'locales', 'nested'), 0o700)
+        os.symlink('c.txt', os.path.join(self.src, 'link.txt'))
+        m = self.manifest(1)
+        self.assertEqual(m.normalize_permissions(
+            self.src, {0o700: 0o755, 0o600: 0o644, 0o400: 0o444}, dir_mode=0o755), 4)
+        def mode(rel):
+            return os.stat(os.path.join(self.src, rel)).st_mode & 0o7777
+        self.assertEqual([mode(rel) for rel in sorted(modes)], [0o755, 0o644, 0o640, 0o444])
+        self.assertEqual(mode('locales/nested'), 0o755)
+
+        for rel in ('bin/viewer', 'bin/data.bin', 'lib/libx.so', 'lib/sub/liby.so'):
+            path = os.path.join(self.dst, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'#!/bin/sh\n' if rel == 'lib/libx.so' else
+                        b'data' if rel == 'bin/data.bin' else b'\x7fELF not really')
+        elves = m.elf_files([os.path.join(self.dst, 'bin'), os.path.join(self.dst, 'lib')])
+        self.assertEqual([os.path.relpath(path, self.dst) for path in elves],
+                         ['bin/viewer', 'lib/sub/liby.so'])
+        if shutil.which('strip'):
+            # strip fails on these, which fails the build
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                with self.assertRaises(llmanifest.ManifestError) as raised:
+                    m.strip_files(elves)
+            self.assertTrue('Stripping 2 files' in out.getvalue())
+            self.assertTrue('strip returned' in str(raised.exception))
+
+    def testbuildid(self):
+        self.assertEqual(llmanifest.elf_build_id(os.path.join(self.src, 'a.pak')), None)
+        if not shutil.which('readelf'):
+            return
+        notes = subprocess.check_output(['readelf', '-n', sys.executable]).decode()
+        expected = [line.split(':')[1].strip() for line in notes.splitlines()
+                    if 'Build ID:' in line]
+        self.assertEqual(llmanifest.elf_build_id(sys.executable),
+                         expected[0] if expected else None)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+"""
+@file test_llmessage.py
+@brief Test cases for the indra.ipc message template library.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Second Life Viewer Source Code
+Copyright (C) 2024, Linden Research, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation;
+version 2.1 of the License only.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Linden Research, Inc., 945 Battery Street, San Francisco, CA  94111  USA
+$/LicenseInfo$
+"""
+
+from indra.ipc import capture
+from indra.ipc import compatibility
+from indra.ipc import corpus
+from indra.ipc import llmessage
+from indra.ipc import messageconfig
+from indra.ipc import priorities
+from indra.ipc import templatecodec
+from indra.ipc import tokenstream
+from indra.ipc import wiresize
+from indra.ipc import zerocode
+import io
+import os
+import struct
+import tempfile
+import unittest
+
+SAMPLE_TEMPLATE = """\
+version 2.0
+
+// a comment line
+{
+	TestMessage Low 1 NotTrusted Zerocoded
+	{
+		TestBlock1		Single
+		{	Test1		U32	}
+	}
+	{
+		NeighborBlock		Multiple		4
+		{	Test0		U32	}
+		{	Test1		U32	}
+	}
+}
+
+{
+	PacketAck Fixed 0xFFFFFFFB NotTrusted Unencoded
+	{
+		Packets			Variable
+		{	ID			U32	}
+	}
+}
+"""
+
+class TestTokenStream(unittest.TestCase):
+    def testtokens(self):
+        ts = tokenstream.TokenStream().fromString("a b // c d\n  e//f\n\n")
+        self.assertEqual(ts.line, 1)
+        self.assertEqual(ts.consume(), "a")
+        self.assertEqual(ts.peek(), "b")
+        self.assertEqual(ts.consume(), "b")
+        self.assertEqual(ts.line, 2)
+        self.assertEqual(ts.consume(), "e")
+        self.assertTrue(ts.peek() is tokenstream.EOF)
+        self.assertTrue(ts.consume() is tokenstream.EOF)
+        self.assertEqual(ts.line, 4)
+
+    def testwant(self):
+        ts = tokenstream.TokenStream().fromString("{ Foo 0x1F 2.5 }")
+        self.assertFalse(ts.want("}"))
+        self.assertEqual(ts.require(ts.want("{")), "{")
+        self.assertEqual(ts.require(ts.wantSymbol()), "Foo")
+        self.assertEqual(ts.require(ts.wantInteger()), "0x1F")
+        self.assertFalse(ts.wantInteger())
+        self.assertEqual(ts.require(ts.wantFloat()), "2.5")
+        self.assertEqual(ts.wantOneOf(["]", "}"]), "}")
+        self.assertTrue(ts.require(ts.wantEOF()) is tokenstream.EOF)
+
+    def testparseerror(self):
+        ts = tokenstream.TokenStream().fromString("a\nb c d e f g h\ni")
+        ts.consume()
+        try:
+            ts.require(ts.want("x"))
+        except tokenstream.ParseError as e:
+            self.assertEqual(str(e), 'line 2: expected "x" @ ... b c d e f')
+        else:
+            self.fail("expected ParseError")
+
+
+class TestTemplateParser(unittest.TestCase):
+    def testparse(self):
+        t = llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+        self.assertEqual(sorted(t.messages), ["PacketAck", "TestMessage"])
+        m = t.messages["TestMessage"]
+        self.assertEqual((m.priority, m.number, m.coding),
+                         (llmessage.Message.LOW, 1, llmessage.Message.ZEROCODED))
+        self.assertEqual([b.name for b in m.blocks], ["TestBlock1", "NeighborBlock"])
+        self.assertEqual(m.blocks[1].count, 4)
+        self.assertEqual(t.messages["PacketAck"].number, 0xFFFFFFFB)
+
+    def testdispatch(self):
+        t = llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+        ack = t.messages["PacketAck"]
+        self.assertEqual(ack.encodedNumber(), b"\xff\xff\xff\xfb")
+        self.assertEqual(t.messages["TestMessage"].encodedNumber(), b"\xff\xff\0\x01")
+        # one extra header byte after the message number
+        packet = b"\0\0\0\0\x01\x01" + ack.encodedNumber() + b"x" + b"body"
+        self.assertEqual(t.parseHeader(memoryview(packet)), (ack, 11))
+        self.assertEqual(t.messageAt(b"\xff\xff\0\x01", 0),
+                         (t.messages["TestMessage"], 4))
+        self.assertEqual(t.messageAt(b"\x07", 0), (None, 1))
+        self.assertEqual(t.parseHeader(b"\0\0\0\0\x01\0\xff"), (None, 6))
+
+    def testfingerprints(self):
+        base = llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+        for edit, expected in (
+                ("Zerocoded", "Zerocoded"),
+                ("{	Test1		U32	}", "{	Test1		U16	}"),
+                ("NeighborBlock		Multiple		4", "NeighborBlock		Multiple		3")):
+            current = llmessage.parseTemplateString(
+                SAMPLE_TEMPLATE.replace(edit, expected, 1))
+            walked = current.compatibleWithBase(base)
+            # the walk doesn't compute fingerprints on its own
+            self.assertFalse(any(block._fingerprint for template in (current, base)
+                                 for message in template.messages.values()
+                                 for block in message.blocks))
+            current.computeFingerprints()
+            base.computeFingerprints()
+            skipped = current.compatibleWithBase(base)
+            self.assertEqual(type(skipped), type(walked))
+            self.assertEqual(skipped.explain(), walked.explain())
+            base = llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+        self.assertEqual(base.messages["PacketAck"].fingerprint(),
+                         llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+                         .messages["PacketAck"].fingerprint())
+
+    def testparseerror(self):
+        self.assertRaises(tokenstream.ParseError, llmessage.parseTemplateString,
+                          "version 2.0\n{ Foo Bad 1 }\n")
+
+    def teststreaming(self):
+        lines = SAMPLE_TEMPLATE.encode('utf-8').splitlines(True)
+        read = []
+        def source():
+            for line in lines:
+                read.append(line)
+                yield line
+        messages = llmessage.iterTemplateFile(source())
+        first = next(messages)
+        self.assertEqual(first.name, "TestMessage")
+        # nothing after the message's closing brace has been read yet
+        self.assertEqual(read[-1].strip(), b"}")
+        self.assertTrue(len(read) < len(lines))
+        self.assertEqual([m.name for m in messages], ["PacketAck"])
+        self.assertEqual(len(read), len(lines))
+
+        streamed = llmessage.parseTemplateFile(io.StringIO(SAMPLE_TEMPLATE))
+        eager = llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+        self.assertEqual(streamed.version, eager.version)
+        self.assertEqual(sorted(streamed.messages), sorted(eager.messages))
+        for name in eager.messages:
+            self.assertEqual(streamed.messages[name].fingerprint(),
+                             eager.messages[name].fingerprint())
+
+        try:
+            llmessage.parseTemplateFile(iter(["version 2.0\n", "\n", "{ Foo Bad 1 }\n"]))
+        except tokenstream.ParseError as e:
+            self.assertTrue(str(e).startswith("line 3:"), str(e))
+        else:
+            self.fail("expected ParseError")
+
+
+class TestCompatibility(unittest.TestCase):
+    def testcombine(self):
+        c = compatibility.Same()
+        for i in range(10000):
+            c = c.combine(compatibility.Newer("n%d" % i))
+        c = c.combine(compatibility.Incompatible("bad"))
+        self.assertEqual(type(c), compatibility.Incompatible)
+        # lower levels go first, as they always have
+        self.assertEqual(c.reasons[:2], ["bad", "n0"])
+        self.assertEqual(len(c.reasons), 10001)
+        mixed = compatibility.Older("o").combine(compatibility.Newer("n"))
+        self.assertEqual(type(mixed), compatibility.Mixed)
+        self.assertEqual(mixed.explain(), "Mixed\no\nn\n")
+
+    def testreport(self):
+        base = llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+        current = llmessage.parseTemplateString(
+            SAMPLE_TEMPLATE.replace("{	Test1		U32	}", "{	Test1		U16	}", 1))
+        report = compatibility.Report()
+        c = current.compatibleWithBase(base, report)
+        self.assertEqual(type(c), compatibility.Incompatible)
+        self.assertFalse(report.passed())
+        entry, = report.entries()
+        self.assertEqual((entry.level, entry.message, entry.block, entry.variable),
+                         ("Incompatible", "TestMessage", 0, 0))
+        self.assertEqual(entry.detail, "has different type: U16 vs. U32 in base")
+        self.assertTrue('"result": "Incompatible"' in report.toJSON())
+        junit = report.toJUnit()
+        self.assertTrue('tests="2" failures="1"' in junit)
+
+
+class TestTemplateCodec(unittest.TestCase):
+    def setUp(self):
+        self.codec = templatecodec.compileTemplate(
+            llmessage.parseTemplateString(SAMPLE_TEMPLATE + """
+{
+	CodecTest Low 2 NotTrusted Unencoded
+	{
+		Info		Single
+		{	Port		IPPORT	}
+		{	Position	LLVector3	}
+		{	Name		Variable	1	}
+		{	Flag		BOOL	}
+	}
+	{
+		Data		Variable
+		{	Key			Fixed	2	}
+		{	Value		S16	}
+	}
+}
+"""))
+
+    def testroundtrip(self):
+        data = {"Info": [{"Port": 13000, "Position": (1.0, 2.0, 3.0),
+                          "Name": b"foo\0", "Flag": True}],
+                "Data": [{"Key": b"ab", "Value": -1}, {"Key": b"cd", "Value": 7}]}
+        body = self.codec.encode("CodecTest", data)
+        self.assertEqual(body[:2], struct.pack(">H", 13000))
+        self.assertEqual(len(body), 2 + 12 + 1 + 4 + 1 + 1 + 2 * 4)
+        self.assertEqual(self.codec.decode("CodecTest", body), data)
+        self.assertEqual(self.codec.decode("CodecTest", b"xx" + body, 2), data)
+
+    def testmultiple(self):
+        data = {"TestBlock1": [{"Test1": 1}],
+                "NeighborBlock": [{"Test0": i, "Test1": i + 1} for i in range(4)]}
+        body = self.codec.encode("TestMessage", data)
+        self.assertEqual(len(body), 4 + 4 * 8)
+        self.assertEqual(self.codec.decode("TestMessage", memoryview(body)), data)
+        del data["NeighborBlock"][0]
+        self.assertRaises(templatecodec.CodecError,
+                          self.codec.encode, "TestMessage", data)
+
+    def testtruncated(self):
+        body = self.codec.encode("PacketAck", {"Packets": [{"ID": 5}]})
+        self.assertEqual(body, b"\x01\x05\x00\x00\x00")
+        # missing variable blocks at the end of a message are legal
+        self.assertEqual(self.codec.decode("PacketAck", b""), {"Packets": []})
+        self.assertRaises(templatecodec.CodecError,
+                          self.codec.decode, "PacketAck", body[:-1])
+
+
+class TestZerocode(unittest.TestCase):
+    def testencode(self):
+        self.assertEqual(zerocode.encode(b"a\0\0\0b\0"), b"a\0\x03b\0\x01")
+        self.assertEqual(zerocode.encode(bytes(256)), b"\0\xff\0\x01")
+        self.assertEqual(zerocode.encodedSize(bytes(256)), 4)
+
+    def testdecode(self):
+        for data in (b"", b"abc", b"a\0\0\0b\0", bytes(600) + b"x"):
+            encoded = zerocode.encode(data)
+            self.assertEqual(zerocode.decode(encoded), data)
+            self.assertEqual(zerocode.decode(memoryview(encoded)), data)
+            out = bytearray(b"prefix")
+            self.assertTrue(zerocode.decode(encoded, out) is out)
+            self.assertEqual(out, b"prefix" + data)
+        # extra zeroes before the count each stand for 256 more
+        self.assertEqual(zerocode.decode(b"\0\0\x02"), bytes(258))
+
+    def testpacket(self):
+        packet = b"\x40\0\0\0\x01\0" + b"\xff\xff" + bytes(20)
+        encoded = zerocode.encodePacket(packet)
+        self.assertEqual(encoded, b"\xc0\0\0\0\x01\0\xff\xff\0\x14")
+        self.assertEqual(zerocode.decodePacket(encoded), packet)
+        # not worth encoding, so left alone
+        plain = b"\x40\0\0\0\x01\0\x01\0\x02"
+        self.assertEqual(zerocode.encodePacket(plain), plain)
+        self.assertEqual(zerocode.decodePacket(plain), plain)
+
+
+def _udpFrame(payload, sport=40000, dport=13001):
+    """An Ethernet/IPv4/UDP frame carrying payload."""
+    udp = struct.pack(">HHHH", sport, dport, 8 + len(payload), 0) + payload
+    ip = struct.pack(">BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0,
+                     b"\x0a\0\0\x01", b"\x0a\0\0\x02") + udp
+    return b"\xff" * 12 + b"\x08\x00" + ip
+
+def _pcap(frames):
+    out = [struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)]
+    for i, frame in enumerate(frames):
+        out.append(struct.pack("<IIII", i, 0, len(frame), len(frame)) + frame)
+    return b"".join(out)
+
+def _pcapngBlock(blocktype, body):
+    body += bytes(-len(body) % 4)
+    length = 12 + len(body)
+    return struct.pack("<II", blocktype, length) + body + struct.pack("<I", length)
+
+def _pcapng(frames):
+    out = [_pcapngBlock(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1)),
+           _pcapngBlock(1, struct.pack("<HHI", 1, 0, 65535))]
+    for i, frame in enumerate(frames):
+        out.append(_pcapngBlock(6, struct.pack("<IIIII", 0, 0, i * 1000000,
+                                               len(frame), len(frame)) + frame))
+    return b"".join(out)
+
+class TestCapture(unittest.TestCase):
+    def setUp(self):
+        self.template = llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+        codec = templatecodec.compileTemplate(self.template)
+        message = self.template.messages["TestMessage"]
+        body = codec.encode("TestMessage", {
+            "TestBlock1": {"Test1": 0},
+            "NeighborBlock": [{"Test0": 0, "Test1": 0}] * 4})
+        self.zerocoded = zerocode.encodePacket(
+            b"\x40\0\0\0\x01\0" + message.encodedNumber() + body)
+        ack = self.template.messages["PacketAck"]
+        # one appended ack, id 7
+        self.acked = (b"\x10\0\0\0\x02\0" + ack.encodedNumber()
+                      + codec.encode("PacketAck", {"Packets": [{"ID": 5}]})
+                      + struct.pack(">I", 7) + b"\x01")
+        self.frames = [_udpFrame(self.zerocoded), _udpFrame(self.acked),
+                       _udpFrame(b"not ll", dport=53)]
+
+    def analyze(self, data):
+        fd, filename = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            with capture.Capture(filename) as c:
+                return capture.TrafficStats(
+                    self.template, templatecodec.compileTemplate(self.template)
+                    ).addCapture(c)
+        finally:
+            os.remove(filename)
+
+    def check(self, stats):
+        self.assertEqual(stats.packets, 2)
+        test = stats.messages["TestMessage"]
+        self.assertEqual((test.packets, test.bytes, test.zerocoded, test.reliable),
+                         (1, len(self.zerocoded), 1, 1))
+        self.assertEqual(test.expandedBytes, len(zerocode.decodePacket(self.zerocoded)))
+        self.assertTrue(test.zerocodeSavings > 0)
+        ack = stats.messages["PacketAck"]
+        self.assertEqual((ack.packets, ack.bytes, ack.acks, ack.errors),
+                         (1, len(self.acked), 1, 0))
+        self.assertEqual(ack.bodyBytes, 5)
+
+    def testpcap(self):
+        self.check(self.analyze(_pcap(self.frames)))
+
+    def testpcapng(self):
+        stats = self.analyze(_pcapng(self.frames))
+        self.check(stats)
+        self.assertEqual(stats.duration, 1.0)
+
+    def testunparseable(self):
+        stats = capture.TrafficStats(self.template)
+        stats.add(b"\0\0\0\0\x01\0\x07")
+        stats.add(b"\x10\0\0\0\x01\0\x07\x09")
+        self.assertEqual(stats.messages[stats.UNKNOWN].packets, 1)
+        self.assertEqual(stats.messages[stats.UNPARSEABLE].errors, 1)
+
+    def testnotacapture(self):
+        self.assertRaises(capture.CaptureError, capture.frames, b"garbage!")
+
+
+class TestPriorities(unittest.TestCase):
+    def testplan(self):
+        t = llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+        counts = {"TestMessage": 10, "PacketAck": 1000, "Missing": 5}
+        self.assertEqual(priorities.headerBytes(t, counts), 4040)
+        plan = priorities.planPromotions(t, counts)
+        # Fixed messages stay put
+        self.assertEqual(plan, [priorities.Promotion(
+            "TestMessage", 10, "Low", "High", 1, "TestMessageHigh", 30)])
+        self.assertEqual(priorities.planPromotions(t, counts, minCount=11), [ ])
+        self.assertEqual(priorities.planPromotions(t, counts, exclude=["TestMessage"]), [ ])
+
+    def testapply(self):
+        t = llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+        plan = priorities.planPromotions(t, {"TestMessage": 10})
+        text = priorities.applyPromotions(SAMPLE_TEMPLATE, plan)
+        self.assertTrue(isinstance(priorities.checkPromotions(SAMPLE_TEMPLATE, text),
+                                   compatibility.Newer))
+        new = llmessage.parseTemplateString(text)
+        self.assertTrue(new.messages["TestMessage"].deprecated())
+        moved = new.messages["TestMessageHigh"]
+        self.assertEqual((moved.priority, moved.number), ("High", 1))
+        self.assertEqual([b.fingerprint() for b in moved.blocks],
+                         [b.fingerprint() for b in t.messages["TestMessage"].blocks])
+
+
+class TestWireSize(unittest.TestCase):
+    def testsizes(self):
+        t = llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+        test = wiresize.messageSize(t.messages["TestMessage"])
+        self.assertEqual((test.header, test.minimum, test.typical, test.maximum),
+                         (10, 46, 46, 46))
+        ack = wiresize.messageSize(t.messages["PacketAck"])
+        # the trailing Variable block may be left out entirely
+        self.assertEqual((ack.minimum, ack.typical, ack.maximum), (10, 15, 1031))
+        self.assertEqual(ack.flags(), [ ])
+        self.assertEqual(ack.flags(mtu=1000), ["max>mtu"])
+        self.assertEqual(wiresize.checkSizes([test, ack]), ([ ], [ ]))
+        self.assertEqual(len(wiresize.checkSizes([ack], mtu=12)[1]), 1)
+        self.assertEqual(len(wiresize.checkSizes([ack], mtu=8, buffer=9)[0]), 1)
+
+    def testcodecagrees(self):
+        for type, size in wiresize.FIXED_SIZES.items():
+            fmt = templatecodec._formats[type][0]
+            self.assertEqual(struct.calcsize("<" + fmt), size, type)
+
+
+SAMPLE_CONFIG = """<?xml version="1.0"?>
+<llsd>
+<map>
+  <key>serverDefaults</key>
+  <map><key>simulator</key><string>template</string></map>
+  <key>messages</key>
+  <map>
+    <!-- a comment -->
+    <key>TestMessage</key>
+    <map>
+      <key>flavor</key><string>llsd</string>
+      <key>trusted-sender</key><boolean>true</boolean>
+      <key>only-send-latest</key><boolean>true</boolean>
+    </map>
+    <key>NotInTemplate</key>
+    <map><key>flavor</key><string>template</string></map>
+    <key>OnlyOverHTTP</key>
+    <map><key>flavor</key><string>llsd</string></map>
+  </map>
+  <key>maxQueuedEvents</key><integer>100</integer>
+</map>
+</llsd>
+"""
+
+class TestMessageConfig(unittest.TestCase):
+    def model(self, template=SAMPLE_TEMPLATE):
+        return messageconfig.MessageModel(
+            llmessage.parseTemplateString(template),
+            messageconfig.parseMessageConfigString(SAMPLE_CONFIG))
+
+    def testmodel(self):
+        model = self.model()
+        self.assertEqual(model.config.maxQueuedEvents, 100)
+        test = model["TestMessage"]
+        self.assertEqual((test.flavor, test.trustedSender, test.onlySendLatest,
+                          test.priority, test.deprecation),
+                         ("llsd", True, True, "Low", "NotDeprecated"))
+        # no entry of its own: the server default
+        self.assertEqual(model["PacketAck"].flavor, "template")
+        self.assertTrue(model["OnlyOverHTTP"].message is None)
+        self.assertEqual(sorted(i.name for i in model.byFlavor["llsd"]),
+                         ["OnlyOverHTTP", "TestMessage"])
+        self.assertEqual(model.messageAt(b"\xff\xff\xff\xfb", 0),
+                         (model["PacketAck"], 4))
+
+    def testconsistency(self):
+        template = SAMPLE_TEMPLATE.replace(
+            "TestMessage Low 1 NotTrusted Zerocoded",
+            "TestMessage High 1 NotTrusted Zerocoded").replace(
+            "PacketAck Fixed 0xFFFFFFFB NotTrusted Unencoded",
+            "PacketAck Fixed 0xFFFFFFFB NotTrusted Unencoded UDPBlackListed")
+        self.assertEqual(
+            [(i.severity, i.name) for i in messageconfig.checkConsistency(self.model(template))],
+            [("error", "NotInTemplate"), ("error", "PacketAck"),
+             ("warning", "TestMessage"), ("error", "TestMessage")])
+
+    def testbadxml(self):
+        self.assertRaises(messageconfig.ConfigError,
+                          messageconfig.parseMessageConfigString, "<llsd><map>")
+
+
+class TestCorpus(unittest.TestCase):
+    def setUp(self):
+        self.template = llmessage.parseTemplateString(SAMPLE_TEMPLATE)
+
+    def corpus(self, **kwargs):
+        f = io.BytesIO()
+        size = corpus.CorpusGenerator(self.template, seed=7, **kwargs).write(f, 300)
+        self.assertEqual(size, len(f.getvalue()))
+        return f.getvalue()
+
+    def testvalid(self):
+        codec = templatecodec.compileTemplate(self.template)
+        data = self.corpus()
+        self.assertEqual(data, self.corpus())
+        names = set()
+        packets = list(corpus.readCorpus(io.BytesIO(data)))
+        self.assertEqual(len(packets), 300)
+        for packet in packets:
+            decoded = zerocode.decodePacket(packet)
+            message, body = self.template.parseHeader(decoded)
+            values, end = codec.messages[message.name].decodeFrom(decoded, body)
+            self.assertEqual(end, len(decoded))
+            names.add(message.name)
+        self.assertEqual(names, set(["TestMessage", "PacketAck"]))
+
+    def testmix(self):
+        data = self.corpus(mix={"PacketAck": 1, "TestMessage": 0}, zerocoding=False)
+        for packet in corpus.readCorpus(io.BytesIO(data)):
+            self.assertEqual(packet[6:10], b"\xff\xff\xff\xfb")
+        self.assertRaises(KeyError, corpus.CorpusGenerator, self.template,
+                          {"Missing": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
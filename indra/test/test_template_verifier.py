@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+@file test_template_verifier.py
+@brief Test cases for template_verifier's master template fetching.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Second Life Viewer Source Code
+Copyright (C) 2024, Linden Research, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation;
+version 2.1 of the License only.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Linden Research, Inc., 945 Battery Street, San Francisco, CA  94111  USA
+$/LicenseInfo$
+"""
+
+import http.server
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'scripts'))
+import template_verifier
+from indra.ipc import tokenstream
+
+TEMPLATE = b"""\
+version 2.0
+{
+	TestMessage Low 1 NotTrusted Zerocoded
+	{
+		TestBlock1		Single
+		{	Test1		U32	}
+	}
+}
+"""
+
+class MasterHandler(http.server.BaseHTTPRequestHandler):
+    """Serves TEMPLATE with an ETag, honouring If-None-Match, and fails the
+    first server.failures requests."""
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        time.sleep(self.server.delay)
+        if self.server.failures:
+            self.server.failures -= 1
+            self.send_error(503)
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Last-Modified', 'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.send_header('Content-Length', str(len(TEMPLATE)))
+        self.end_headers()
+        self.wfile.write(TEMPLATE)
+
+    def log_message(self, *args):
+        pass
+
+class TestMasterFetch(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), MasterHandler)
+        self.server.requests = []
+        self.server.failures = 0
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/message_template.msg' % self.server.server_port
+        self.dir = tempfile.mkdtemp()
+        self.cache = os.path.join(self.dir, 'master.msg')
+        self.saved = template_verifier.local_master_cache_filename
+        template_verifier.local_master_cache_filename = lambda: self.cache
+
+    def tearDown(self):
+        template_verifier.local_master_cache_filename = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def cache_master(self, use_parse_cache=True):
+        with redirect_stdout(io.StringIO()):
+            return template_verifier.cache_master(self.url, use_parse_cache)
+
+    def testconditional(self):
+        self.assertEqual(self.cache_master(), 'file://' + self.cache)
+        with open(self.cache, 'rb') as f:
+            self.assertEqual(f.read(), TEMPLATE)
+        self.assertFalse('If-None-Match' in self.server.requests[0])
+
+        # still fresh: no request at all
+        self.cache_master()
+        self.assertEqual(len(self.server.requests), 1)
+
+        # stale: a conditional request, whose 304 renews the cache
+        stale = time.time() - template_verifier.MAX_MASTER_AGE - 10
+        os.utime(self.cache, (stale, stale))
+        self.cache_master()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1]['If-None-Match'], '"v1"')
+        self.assertEqual(self.server.requests[1]['If-Modified-Since'],
+                         'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertTrue(os.path.getmtime(self.cache) > stale + 5)
+        with open(self.cache, 'rb') as f:
+            self.assertEqual(f.read(), TEMPLATE)
+
+    def testretry(self):
+        self.server.failures = 2
+        body, etag, last_modified = template_verifier.retry(
+            3, template_verifier.fetch_if_modified, self.url, delay=0.01)
+        self.assertEqual((body, etag), (TEMPLATE, '"v1"'))
+        self.assertEqual(len(self.server.requests), 3)
+
+    def testdeadline(self):
+        self.server.failures = 5
+        start = time.monotonic()
+        self.assertRaises(IOError, template_verifier.retry, 10,
+                          template_verifier.fetch, self.url, delay=0.2, deadline=0.5)
+        # tries at 0 and 0.2 s; the next one would start after the deadline
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertTrue(time.monotonic() - start < 2)
+
+    def testrun(self):
+        current = os.path.join(self.dir, 'current.msg')
+        with open(current, 'wb') as f:
+            f.write(TEMPLATE)
+        with redirect_stdout(io.StringIO()) as out:
+            result = template_verifier.run(
+                ['-f', '--no-parse-cache', '--message-config', '',
+                 '-u', self.url, current])
+        self.assertFalse(result)
+        self.assertTrue('--- PASS ---' in out.getvalue())
+
+    def testlocalerror(self):
+        # a broken local template is reported without waiting for the master
+        self.server.delay = 2
+        current = os.path.join(self.dir, 'current.msg')
+        with open(current, 'wb') as f:
+            f.write(TEMPLATE.replace(b'U32', b'U33'))
+        start = time.monotonic()
+        with redirect_stdout(io.StringIO()):
+            self.assertRaises(tokenstream.ParseError, template_verifier.run,
+                              ['-f', '--no-parse-cache', '--message-config', '',
+                               '-u', self.url, current])
+        self.assertTrue(time.monotonic() - start < 1)
+
+        # nor does exiting the script
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              os.pardir, os.pardir, 'scripts', 'template_verifier.py')
+        start = time.monotonic()
+        result = subprocess.run([sys.executable, script, '-f', '--no-parse-cache',
+                                 '--message-config', '', '-u', self.url, current],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertTrue(time.monotonic() - start < 1.5)
+
+    def testnoparsecache(self):
+        parse_cache = os.path.join(self.dir, 'parse-cache')
+        saved = template_verifier.local_parse_cache_dirname
+        template_verifier.local_parse_cache_dirname = lambda: parse_cache
+        try:
+            self.cache_master(use_parse_cache=False)
+        finally:
+            template_verifier.local_parse_cache_dirname = saved
+        self.assertTrue(os.path.isfile(self.cache))
+        self.assertFalse(os.path.exists(parse_cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""\
+@file message_corpus.py
+@brief Write a synthetic packet corpus for message system load tests.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Second Life Viewer Source Code
+Copyright (C) 2024, Linden Research, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation;
+version 2.1 of the License only.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Linden Research, Inc., 945 Battery Street, San Francisco, CA  94111  USA
+$/LicenseInfo$
+"""
+
+"""message_corpus writes COUNT random but valid packets for the messages
+of a template to OUTPUT, each preceded by its length as a 4 byte
+little-endian integer (see indra.ipc.corpus). The same --seed always
+produces the same corpus.
+
+The message mix is either uniform over the messages still sent over UDP,
+or taken from --mix: a CSV of per-message counts such as the one
+message_traffic.py --csv writes, or a list like ObjectUpdate=10,AgentUpdate=5.
+"""
+
+import sys
+import os.path
+
+def add_indra_lib_path():
+    root = os.path.realpath(__file__)
+    # always insert the directory of the script in the search path
+    dir = os.path.dirname(root)
+    if dir not in sys.path:
+        sys.path.insert(0, dir)
+
+    # Now go look for indra/lib/python in the parent dies
+    while root != os.path.sep:
+        root = os.path.dirname(root)
+        dir = os.path.join(root, 'indra', 'lib', 'python')
+        if os.path.isdir(dir):
+            if dir not in sys.path:
+                sys.path.insert(0, dir)
+            return root
+    print("This script is not inside a valid installation.", file=sys.stderr)
+    sys.exit(1)
+
+SOURCE_ROOT = add_indra_lib_path()
+
+import argparse
+import time
+
+from indra.ipc import corpus
+from indra.ipc import llmessage
+
+from message_priorities import read_counts_csv
+
+DEFAULT_TEMPLATE = os.path.join(SOURCE_ROOT, 'scripts', 'messages', 'message_template.msg')
+
+
+def parse_mix(spec):
+    """A per-message weight dict from a CSV file or Name=weight,... list."""
+    if os.path.exists(spec):
+        return read_counts_csv(spec)
+    mix = {}
+    for part in spec.split(','):
+        name, sep, weight = part.partition('=')
+        try:
+            mix[name.strip()] = float(weight) if sep else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError("bad message mix entry %r" % part)
+    return mix
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="write a synthetic, length-prefixed packet corpus")
+    parser.add_argument('output', help="corpus file to write")
+    parser.add_argument('-n', '--count', type=int, default=1000000,
+                        help="number of packets [default: %(default)s]")
+    parser.add_argument('-t', '--template', default=DEFAULT_TEMPLATE,
+                        help="message template [default: %(default)s]")
+    parser.add_argument('--mix', type=parse_mix,
+                        help="message frequencies: a counts CSV or Name=weight,...")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="random seed [default: %(default)s]")
+    parser.add_argument('--no-zerocode', dest='zerocoding', action='store_false',
+                        help="don't zerocode Zerocoded messages")
+    parser.add_argument('--max-repeats', type=int, default=8,
+                        help="most instances of a Variable block [default: %(default)s]")
+    parser.add_argument('--max-variable-bytes', type=int, default=64,
+                        help="longest Variable field data [default: %(default)s]")
+    parser.add_argument('--variants', type=int, default=32,
+                        help="random encodings pooled per block [default: %(default)s]")
+    args = parser.parse_args(argv)
+
+    with open(args.template) as f:
+        template = llmessage.parseTemplateString(f.read())
+    try:
+        generator = corpus.CorpusGenerator(
+            template, args.mix, args.zerocoding, args.seed, args.variants,
+            args.max_repeats, args.max_variable_bytes)
+    except (KeyError, ValueError) as e:
+        print("message_corpus: %s" % e, file=sys.stderr)
+        return 1
+
+    start = time.time()
+    with open(args.output, 'wb') as f:
+        size = generator.write(f, args.count)
+    elapsed = time.time() - start
+    print("Wrote %d packets (%d bytes) to %s in %.1f s" % (
+        args.count, size, args.output, elapsed))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
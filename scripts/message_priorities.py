@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""\
+@file message_priorities.py
+@brief Propose moving busy messages to shorter message number bands.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Second Life Viewer Source Code
+Copyright (C) 2024, Linden Research, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation;
+version 2.1 of the License only.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Linden Research, Inc., 945 Battery Street, San Francisco, CA  94111  USA
+$/LicenseInfo$
+"""
+
+"""message_priorities takes per-message packet counts, either from pcap or
+pcapng captures or from a CSV file (such as the one message_traffic.py
+--csv writes, or plain name,count rows), and works out which messages to
+move into the free High and Medium numbers to save the most header bytes.
+
+It prints the savings and a unified diff against the template. Since a
+message can't change priority in place, each move deprecates the message
+and adds a renamed copy in the shorter band; the diff is checked with
+template_verifier's development rules before it is printed.
+"""
+
+import sys
+import os.path
+
+def add_indra_lib_path():
+    root = os.path.realpath(__file__)
+    # always insert the directory of the script in the search path
+    dir = os.path.dirname(root)
+    if dir not in sys.path:
+        sys.path.insert(0, dir)
+
+    # Now go look for indra/lib/python in the parent dies
+    while root != os.path.sep:
+        root = os.path.dirname(root)
+        dir = os.path.join(root, 'indra', 'lib', 'python')
+        if os.path.isdir(dir):
+            if dir not in sys.path:
+                sys.path.insert(0, dir)
+            return root
+    print("This script is not inside a valid installation.", file=sys.stderr)
+    sys.exit(1)
+
+SOURCE_ROOT = add_indra_lib_path()
+
+import argparse
+import csv
+import difflib
+
+from indra.ipc import capture
+from indra.ipc import llmessage
+from indra.ipc import priorities
+
+import message_traffic
+import template_verifier
+
+DEFAULT_TEMPLATE = os.path.join(SOURCE_ROOT, 'scripts', 'messages', 'message_template.msg')
+
+
+def read_counts_csv(filename):
+    """Per-message counts from a CSV with 'name' and 'packets' (or 'count')
+    columns, or from headerless name,count rows."""
+    counts = {}
+    with open(filename, newline='') as f:
+        rows = list(csv.reader(f))
+    if not rows:
+        return counts
+    header = [h.strip().lower() for h in rows[0]]
+    if 'name' in header:
+        name_col = header.index('name')
+        for column in ('packets', 'count'):
+            if column in header:
+                count_col = header.index(column)
+                break
+        else:
+            raise ValueError("%s has no packets or count column" % filename)
+        rows = rows[1:]
+    else:
+        name_col, count_col = 0, 1
+    for row in rows:
+        if not row or row[name_col].startswith('#'):
+            continue
+        try:
+            name, count = row[name_col].strip(), int(float(row[count_col]))
+        except (IndexError, ValueError):
+            raise ValueError("%s: bad row %r" % (filename, row))
+        counts[name] = counts.get(name, 0) + count
+    return counts
+
+def print_plan(template, counts, promotions, out=sys.stdout):
+    before = priorities.headerBytes(template, counts)
+    saved = sum(p.savings for p in promotions)
+    print("%-36s %11s %7s %7s %6s %-40s %11s" % (
+        "message", "packets", "from", "to", "number", "new name", "bytes saved"),
+          file=out)
+    for p in promotions:
+        print("%-36s %11d %7s %7s %6d %-40s %11d" % (
+            p.name, p.count, p.priority, p.target, p.number, p.newname, p.savings),
+              file=out)
+    print("message number bytes: %d now, %d after (%.1f%% saved)" % (
+        before, before - saved, 100.0 * saved / before if before else 0.0),
+          file=out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="propose message priority changes that save header bytes")
+    parser.add_argument('inputs', nargs='+', metavar='FILE',
+                        help="pcap/pcapng captures or CSV files of per-message counts")
+    parser.add_argument('-t', '--template', default=DEFAULT_TEMPLATE,
+                        help="message template to change [default: %(default)s]")
+    parser.add_argument('-p', '--port', type=message_traffic.parse_ports,
+                        default=capture.DEFAULT_PORTS,
+                        help="simulator UDP ports to look at in captures")
+    parser.add_argument('-m', '--min-count', type=int, default=1,
+                        help="leave messages sent fewer times than this alone")
+    parser.add_argument('-x', '--exclude', action='append', default=[],
+                        help="never move this message (may be repeated)")
+    parser.add_argument('--name-format', default=priorities.DEFAULT_NAME_FORMAT,
+                        help="name of the moved copy, from {name} and {priority} "
+                        "[default: %(default)s]")
+    parser.add_argument('-o', '--output',
+                        help="write the proposed template here instead of printing a diff")
+    args = parser.parse_args(argv)
+
+    with open(args.template) as f:
+        text = f.read()
+    template = llmessage.parseTemplateString(text)
+
+    counts = {}
+    captures = []
+    for filename in args.inputs:
+        if filename.lower().endswith('.csv'):
+            for name, count in read_counts_csv(filename).items():
+                counts[name] = counts.get(name, 0) + count
+        else:
+            captures.append(filename)
+    if captures:
+        stats = message_traffic.analyze(template, captures, args.port)
+        for name, s in stats.messages.items():
+            counts[name] = counts.get(name, 0) + s.packets
+
+    promotions = priorities.planPromotions(template, counts, args.min_count,
+                                           frozenset(args.exclude), args.name_format)
+    print_plan(template, counts, promotions)
+    if not promotions:
+        return 0
+
+    proposed = priorities.applyPromotions(text, promotions)
+    compat = priorities.checkPromotions(text, proposed)
+    if type(compat) not in template_verifier.mode_acceptable('development'):
+        print("The proposed template isn't compatible in development mode:\n%s"
+              % compat.explain(), file=sys.stderr)
+        return 1
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(proposed)
+        print("Wrote %s" % args.output)
+    else:
+        sys.stdout.writelines(difflib.unified_diff(
+            text.splitlines(True), proposed.splitlines(True),
+            args.template, args.template + ' (proposed)'))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
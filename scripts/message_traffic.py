@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""\
+@file message_traffic.py
+@brief Attribute captured viewer/simulator UDP traffic to template messages.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Second Life Viewer Source Code
+Copyright (C) 2024, Linden Research, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation;
+version 2.1 of the License only.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Linden Research, Inc., 945 Battery Street, San Francisco, CA  94111  USA
+$/LicenseInfo$
+"""
+
+"""message_traffic reads one or more pcap or pcapng captures (for instance
+from tcpdump -w or Wireshark) and reports, for each template message, how
+many packets carried it, their total and average wire size, and how much
+zerocoding saved. Captures are memory-mapped and streamed, so multi-GB
+files are processed in constant memory.
+
+Only UDP datagrams to or from a simulator port are looked at; use --port to
+change the set of ports.
+"""
+
+import sys
+import os.path
+
+def add_indra_lib_path():
+    root = os.path.realpath(__file__)
+    # always insert the directory of the script in the search path
+    dir = os.path.dirname(root)
+    if dir not in sys.path:
+        sys.path.insert(0, dir)
+
+    # Now go look for indra/lib/python in the parent dies
+    while root != os.path.sep:
+        root = os.path.dirname(root)
+        dir = os.path.join(root, 'indra', 'lib', 'python')
+        if os.path.isdir(dir):
+            if dir not in sys.path:
+                sys.path.insert(0, dir)
+            return root
+    print("This script is not inside a valid installation.", file=sys.stderr)
+    sys.exit(1)
+
+SOURCE_ROOT = add_indra_lib_path()
+
+import argparse
+import csv
+import json
+
+from indra.ipc import capture
+from indra.ipc import llmessage
+from indra.ipc import templatecodec
+
+DEFAULT_TEMPLATE = os.path.join(SOURCE_ROOT, 'scripts', 'messages', 'message_template.msg')
+
+CSV_FIELDS = ('name', 'packets', 'bytes', 'averageSize', 'bodyBytes',
+              'zerocoded', 'zerocodedBytes', 'expandedBytes', 'zerocodeSavings',
+              'reliable', 'resent', 'acks', 'errors')
+
+SORT_KEYS = {
+    'bytes': 'bytes',
+    'packets': 'packets',
+    'size': 'averageSize',
+    'savings': 'zerocodeSavings',
+    'name': 'name',
+    }
+
+
+def parse_ports(spec):
+    """Parse "12035,13000-13050" (or "all") into a set of ports."""
+    if spec == 'all':
+        return None
+    ports = set()
+    for part in spec.split(','):
+        low, sep, high = part.partition('-')
+        try:
+            if sep:
+                ports.update(range(int(low), int(high) + 1))
+            else:
+                ports.add(int(low))
+        except ValueError:
+            raise argparse.ArgumentTypeError("bad port list %r" % spec)
+    return frozenset(ports)
+
+def load_template(filename):
+    with open(filename) as f:
+        return llmessage.parseTemplateString(f.read())
+
+def analyze(template, filenames, ports=capture.DEFAULT_PORTS, decode_bodies=False):
+    codec = templatecodec.compileTemplate(template) if decode_bodies else None
+    stats = capture.TrafficStats(template, codec)
+    for filename in filenames:
+        with capture.Capture(filename) as c:
+            stats.addCapture(c, ports)
+    return stats
+
+def sorted_stats(stats, sort):
+    key = SORT_KEYS[sort]
+    if key == 'name':
+        return sorted(stats.messages.values(), key=lambda s: s.name)
+    return stats.sortedMessages(key)
+
+def print_table(stats, rows, out=sys.stdout):
+    total = stats.bytes or 1
+    print("%-36s %9s %12s %6s %8s %11s %7s %7s %6s" % (
+        "message", "packets", "bytes", "%", "avg", "zc saved", "zc %",
+        "rel %", "errors"), file=out)
+    for s in rows:
+        print("%-36s %9d %12d %6.2f %8.1f %11d %7.1f %7.1f %6d" % (
+            s.name, s.packets, s.bytes, 100.0 * s.bytes / total, s.averageSize,
+            s.zerocodeSavings,
+            100.0 * s.zerocodeSavings / s.expandedBytes if s.expandedBytes else 0.0,
+            100.0 * s.reliable / s.packets if s.packets else 0.0,
+            s.errors), file=out)
+    savings = sum(s.zerocodeSavings for s in stats.messages.values())
+    print("%d packets, %d bytes in %.1f s; zerocoding saved %d bytes" % (
+        stats.packets, stats.bytes, stats.duration, savings), file=out)
+
+def write_csv(rows, filename):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        for s in rows:
+            d = s.toDict()
+            writer.writerow([d[k] for k in CSV_FIELDS])
+
+def write_json(stats, rows, filename):
+    with open(filename, 'w') as f:
+        json.dump({'packets': stats.packets,
+                   'bytes': stats.bytes,
+                   'duration': stats.duration,
+                   'messages': [s.toDict() for s in rows]},
+                  f, indent=2)
+        f.write('\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="attribute captured UDP traffic to template messages")
+    parser.add_argument('captures', nargs='+', metavar='CAPTURE',
+                        help="pcap or pcapng capture files")
+    parser.add_argument('-t', '--template', default=DEFAULT_TEMPLATE,
+                        help="message template to decode with [default: %(default)s]")
+    parser.add_argument('-p', '--port', type=parse_ports,
+                        default=capture.DEFAULT_PORTS,
+                        help="simulator UDP ports, e.g. 12035,13000-13050, or 'all'")
+    parser.add_argument('-d', '--decode', action='store_true',
+                        help="also decode every message body, counting failures as errors")
+    parser.add_argument('-s', '--sort', choices=sorted(SORT_KEYS), default='bytes',
+                        help="table order [default: %(default)s]")
+    parser.add_argument('-n', '--limit', type=int, default=0,
+                        help="only show the top N messages")
+    parser.add_argument('--csv', help="also write the per-message totals to this CSV file")
+    parser.add_argument('--json', help="also write the per-message totals to this JSON file")
+    args = parser.parse_args(argv)
+
+    template = load_template(args.template)
+    try:
+        stats = analyze(template, args.captures, args.port, args.decode)
+    except (capture.CaptureError, OSError) as e:
+        print("message_traffic: %s" % e, file=sys.stderr)
+        return 1
+
+    rows = sorted_stats(stats, args.sort)
+    print_table(stats, rows[:args.limit] if args.limit else rows)
+    if args.csv:
+        write_csv(rows, args.csv)
+    if args.json:
+        write_json(stats, rows, args.json)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
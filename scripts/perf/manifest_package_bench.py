@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""\
+@file manifest_package_bench.py
+@brief Compares the Linux package_finish tarball step with tar -caf.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Second Life Viewer Source Code
+Copyright (C) 2024, Linden Research, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation;
+version 2.1 of the License only.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Linden Research, Inc., 945 Battery Street, San Francisco, CA  94111  USA
+$/LicenseInfo$
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+def add_indra_lib_path():
+    root = os.path.realpath(__file__)
+    while root != os.path.sep:
+        root = os.path.dirname(root)
+        dir = os.path.join(root, 'indra', 'lib', 'python')
+        if os.path.isdir(dir):
+            if dir not in sys.path:
+                sys.path.insert(0, dir)
+            return root
+    print("This script is not inside a valid installation.", file=sys.stderr)
+    sys.exit(1)
+
+SOURCE_ROOT = add_indra_lib_path()
+
+from indra.util import llmanifest
+
+
+def make_tree(root, megabytes, seed):
+    """A stand-in for a staged viewer: a few large, partly compressible
+    binaries, many small files and a bin/.debug directory to exclude."""
+    rng = random.Random(seed)
+    def write(rel, size):
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            # half noise, half repetitive, like code and data sections
+            f.write(rng.randbytes(size // 2))
+            f.write((b'\x00\x48\x89\xe5' * (size // 8 + 1))[:size - size // 2])
+    total = megabytes << 20
+    for name, share in (('bin/do-not-directly-run-firestorm-bin', 0.3),
+                        ('lib/libcef.so', 0.5), ('bin/.debug/firestorm-bin.debug', 0.1)):
+        write(name, int(total * share))
+    for i in range(500):
+        write('app_settings/file%03d.xml' % i, int(total * 0.1 / 500))
+
+def listing(tarname):
+    return sorted(subprocess.check_output(['tar', '-tJf', tarname]).decode().split())
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Times the Linux viewer tarball: tar -caf, as package_finish "
+        "used to run it, against LLManifest.xz_tarball().")
+    parser.add_argument('--tree', help="staged viewer directory to package "
+                        "(default: a generated one)")
+    parser.add_argument('--megabytes', type=int, default=200,
+                        help="size of the generated tree")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="compression processes (default: one per core)")
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args(argv)
+
+    work = tempfile.mkdtemp()
+    try:
+        tree = options.tree
+        if tree is None:
+            tree = os.path.join(work, 'staged')
+            make_tree(tree, options.megabytes, options.seed)
+        name = 'Phoenix-Firestorm-bench'
+        # tar names the tree by its directory, so give it the package name
+        named = os.path.join(work, name)
+        os.symlink(os.path.abspath(tree), named)
+        exclude = name + '/bin/.debug'
+
+        baseline = os.path.join(work, 'baseline.tar.xz')
+        start = time.perf_counter()
+        subprocess.check_call(['tar', '-C', work, '--numeric-owner', '--dereference',
+                               '--exclude=' + exclude, '-caf', baseline, name])
+        tar_time = time.perf_counter() - start
+
+        current = os.path.join(work, 'current.tar.xz')
+        m = llmanifest.LLManifest({'dest': tree, 'build': work, 'source': work,
+                                   'artwork': work, 'actions': [], 'state_file': '',
+                                   'compress_workers': str(options.workers or '')})
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            m.xz_tarball(current, tree, name, excludes=[exclude])
+        xz_time = time.perf_counter() - start
+
+        if listing(baseline) != listing(current):
+            print("The tarballs list different files!", file=sys.stderr)
+            return 1
+        for label, tarname, seconds in (('tar -caf', baseline, tar_time),
+                                        ('xz_tarball', current, xz_time)):
+            print("%-10s %8.2f s  %12d bytes" % (label, seconds, os.path.getsize(tarname)))
+        print("speedup %.1fx on %d cores" % (tar_time / xz_time, os.cpu_count() or 1))
+        return 0
+    finally:
+        shutil.rmtree(work)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""\
+@file message_template_bench.py
+@brief Micro-benchmarks for the message template tooling in indra.ipc.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Second Life Viewer Source Code
+Copyright (C) 2024, Linden Research, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation;
+version 2.1 of the License only.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Linden Research, Inc., 945 Battery Street, San Francisco, CA  94111  USA
+$/LicenseInfo$
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import timeit
+
+def add_indra_lib_path():
+    root = os.path.realpath(__file__)
+    while root != os.path.sep:
+        root = os.path.dirname(root)
+        dir = os.path.join(root, 'indra', 'lib', 'python')
+        if os.path.isdir(dir):
+            if dir not in sys.path:
+                sys.path.insert(0, dir)
+            return root
+    print("This script is not inside a valid installation.", file=sys.stderr)
+    sys.exit(1)
+
+SOURCE_ROOT = add_indra_lib_path()
+
+from indra.ipc import compatibility as compatibility_module
+from indra.ipc import corpus
+from indra.ipc import llmessage
+from indra.ipc import templatecodec
+from indra.ipc import tokenstream
+from indra.ipc import zerocode
+
+DEFAULT_TEMPLATE = os.path.join(SOURCE_ROOT, 'scripts', 'messages', 'message_template.msg')
+
+
+def best_of(function, repeat, number):
+    """Return the best per-call time of function, in seconds."""
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+def report(name, baseline, candidate):
+    print("%-12s baseline %9.3f ms   current %9.3f ms   speedup %6.1fx" % (
+        name, baseline * 1000, candidate * 1000, baseline / candidate))
+
+
+class _PopFrontTokenStream(object):
+    """The original list.pop(0) lexer, kept only as a baseline to measure
+    against."""
+    def __init__(self):
+        self.line = 0
+        self.tokens = [ ]
+
+    def fromString(self, string):
+        for i, line in enumerate(string.split('\n'), 1):
+            self.tokens.append(i)
+            self.tokens.extend(tokenstream._commentRE.sub(" ", line).split())
+        self._consumeLines()
+        return self
+
+    def consume(self):
+        if not self.tokens:
+            return tokenstream.EOF
+        t = self.tokens.pop(0)
+        self._consumeLines()
+        return t
+
+    def _consumeLines(self):
+        while self.tokens and isinstance(self.tokens[0], int):
+            self.line = self.tokens.pop(0)
+
+    def peek(self):
+        if not self.tokens:
+            return tokenstream.EOF
+        return self.tokens[0]
+
+def drain(stream):
+    while stream.peek() is not tokenstream.EOF:
+        stream.consume()
+
+def bench_tokenize(text, options):
+    baseline = best_of(lambda: drain(_PopFrontTokenStream().fromString(text)),
+                       options.repeat, options.number)
+    current = best_of(lambda: drain(tokenstream.TokenStream().fromString(text)),
+                      options.repeat, options.number)
+    report("tokenize", baseline, current)
+    parse = best_of(lambda: llmessage.parseTemplateString(text),
+                    options.repeat, options.number)
+    print("%-12s current %9.3f ms" % ("parse", parse * 1000))
+
+
+def sample_value(variable, rng):
+    """A plausible value for variable: integers are mostly zero or small,
+    which is what makes zerocoding pay off on real traffic."""
+    t = variable.type
+    if t in (llmessage.Variable.F32, llmessage.Variable.F64):
+        return rng.uniform(-256.0, 256.0)
+    if t in (llmessage.Variable.LLVECTOR3, llmessage.Variable.LLVECTOR3D,
+             llmessage.Variable.LLQUATERNION):
+        return (rng.uniform(0, 256), rng.uniform(0, 256), rng.uniform(0, 64))
+    if t == llmessage.Variable.LLVECTOR4:
+        return (rng.random(), rng.random(), rng.random(), 1.0)
+    if t == llmessage.Variable.LLUUID:
+        return bytes(16) if rng.random() < 0.3 else rng.randbytes(16)
+    if t == llmessage.Variable.IPADDR:
+        return bytes((10, 0, 0, rng.randrange(256)))
+    if t == llmessage.Variable.IPPORT:
+        return 13000 + rng.randrange(100)
+    if t == llmessage.Variable.BOOL:
+        return rng.random() < 0.5
+    if t == llmessage.Variable.FIXED:
+        return bytes(int(variable.size))
+    if t == llmessage.Variable.VARIABLE:
+        return b'sample text\0'[:rng.randrange(13)]
+    return rng.choice((0, 0, 0, 1, rng.randrange(128)))
+
+def sample_message(message, rng):
+    data = { }
+    for block in message.blocks:
+        if block.repeat == llmessage.Block.SINGLE:
+            n = 1
+        elif block.repeat == llmessage.Block.MULTIPLE:
+            n = block.count
+        else:
+            n = rng.randrange(1, 4)
+        data[block.name] = [dict((v.name, sample_value(v, rng)) for v in block.variables)
+                            for i in range(n)]
+    return data
+
+def bench_zerocode(text, options):
+    template = llmessage.parseTemplateString(text)
+    codec = templatecodec.compileTemplate(template)
+    rng = random.Random(options.seed)
+    rows = [ ]
+    for name in sorted(template.messages):
+        message = template.messages[name]
+        if message.coding != llmessage.Message.ZEROCODED:
+            continue
+        body = codec.encode(name, sample_message(message, rng))
+        encoded = zerocode.encode(body)
+        if zerocode.decode(encoded) != body:
+            raise RuntimeError("zerocode round trip failed for %s" % name)
+        number = max(1, options.number * 100)
+        enc = best_of(lambda: zerocode.encode(body), options.repeat, number)
+        dec = best_of(lambda: zerocode.decode(encoded), options.repeat, number)
+        rows.append((name, len(body), len(encoded), enc, dec))
+
+    if options.verbose:
+        print("%-36s %7s %7s %7s %9s %9s" % (
+            "message", "raw", "encoded", "ratio", "enc us", "dec us"))
+        for name, raw, encoded, enc, dec in rows:
+            print("%-36s %7d %7d %6.1f%% %9.2f %9.2f" % (
+                name, raw, encoded, 100.0 * encoded / max(raw, 1),
+                enc * 1e6, dec * 1e6))
+    raw = sum(r[1] for r in rows)
+    encoded = sum(r[2] for r in rows)
+    enc = sum(r[3] for r in rows)
+    dec = sum(r[4] for r in rows)
+    print("%-12s %d messages, %d -> %d bytes (%.1f%%), "
+          "encode %.1f MB/s, decode %.1f MB/s, %d larger when encoded" % (
+              "zerocode", len(rows), raw, encoded, 100.0 * encoded / raw,
+              raw / enc / 1e6, raw / dec / 1e6,
+              sum(1 for r in rows if r[2] > r[1])))
+
+
+def full_walk(current, base):
+    """Template.compatibleWithBase() as it was before fingerprints: every
+    message pair gets the full block and variable walk."""
+    compatibility = compatibility_module.Same()
+    for name in frozenset(current.messages) | frozenset(base.messages):
+        selfmessage = current.messages.get(name, None)
+        basemessage = base.messages.get(name, None)
+        if not selfmessage:
+            c = compatibility_module.Older("missing message %s, did you mean to deprecate?" % name)
+        elif not basemessage:
+            c = compatibility_module.Newer("added message %s" % name)
+        else:
+            c = selfmessage.compatibleWithBase(basemessage)
+            c.prefix("in message %s: " % name)
+        compatibility = compatibility.combine(c)
+    return compatibility
+
+def edit_one_message(text, name):
+    """Returns text with a block appended to message name, which is what
+    most (compatible) template changes look like."""
+    start = text.index('\t%s ' % name)
+    end = text.index('\n}\n', start)
+    return (text[:end] + '\n\t{\n\t\tBenchmarkAddition\tSingle\n'
+            '\t\t{\tValue\tU32\t}\n\t}' + text[end:])
+
+def bench_compat(text, options):
+    base = llmessage.parseTemplateString(text)
+    current = llmessage.parseTemplateString(edit_one_message(text, options.message))
+    expected = full_walk(current, base)
+    # as loaded from template_verifier's parse cache
+    base.computeFingerprints()
+    current.computeFingerprints()
+    result = current.compatibleWithBase(base)
+    if (type(result), result.explain()) != (type(expected), expected.explain()):
+        raise RuntimeError("incremental compatibility differs:\n%s\nvs\n%s"
+                           % (result.explain(), expected.explain()))
+    number = options.number * 10
+    baseline = best_of(lambda: full_walk(current, base), options.repeat, number)
+    warm = best_of(lambda: current.compatibleWithBase(base), options.repeat, number)
+    report("compat", baseline, warm)
+
+    # a freshly parsed pair pays for fingerprinting once, as template_verifier
+    # does before storing a parse in its cache
+    edited = edit_one_message(text, options.message)
+    cold = float('inf')
+    for i in range(options.repeat):
+        base = llmessage.parseTemplateString(text)
+        current = llmessage.parseTemplateString(edited)
+        start = time.perf_counter()
+        base.computeFingerprints()
+        current.computeFingerprints()
+        cold = min(cold, time.perf_counter() - start)
+    print("%-12s %9.3f ms to fingerprint both templates once" % ("", cold * 1000))
+    print("%-12s %s" % ("", result.explain().strip().replace("\n", "; ")))
+
+
+class _NullFile(object):
+    def write(self, data):
+        pass
+
+def bench_corpus(text, options):
+    template = llmessage.parseTemplateString(text)
+    generator = corpus.CorpusGenerator(template, seed=options.seed)
+    count = options.number * 10000
+    elapsed = best_of(lambda: generator.write(_NullFile(), count), options.repeat, 1)
+    print("%-12s %9d packets in %7.3f s   %6.2f million packets/minute" % (
+        "corpus", count, elapsed, count / elapsed * 60 / 1e6))
+
+
+BENCHMARKS = {
+    'compat': bench_compat,
+    'corpus': bench_corpus,
+    'tokenize': bench_tokenize,
+    'zerocode': bench_zerocode,
+    }
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Micro-benchmarks for the message template tooling.")
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help="benchmarks to run, from: %s (default: all)"
+                        % ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument('--template', default=DEFAULT_TEMPLATE,
+                        help="message template to benchmark against")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed for generated sample messages")
+    parser.add_argument('--message', default='ObjectUpdate',
+                        help="message edited for the compat benchmark")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="print per-message results where available")
+    options = parser.parse_args(argv)
+    unknown = set(options.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmark(s): %s" % ", ".join(sorted(unknown)))
+
+    with open(options.template) as f:
+        text = f.read()
+    print("template: %s (%d bytes)" % (options.template, len(text)))
+    for name in options.benchmarks or sorted(BENCHMARKS):
+        BENCHMARKS[name](text, options)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -63,14 +63,20 @@ def add_indra_lib_path():
 
 add_indra_lib_path()
 
+import json
 import optparse
 import os
+import pickle
+import threading
+import time
 import urllib.request, urllib.parse, urllib.error
 import hashlib
 
 from indra.ipc import compatibility
 from indra.ipc import tokenstream
 from indra.ipc import llmessage
+from indra.ipc import messageconfig
+from indra.ipc import wiresize
 
 def getstatusall(command):
     """ Like commands.getstatusoutput, but returns stdout and 
@@ -102,15 +108,52 @@ DEVELOPMENT_ACCEPTABLE = (
 
 MAX_MASTER_AGE = 60 * 60 * 4   # refresh master cache every 4 hours
 
-def retry(times, function, *args, **kwargs):
+MAX_PARSE_CACHE_ENTRIES = 8    # parsed templates kept in the parse cache
+
+FETCH_TIMEOUT = 30             # seconds to wait on any one request
+RETRY_DELAY = 1                # seconds before the first retry, doubling after
+RETRY_DEADLINE = 120           # seconds after which we stop retrying
+
+def retry(times, function, *args, delay=RETRY_DELAY, deadline=RETRY_DEADLINE, **kwargs):
+    """Calls function up to times times until it doesn't raise, waiting
+    delay seconds before the first retry and twice as long before each
+    one after that. No retry starts more than deadline seconds after the
+    first attempt; the last exception is raised once we give up."""
+    give_up = time.monotonic() + deadline
     for i in range(times):
         try:
             return function(*args, **kwargs)
         except Exception as e:
-            if i == times - 1:
+            wait = delay * (2 ** i)
+            if i == times - 1 or time.monotonic() + wait > give_up:
                 raise e  # we retried all the times we could
+            time.sleep(wait)
+
+class Background(threading.Thread):
+    """Calls function() on a daemon thread, so that neither returning early
+    nor exiting the interpreter waits for it; result() waits, and returns
+    what it returned or raises what it raised."""
+    def __init__(self, function):
+        super(Background, self).__init__(daemon=True)
+        self.function = function
+        self.value = None
+        # not just tested for truth: tokenstream.ParseError is always false
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.value = self.function()
+        except BaseException as e:
+            self.error = e
 
-def compare(base_parsed, current_parsed, mode):
+    def result(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+def compare(base_parsed, current_parsed, mode, report=None):
     """Compare the current template against the base template using the given
     'mode' strictness:
 
@@ -120,55 +163,156 @@ def compare(base_parsed, current_parsed, mode):
     Print out information about whether the current template is compatible
     with the base template.
 
+    If report (a compatibility.Report) is given, per-message results are
+    collected in it too.
+
     Returns a tuple of (bool, Compatibility)
     Return True if they are compatible in this mode, False if not.
     """
 
-    compat = current_parsed.compatibleWithBase(base_parsed)
-    if mode == 'production':
-        acceptable = PRODUCTION_ACCEPTABLE
-    else:
-        acceptable = DEVELOPMENT_ACCEPTABLE
+    acceptable = mode_acceptable(mode)
+    compat = current_parsed.compatibleWithBase(base_parsed, report)
 
     if type(compat) in acceptable:
         return True, compat
     return False, compat
 
+def mode_acceptable(mode):
+    if mode == 'production':
+        return PRODUCTION_ACCEPTABLE
+    return DEVELOPMENT_ACCEPTABLE
+
+def write_report(report, json_filename, junit_filename):
+    """Writes the machine-readable compatibility reports requested on the
+    command line."""
+    for filename, contents in ((json_filename, report.toJSON),
+                               (junit_filename, report.toJUnit)):
+        if filename:
+            with open(filename, 'w') as f:
+                f.write(contents())
+            print("Wrote %s" % filename)
+
+def check_sizes(template, show_table=False, sort='name'):
+    """Checks every message's packet size bounds against the MTU and the
+    packet buffer, printing what it finds. Returns False if some message
+    can never fit in the packet buffer."""
+    sizes = wiresize.templateSizes(template)
+    if show_table:
+        print('\n'.join(wiresize.formatTable(sizes, sort)))
+    errors, warnings = wiresize.checkSizes(sizes)
+    for warning in warnings:
+        print("WARNING: %s" % warning)
+    for error in errors:
+        print("ERROR: %s" % error)
+    sent = [s for s in sizes if s.sentOverUDP()]
+    print("Packet sizes: %d messages can exceed the %d byte MTU, "
+          "%d the %d byte packet buffer, at their largest." % (
+          len([s for s in sent if s.maximum > wiresize.MTU_BYTES]), wiresize.MTU_BYTES,
+          len([s for s in sent if s.maximum > wiresize.BUFFER_BYTES]),
+          wiresize.BUFFER_BYTES))
+    return not errors
+
+def check_message_config(template, filename):
+    """Checks the template against the message routing in message.xml,
+    printing any inconsistencies. Returns False if there are errors."""
+    try:
+        with open(filename, 'rb') as f:
+            config = messageconfig.parseMessageConfigFile(f)
+    except (OSError, messageconfig.ConfigError) as e:
+        print("WARNING: not checking message routing, can't read %s: %s" % (filename, e))
+        return True
+    issues = messageconfig.checkConsistency(
+        messageconfig.MessageModel(template, config))
+    for issue in issues:
+        print("%s: %s: %s" % (issue.severity.upper(), issue.name, issue.reason))
+    return not [i for i in issues if i.severity == messageconfig.ERROR]
+
 def fetch(url):
+    return fetch_if_modified(url)[0]
+
+def fetch_if_modified(url, etag=None, last_modified=None):
+    """Fetches url, sending If-None-Match and If-Modified-Since for the
+    given validators. Returns (contents, etag, last_modified), with
+    contents None if the server answered 304 Not Modified."""
     if url.startswith('file://'):
         # just open the file directly because urllib is dumb about these things
         file_name = url[len('file://'):]
         with open(file_name, 'rb') as f:
-            return f.read()
-    else:
-        with urllib.request.urlopen(url) as res:
+            return f.read(), None, None
+    request = urllib.request.Request(url)
+    if etag:
+        request.add_header('If-None-Match', etag)
+    if last_modified:
+        request.add_header('If-Modified-Since', last_modified)
+    try:
+        with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as res:
             body = res.read()
             if res.status > 299:
                 sys.exit("ERROR: Unable to download %s. HTTP status %d.\n%s" % (url, res.status, body.decode("utf-8")))
-            return body
-
-def cache_master(master_url):
+            return body, res.headers.get('ETag'), res.headers.get('Last-Modified')
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, etag, last_modified
+        raise
+
+def read_master_validators(master_url):
+    """Returns the (etag, last_modified) stored with the master cache when
+    it was last downloaded from master_url, or (None, None)."""
+    try:
+        with open(local_master_cache_filename() + '.validators') as f:
+            validators = json.load(f)
+        if validators.get('url') == master_url:
+            return validators.get('etag'), validators.get('last_modified')
+    except (OSError, ValueError):
+        pass
+    return None, None
+
+def write_master_validators(master_url, etag, last_modified):
+    filename = local_master_cache_filename() + '.validators'
+    try:
+        if etag or last_modified:
+            with open(filename, 'w') as f:
+                json.dump({'url': master_url, 'etag': etag,
+                           'last_modified': last_modified}, f)
+        elif os.path.exists(filename):
+            os.unlink(filename)
+    except OSError as e:
+        print("WARNING: Unable to write %s: %s" % (filename, e))
+
+def cache_master(master_url, use_parse_cache=True):
     """Using the url for the master, updates the local cache, and returns an url to the local cache."""
     master_cache = local_master_cache_filename()
     master_cache_url = 'file://' + master_cache
     # decide whether to refresh the master cache based on its age
-    import time
-    if (os.path.exists(master_cache)
+    have_cache = os.path.exists(master_cache)
+    if (have_cache
         and time.time() - os.path.getmtime(master_cache) < MAX_MASTER_AGE):
         return master_cache_url  # our cache is fresh
-    # new master doesn't exist or isn't fresh
+    # new master doesn't exist or isn't fresh; if we still have it, only
+    # ask for it again if it has changed
+    etag, last_modified = (read_master_validators(master_url) if have_cache
+                           else (None, None))
     print("Refreshing master cache from %s" % master_url)
     def get_and_test_master():
-        new_master_contents = fetch(master_url)
-        llmessage.parseTemplateString(new_master_contents.decode("utf-8"))
-        return new_master_contents
+        contents, new_etag, new_last_modified = fetch_if_modified(
+            master_url, etag, last_modified)
+        if contents is not None:
+            parse_template(contents, use_parse_cache)
+        return contents, new_etag, new_last_modified
     try:
-        new_master_contents = retry(3, get_and_test_master)
+        new_master_contents, etag, last_modified = retry(3, get_and_test_master)
     except IOError as e:
         # the refresh failed, so we should just soldier on
         print("WARNING: unable to download new master, probably due to network error.  Your message template compatibility may be suspect.")
         print("Cause: %s" % e)
         return master_cache_url
+    if new_master_contents is None:
+        print("Master is unchanged; renewing the cache")
+        try:
+            os.utime(master_cache)
+        except OSError as e:
+            print("WARNING: Unable to touch %s: %s" % (master_cache, e))
+        return master_cache_url
     try:
         tmpname = '%s.%d' % (master_cache, os.getpid())
         with open(tmpname, "wb") as mc:
@@ -187,8 +331,96 @@ def cache_master(master_url):
         print("WARNING: Unable to write master message template to %s, proceeding without cache." % master_cache)
         print("Cause: %s" % e)
         return master_url
+    write_master_validators(master_url, etag, last_modified)
     return master_cache_url
 
+_parser_fingerprint = None
+def parser_fingerprint():
+    """Returns a digest of the template parser's own source, so that any
+    change to the parser or the classes it builds invalidates the parse
+    cache without anyone having to remember to bump a version number."""
+    global _parser_fingerprint
+    if _parser_fingerprint is None:
+        h = hashlib.sha1(('pickle %d' % pickle.HIGHEST_PROTOCOL).encode())
+        for module in (llmessage, tokenstream, compatibility):
+            with open(module.__file__, 'rb') as f:
+                h.update(f.read())
+        _parser_fingerprint = h.hexdigest()
+    return _parser_fingerprint
+
+def local_parse_cache_dirname():
+    """Returns the location of the parsed template cache (in the system tempdir)
+    <temp_dir>/message_template_parse_cache.<user>"""
+    import tempfile
+    return os.path.join(tempfile.gettempdir(),
+                        'message_template_parse_cache.%s' % getuser())
+
+def parse_cache_filename(contents):
+    """Returns the parse cache file for the template bytes in contents, keyed
+    by the template's sha1 and the parser fingerprint, creating the cache
+    directory if necessary. Returns None if there's no usable cache."""
+    d = local_parse_cache_dirname()
+    try:
+        os.makedirs(d, mode=0o700, exist_ok=True)
+        if hasattr(os, 'getuid') and os.stat(d).st_uid != os.getuid():
+            # never unpickle something another user could have written
+            return None
+    except OSError:
+        return None
+    key = '%s-%s' % (hashlib.sha1(contents).hexdigest(), parser_fingerprint()[:16])
+    return os.path.join(d, key + '.pickle')
+
+def prune_parse_cache(keep):
+    d = local_parse_cache_dirname()
+    try:
+        entries = [os.path.join(d, name) for name in os.listdir(d)
+                   if name.endswith('.pickle')]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for old in entries[keep:]:
+            os.unlink(old)
+    except OSError:
+        pass
+
+def parse_template(contents, use_cache=True):
+    """Parses the template bytes in contents, reusing a previously pickled
+    parse of identical contents by the same parser if there is one."""
+    cache_filename = parse_cache_filename(contents) if use_cache else None
+    if cache_filename:
+        try:
+            with open(cache_filename, 'rb') as f:
+                parsed = pickle.load(f)
+            if isinstance(parsed, llmessage.Template):
+                os.utime(cache_filename)
+                return parsed
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print("WARNING: ignoring unreadable parse cache %s: %s" % (cache_filename, e))
+
+    parsed = llmessage.parseTemplateString(contents.decode("utf-8"))
+
+    if cache_filename:
+        # store the structural fingerprints too, so compatibleWithBase() can
+        # skip unchanged messages without recomputing them on every run
+        parsed.computeFingerprints()
+        try:
+            # the current and master templates may be parsed at once
+            tmpname = '%s.%d.%d' % (cache_filename, os.getpid(), threading.get_ident())
+            with open(tmpname, 'wb') as f:
+                pickle.dump(parsed, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, cache_filename)
+        except OSError as e:
+            print("WARNING: Unable to write parse cache %s." % cache_filename)
+            print("Cause: %s" % e)
+        prune_parse_cache(MAX_PARSE_CACHE_ENTRIES)
+    return parsed
+
+def local_message_config_filename():
+    """Returns message.xml's default location relative to template_verifier.py:
+    ../etc/message.xml."""
+    d = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(os.path.dirname(d), 'etc', 'message.xml')
+
 def local_template_filename():
     """Returns the message template's default location relative to template_verifier.py:
     ./messages/message_template.msg."""
@@ -240,6 +472,28 @@ http://wiki.secondlife.com/wiki/Template_verifier.py
     parser.add_option(
         '-f', '--force', action='store_true', dest='force_verification',
         default=False, help="""Set to true to skip the sha_1 check and force template verification.""")
+    parser.add_option(
+        '--no-parse-cache', action='store_false', dest='parse_cache',
+        default=True, help="""Always reparse the templates instead of reusing cached parses.""")
+    parser.add_option(
+        '--json', type='string', dest='json_report', default=None,
+        help="""Write the per-message compatibility results to this file as JSON.""")
+    parser.add_option(
+        '--junit', type='string', dest='junit_report', default=None,
+        help="""Write the per-message compatibility results to this file as JUnit XML.""")
+    parser.add_option(
+        '--message-config', type='string', dest='message_config',
+        default=local_message_config_filename(),
+        help="""The message.xml to check the current template's routing against
+[default: %default]; pass an empty string to skip the check.""")
+    parser.add_option(
+        '--sizes', action='store_true', dest='sizes', default=False,
+        help="""Print the smallest, typical and largest packet size of every message.""")
+    parser.add_option(
+        '--sizes-sort', type='choice', dest='sizes_sort', default='name',
+        choices=list(wiresize.SORT_KEYS),
+        help="""Order of the --sizes table: %s [default: %%default]."""
+        % ", ".join(wiresize.SORT_KEYS))
 
     options, args = parser.parse_args(sysargs)
 
@@ -287,18 +541,33 @@ http://wiki.secondlife.com/wiki/Template_verifier.py
             print("Message template SHA_1 has not changed.")
             sys.exit(0)
 
+    def get_master():
+        url = master_url
+        if options.cache_master:
+            # optionally return a url to a locally-cached master so we don't hit the network all the time
+            url = cache_master(url, options.parse_cache)
+        return retry(3, lambda: parse_template(fetch(url), options.parse_cache))
+
+    # fetch and parse the master while the current template is checked;
+    # returning early, or exiting, doesn't wait for the master
+    master = Background(get_master)
+
     # and check for syntax
-    current_parsed = llmessage.parseTemplateString(current.decode("utf-8"))
+    current_parsed = parse_template(current, options.parse_cache)
 
-    if options.cache_master:
-        # optionally return a url to a locally-cached master so we don't hit the network all the time
-        master_url = cache_master(master_url)
+    # and for messages that can't fit in a packet
+    if not check_sizes(current_parsed, options.sizes, options.sizes_sort):
+        print("*** FAIL ***")
+        return 1
+
+    # and for messages that message.xml routes inconsistently
+    if options.message_config and not check_message_config(
+            current_parsed, options.message_config):
+        print("*** FAIL ***")
+        return 1
 
-    def parse_master_url():
-        master = fetch(master_url).decode("utf-8")
-        return llmessage.parseTemplateString(master)
     try:
-        master_parsed = retry(3, parse_master_url)
+        master_parsed = master.result()
     except (IOError, tokenstream.ParseError) as e:
         if options.mode == 'production':
             raise e
@@ -307,9 +576,14 @@ http://wiki.secondlife.com/wiki/Template_verifier.py
             print("Syntax-checking the local template ONLY, no compatibility check is being run.")
             print("Cause: %s\n\n" % e)
             return 0
-        
+
+    report = None
+    if options.json_report or options.junit_report:
+        report = compatibility.Report(mode_acceptable(options.mode))
     acceptable, compat = compare(
-        master_parsed, current_parsed, options.mode)
+        master_parsed, current_parsed, options.mode, report)
+    if report is not None:
+        write_report(report, options.json_report, options.junit_report)
 
     def explain(header, compat):
         print(header)